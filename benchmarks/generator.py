@@ -0,0 +1,110 @@
+"""Seeded generator for synthetic graph XML.
+
+Writes graphs in the same format as the files in sample_graph_data/, so
+they pass verify_graph_data(), in a few shapes:
+
+- dag: edges only go forward, to one of the next `window` nodes. No cycles.
+- grid: a square grid with edges going right and down. Lots of paths.
+- scale_free: preferential attachment, so a few hub nodes have most of
+  the edges. Edge directions are random, so there are cycles.
+- dense: every node has `degree` edges to random nodes. Lots of cycles.
+
+$ python -m benchmarks.generator --shape dense --nodes 10000 --degree 8 --seed 1 -o dense.xml
+"""
+import argparse
+import math
+from random import Random
+from typing import Iterator, TextIO
+from xml.sax.saxutils import escape
+
+
+def dag_edges(node_count: int, rng: Random, degree: int = 3, window: int = 50) -> Iterator[tuple]:
+    for node in range(node_count - 1):
+        last = min(node + window, node_count - 1)
+        for _ in range(degree):
+            yield node, rng.randint(node + 1, last)
+
+
+def grid_edges(node_count: int, rng: Random, **_) -> Iterator[tuple]:
+    side = math.isqrt(node_count)
+    for row in range(side):
+        for column in range(side):
+            node = row * side + column
+            if column + 1 < side:
+                yield node, node + 1
+            if row + 1 < side:
+                yield node, node + side
+
+
+def scale_free_edges(node_count: int, rng: Random, degree: int = 3, **_) -> Iterator[tuple]:
+    # Each node appears in `endpoints` once per edge it has, so picking from it
+    # picks nodes in proportion to their degree
+    endpoints = [0]
+    for node in range(1, node_count):
+        for _ in range(min(degree, node)):
+            other = rng.choice(endpoints)
+            yield (node, other) if rng.random() < 0.5 else (other, node)
+            endpoints.append(other)
+            endpoints.append(node)
+
+
+def dense_edges(node_count: int, rng: Random, degree: int = 8, **_) -> Iterator[tuple]:
+    for node in range(node_count):
+        for _ in range(degree):
+            yield node, rng.randrange(node_count)
+
+
+GRAPH_SHAPES = {
+    "dag": dag_edges,
+    "grid": grid_edges,
+    "scale_free": scale_free_edges,
+    "dense": dense_edges,
+}
+
+
+def graph_node_count(shape: str, node_count: int) -> int:
+    """Grids are square, so they round down to the nearest square number of nodes."""
+    return math.isqrt(node_count) ** 2 if shape == "grid" else node_count
+
+
+def write_graph_xml(out: TextIO, shape: str, node_count: int, seed: int = 0, **options) -> dict:
+    """Write a generated graph as XML, a line at a time. Returns a summary of what was written."""
+    rng = Random(seed)
+    node_count = graph_node_count(shape, node_count)
+    graph_id = f"{shape}_{node_count}_{seed}"
+    out.write("<graph>\n")
+    out.write(f"  <id>{escape(graph_id)}</id>\n")
+    out.write(f"  <name>Synthetic {shape} graph, {node_count} nodes, seed {seed}</name>\n")
+    out.write("  <nodes>\n")
+    for node in range(node_count):
+        out.write(f"    <node><id>n{node}</id><name>Node {node}</name></node>\n")
+    out.write("  </nodes>\n")
+    out.write("  <edges>\n")
+    edge_count = 0
+    for from_node, to_node in GRAPH_SHAPES[shape](node_count, rng, **options):
+        cost = round(rng.uniform(0.1, 10.0), 2)
+        out.write(f"    <node><id>e{edge_count}</id><from>n{from_node}</from><to>n{to_node}</to>"
+                  f"<cost>{cost}</cost></node>\n")
+        edge_count += 1
+    out.write("  </edges>\n")
+    out.write("</graph>\n")
+    return {"graph_id": graph_id, "shape": shape, "nodes": node_count, "edges": edge_count, "seed": seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic graph XML file.")
+    parser.add_argument("--shape", choices=GRAPH_SHAPES, default="dag")
+    parser.add_argument("--nodes", type=int, default=1000)
+    parser.add_argument("--degree", type=int, help="Edges per node, for the dag, scale_free and dense shapes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", required=True)
+    args = parser.parse_args()
+
+    options = {"degree": args.degree} if args.degree else {}
+    with open(args.output, "w") as out:
+        summary = write_graph_xml(out, args.shape, args.nodes, args.seed, **options)
+    print(f"Wrote {summary['nodes']} nodes and {summary['edges']} edges to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
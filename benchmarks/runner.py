@@ -0,0 +1,301 @@
+"""End-to-end benchmarks for the downloader and the query service.
+
+For each shape and size, a graph is generated with benchmarks.generator,
+served over HTTP from a local server, and pushed through each phase:
+download, parse (verify + extract), streaming parse, insert, loading the
+in-memory graph, and answering queries. Queries are timed twice: straight
+against the search engine ("cheapest" and "paths"), and end to end, as a
+batch query document answered by the query service the way a client's
+would be ("query_batch", then "query_batch_repeat" for the same document
+again, which the result cache answers). The timings are written out as
+JSON, so runs can be compared between releases.
+
+Inserts and the query batch go to PostgreSQL if POSTGRES_HOST is set
+(each graph is deleted again afterwards). Otherwise they go to a stand-in
+connection which accepts the COPY data and throws it away, which still
+measures the client side of the insert, and serves the generated graph
+back to the query service when it loads it.
+
+$ python -m benchmarks.runner --shapes dag grid --sizes 1000 10000 --output bench_results.json
+"""
+import argparse
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import io
+from itertools import islice
+import json
+import multiprocessing
+import os
+import platform
+from random import Random
+import tempfile
+import threading
+import time
+
+import config
+from benchmarks.generator import GRAPH_SHAPES, write_graph_xml
+from src.db_connection.postgres import pooled_connection
+from src.downloader import setup
+from src.downloader.streaming import GraphStream
+from src.query_service import query_listener
+from src.query_service.graph_cache import CSRGraph
+from src.query_service.path_finding import find_cheapest_path, iter_all_paths
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_directory(directory: str) -> ThreadingHTTPServer:
+    """Serve files from a directory on a free local port, in a background thread."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StandInCursor:
+    """Takes the place of a psycopg2 cursor when there's no database.
+
+    Given a graph's (graph_id, name, nodes, edges), it answers the query
+    service's reads of it: its version, its nodes and its edges.
+    """
+
+    def __init__(self, graph_data=None):
+        self.graph_data = graph_data
+        self.rows = iter(())
+
+    def execute(self, sql, params=None):
+        self.rows = iter(())
+        if self.graph_data is None:
+            return
+        _, _, nodes, edges = self.graph_data
+        if "FROM public.graphs" in sql:
+            self.rows = iter([(1,)])
+        elif "FROM public.nodes" in sql:
+            self.rows = (node[:1] for node in nodes)
+        elif "FROM public.edges" in sql:
+            self.rows = (edge[1:] for edge in edges)
+
+    def fetchone(self):
+        return next(self.rows, None)
+
+    def __iter__(self):
+        return self.rows
+
+    def copy_expert(self, sql, stream, size=8192):
+        while stream.read(size):
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class StandInConnection:
+    """Takes the place of a psycopg2 connection when there's no database."""
+    closed = 0
+
+    def __init__(self, graph_data=None):
+        self.graph_data = graph_data
+
+    def cursor(self):
+        return StandInCursor(self.graph_data)
+
+    def commit(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def timed(func, *args, **kwargs):
+    start_time = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start_time
+
+
+def delete_graph(graph_id: str):
+    with pooled_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM public.graphs WHERE graph_id = %s", (graph_id,))
+
+
+def count_paths(graph: CSRGraph, pairs: list, max_paths: int) -> tuple:
+    start_time = time.perf_counter()
+    count = sum(sum(1 for _ in islice(iter_all_paths(graph, start, end), max_paths)) for start, end in pairs)
+    return count, time.perf_counter() - start_time
+
+
+def benchmark_queries(graph: CSRGraph, rng: Random, query_count: int, max_paths: int,
+                      paths_timeout: float) -> dict:
+    """Time cheapest and paths queries between random pairs of nodes.
+
+    Paths queries stop after `max_paths` paths, but a search which finds
+    nothing can still take exponential time on dense graphs. So they run
+    in a worker process, and give up after `paths_timeout` seconds.
+    """
+    pairs = [(rng.choice(graph.names), rng.choice(graph.names)) for _ in range(query_count)]
+    cheapest, cheapest_seconds = timed(lambda: [find_cheapest_path(graph, start, end) for start, end in pairs])
+    paths = {"queries": query_count, "max_paths": max_paths}
+    with multiprocessing.Pool(1) as worker:
+        try:
+            paths["paths"], paths["seconds"] = worker.apply_async(
+                count_paths, (graph, pairs, max_paths)).get(paths_timeout)
+        except multiprocessing.TimeoutError:
+            paths["seconds"] = paths_timeout
+            paths["timed_out"] = True
+    return {
+        "cheapest": {"seconds": cheapest_seconds, "queries": query_count,
+                     "found": sum(1 for result in cheapest if result)},
+        "paths": paths,
+    }
+
+
+def query_document(graph_id: str, pairs: list, max_paths: int) -> str:
+    """A query document asking for the cheapest path and up to `max_paths` paths between each pair."""
+    queries = []
+    for start, end in pairs:
+        queries.append({"cheapest": {"start": start, "end": end}})
+        queries.append({"paths": {"start": start, "end": end, "limit": max_paths}})
+    return json.dumps({"graph_id": graph_id, "queries": queries})
+
+
+def answer_twice(query_str: str, conn) -> tuple:
+    """Answer a query document from cold, then again. Runs in a worker process."""
+    query_listener.graph_cache.clear()
+    query_listener.memory_result_cache.clear()
+    response, seconds = timed(query_listener.answer_query, query_str, conn)
+    _, repeat_seconds = timed(query_listener.answer_query, query_str, conn)
+    return len(response), seconds, repeat_seconds
+
+
+def benchmark_query_batch(graph_id: str, graph: CSRGraph, rng: Random, query_count: int, max_paths: int,
+                          paths_timeout: float, conn=None) -> dict:
+    """Time a batch of queries answered end to end by the query service.
+
+    That's parsing the document, loading the graph (through `conn`, or a
+    pooled connection), planning the searches, running them, and
+    formatting the response, and then the same document again. Like the
+    paths queries, it runs in a worker process and gives up after
+    `paths_timeout` seconds.
+    """
+    pairs = [(rng.choice(graph.names), rng.choice(graph.names)) for _ in range(query_count)]
+    batch = {"queries": 2 * query_count, "max_paths": max_paths, "result_cache": config.result_cache}
+    repeat = dict(batch)
+    with multiprocessing.get_context("forkserver").Pool(1) as worker:
+        try:
+            batch["response_bytes"], batch["seconds"], repeat["seconds"] = worker.apply_async(
+                answer_twice, (query_document(graph_id, pairs, max_paths), conn)).get(paths_timeout)
+        except multiprocessing.TimeoutError:
+            for phase in (batch, repeat):
+                phase["seconds"] = paths_timeout
+                phase["timed_out"] = True
+    return {"query_batch": batch, "query_batch_repeat": repeat}
+
+
+def run_benchmark(shape: str, size: int, seed: int = 0, query_count: int = 100, max_paths: int = 1000,
+                  paths_timeout: float = 60, use_postgres: bool = False) -> dict:
+    """Generate one graph and time each phase of getting it in and querying it."""
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "graph.xml"), "w") as out:
+            summary = write_graph_xml(out, shape, size, seed)
+        file_size = os.path.getsize(os.path.join(directory, "graph.xml"))
+
+        server = serve_directory(directory)
+        original_endpoint = config.graph_data_endpoint
+        config.graph_data_endpoint = f"http://127.0.0.1:{server.server_address[1]}/graph.xml"
+        try:
+            xml_string, download_seconds = timed(setup.download_graph)
+
+            def stream_parse():
+                with setup.open_graph_stream() as stream:
+                    graph = GraphStream(stream)
+                    return sum(1 for _ in graph.nodes()) + sum(1 for _ in graph.edges())
+            streamed_rows, stream_seconds = timed(stream_parse)
+        finally:
+            config.graph_data_endpoint = original_endpoint
+            server.shutdown()
+            server.server_close()
+
+    def parse():
+        valid, root = setup.verify_graph_data(xml_string)
+        return setup.extract_graph_data(root)
+    graph_data, parse_seconds = timed(parse)
+    graph_id, _, nodes, edges = graph_data
+    row_count = len(nodes) + len(edges)
+
+    with redirect_stdout(io.StringIO()):
+        if use_postgres:
+            _, insert_seconds = timed(setup.insert_graph_data, graph_data)
+        else:
+            _, insert_seconds = timed(setup.insert_graph_data, graph_data, conn=StandInConnection())
+
+    graph, load_seconds = timed(
+        CSRGraph.from_edges, [node[0] for node in nodes], ((edge[1], edge[2], edge[3]) for edge in edges))
+
+    try:
+        query_batch = benchmark_query_batch(graph_id, graph, Random(seed + 1), query_count, max_paths, paths_timeout,
+                                            None if use_postgres else StandInConnection(graph_data))
+    finally:
+        if use_postgres:
+            delete_graph(graph_id)
+
+    return {
+        **summary,
+        "bytes": file_size,
+        "phases": {
+            "download": {"seconds": download_seconds, "bytes": file_size},
+            "parse": {"seconds": parse_seconds, "rows": row_count},
+            "stream_parse": {"seconds": stream_seconds, "rows": streamed_rows, "bytes": file_size},
+            "insert": {"seconds": insert_seconds, "rows": row_count,
+                       "backend": "postgres" if use_postgres else "stand-in"},
+            "load": {"seconds": load_seconds, "rows": len(edges)},
+            **benchmark_queries(graph, Random(seed), query_count, max_paths, paths_timeout),
+            **query_batch,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark graph ingest and queries on synthetic graphs.")
+    parser.add_argument("--shapes", nargs="+", choices=GRAPH_SHAPES, default=list(GRAPH_SHAPES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=100, help="Random node pairs to query per graph")
+    parser.add_argument("--max-paths", type=int, default=1000, help="Stop each paths query after this many")
+    parser.add_argument("--paths-timeout", type=float, default=60,
+                        help="Give up on the paths queries for a graph after this many seconds")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    use_postgres = bool(os.getenv("POSTGRES_HOST"))
+    results = []
+    for shape in args.shapes:
+        for size in args.sizes:
+            result = run_benchmark(shape, size, args.seed, args.queries, args.max_paths,
+                                   args.paths_timeout, use_postgres)
+            phases = ", ".join(f"{name} {phase['seconds']:.3f}s" + (" (timed out)" if phase.get("timed_out") else "")
+                               for name, phase in result["phases"].items())
+            print(f"{shape} {result['nodes']} nodes/{result['edges']} edges: {phases}", flush=True)
+            results.append(result)
+
+    with open(args.output, "w") as out:
+        json.dump({
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "seed": args.seed,
+            "results": results,
+        }, out, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+-- Compares the stack-pointer versions of find_all_paths() and find_cycles()
+-- with the original array_remove() based ones, on the sample graph, some small
+-- synthetic graphs, and synthetic graphs of thousands of nodes. Every timing is
+-- its own statement, and gives up after statement_timeout (set below), so the
+-- legacy functions can't hang the run: those show up as "timed out". Everything
+-- happens in a transaction which is rolled back at the end, so it leaves the
+-- database as it found it.
+--
+-- $ docker exec -i postgres psql -U postgres -d graphs < benchmarks/sql/traversal.sql
+
+BEGIN;
+
+-- The original functions, for comparison
+CREATE FUNCTION find_all_paths_legacy(
+    start_node character varying,
+    end_node character varying,
+    curr_graph_id varchar(64)
+)
+RETURNS TABLE(path text[], total_cost double precision) AS
+$$
+DECLARE
+    stack stack_item[] = '{}';
+    stack_item stack_item;
+    current_node character varying;
+    path text[] = '{}';
+    next_node character varying;
+    edge_cost double precision;
+    total_cost double precision = 0;
+BEGIN
+    stack = stack || (ROW(start_node, ARRAY[start_node], 0)::stack_item);
+    WHILE array_length(stack, 1) > 0 LOOP
+        stack_item = stack[array_upper(stack, 1)];
+        stack = array_remove(stack, stack_item);
+        current_node = stack_item.current_node;
+        path = stack_item.path;
+        total_cost = stack_item.total_cost;
+        IF current_node = end_node THEN
+            RETURN QUERY SELECT path, total_cost;
+        END IF;
+        FOR next_node, edge_cost IN
+            SELECT to_node, cost FROM edges
+            WHERE from_node = current_node AND graph_id = curr_graph_id
+        LOOP
+            IF next_node = ANY(path) THEN
+                CONTINUE;
+            END IF;
+            stack = stack || (ROW(next_node, path || next_node, total_cost + edge_cost)::stack_item);
+        END LOOP;
+    END LOOP;
+    RETURN;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION find_cycles_legacy(curr_graph_id varchar(64))
+RETURNS TABLE(cycle_path text[]) AS
+$$
+DECLARE
+    stack stack_item[] = '{}';
+    stack_item stack_item;
+    current_node character varying;
+    path text[] = '{}';
+    next_node character varying;
+    cycle_start character varying;
+BEGIN
+    FOR current_node IN
+        SELECT node_id FROM nodes WHERE graph_id = curr_graph_id ORDER BY node_id
+    LOOP
+        stack = stack || (ROW(current_node, ARRAY[current_node], 0.0)::stack_item);
+    END LOOP;
+    WHILE array_length(stack, 1) > 0 LOOP
+        stack_item = stack[array_upper(stack, 1)];
+        stack = array_remove(stack, stack_item);
+        current_node = stack_item.current_node;
+        path = stack_item.path;
+        FOR next_node IN
+            SELECT to_node FROM edges WHERE from_node = current_node AND graph_id = curr_graph_id
+        LOOP
+            IF next_node = ANY(path) THEN
+                WHILE path[1] != next_node LOOP
+                    path = path[2:];
+                END LOOP;
+                SELECT min(node) FROM unnest(path) AS node
+                    INTO cycle_start;
+                WHILE path[1] != cycle_start LOOP
+                    path = path[2:] || path[1];
+                END LOOP;
+                RETURN QUERY SELECT path;
+            ELSE
+                stack = stack || (ROW(next_node, path || next_node, 0.0)::stack_item);
+            END IF;
+        END LOOP;
+    END LOOP;
+    RETURN;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Runs a query `runs` times, and returns the average time in milliseconds,
+-- or NULL if the statement timed out first
+CREATE FUNCTION bench_ms(query text, runs integer DEFAULT 3)
+RETURNS numeric AS
+$$
+DECLARE
+    started timestamptz;
+BEGIN
+    started = clock_timestamp();
+    FOR i IN 1..runs LOOP
+        EXECUTE 'SELECT count(*) FROM (' || query || ') AS results';
+    END LOOP;
+    RETURN round((extract(epoch FROM clock_timestamp() - started) * 1000 / runs)::numeric, 2);
+EXCEPTION WHEN query_canceled THEN
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TEMPORARY TABLE bench_results (
+    run_order serial,
+    benchmark text,
+    version text,
+    ms numeric
+) ON COMMIT DROP;
+
+-- Times one version of one benchmark, as a statement of its own so it gets the whole timeout
+CREATE FUNCTION bench(benchmark text, version text, query text, runs integer DEFAULT 3)
+RETURNS void AS
+$$
+    INSERT INTO bench_results (benchmark, version, ms) VALUES (benchmark, version, bench_ms(query, runs));
+$$ LANGUAGE sql;
+
+-- Synthetic graphs
+INSERT INTO graphs (graph_id, name) VALUES
+    ('bench_g13', 'Sample graph with multiple paths and cycles'),
+    ('bench_ladder', 'Ladder: i -> i+1 and i -> i+2, Fibonacci many paths'),
+    ('bench_grid', 'Grid: right and down edges'),
+    ('bench_ring', 'Ring with chords, for cycles'),
+    ('bench_long_ladder', 'Chain of 2,000 nodes, with a shortcut every 200: 1,024 long paths'),
+    ('bench_grid_large', 'Grid of 3,600 nodes: right and down edges'),
+    ('bench_rings', '500 separate rings of 4 nodes, for cycles');
+
+INSERT INTO nodes (node_id, name, graph_id)
+SELECT n, n, 'bench_g13' FROM unnest(ARRAY['a', 'b', 'c', 'd', 'e']) AS n;
+INSERT INTO edges (edge_id, from_node, to_node, cost, graph_id) VALUES
+    ('e1', 'a', 'b', 1, 'bench_g13'), ('e2', 'b', 'c', 1, 'bench_g13'),
+    ('e3', 'a', 'd', 1.5, 'bench_g13'), ('e4', 'd', 'e', 0.5, 'bench_g13'),
+    ('e5', 'e', 'c', 0.5, 'bench_g13'), ('e6', 'd', 'c', 1, 'bench_g13'),
+    ('e7', 'c', 'a', 1.25, 'bench_g13'), ('e8', 'b', 'b', 0.25, 'bench_g13');
+
+INSERT INTO nodes (node_id, name, graph_id)
+SELECT 'n' || i, 'n' || i, 'bench_ladder' FROM generate_series(0, 20) AS i;
+INSERT INTO edges (edge_id, from_node, to_node, cost, graph_id)
+SELECT 'e' || i || '_' || step, 'n' || i, 'n' || (i + step), step, 'bench_ladder'
+FROM generate_series(0, 20) AS i, generate_series(1, 2) AS step
+WHERE i + step <= 20;
+
+INSERT INTO nodes (node_id, name, graph_id)
+SELECT x || '_' || y, x || '_' || y, 'bench_grid' FROM generate_series(0, 6) AS x, generate_series(0, 6) AS y;
+INSERT INTO edges (edge_id, from_node, to_node, cost, graph_id)
+SELECT 'r' || x || '_' || y, x || '_' || y, (x + 1) || '_' || y, 1, 'bench_grid'
+FROM generate_series(0, 5) AS x, generate_series(0, 6) AS y
+UNION ALL
+SELECT 'd' || x || '_' || y, x || '_' || y, x || '_' || (y + 1), 1, 'bench_grid'
+FROM generate_series(0, 6) AS x, generate_series(0, 5) AS y;
+
+INSERT INTO nodes (node_id, name, graph_id)
+SELECT 'n' || i, 'n' || i, 'bench_ring' FROM generate_series(0, 59) AS i;
+INSERT INTO edges (edge_id, from_node, to_node, cost, graph_id)
+SELECT 'e' || i, 'n' || i, 'n' || ((i + 1) % 60), 1, 'bench_ring' FROM generate_series(0, 59) AS i
+UNION ALL
+SELECT 'c' || i, 'n' || i, 'n' || ((i + 7) % 60), 1, 'bench_ring' FROM generate_series(0, 59, 10) AS i;
+
+INSERT INTO nodes (node_id, name, graph_id)
+SELECT 'n' || i, 'n' || i, 'bench_long_ladder' FROM generate_series(0, 1999) AS i;
+INSERT INTO edges (edge_id, from_node, to_node, cost, graph_id)
+SELECT 'e' || i, 'n' || i, 'n' || (i + 1), 1, 'bench_long_ladder' FROM generate_series(0, 1998) AS i
+UNION ALL
+SELECT 's' || i, 'n' || i, 'n' || (i + 2), 2, 'bench_long_ladder' FROM generate_series(0, 1997, 200) AS i;
+
+INSERT INTO nodes (node_id, name, graph_id)
+SELECT x || '_' || y, x || '_' || y, 'bench_grid_large' FROM generate_series(0, 59) AS x, generate_series(0, 59) AS y;
+INSERT INTO edges (edge_id, from_node, to_node, cost, graph_id)
+SELECT 'r' || x || '_' || y, x || '_' || y, (x + 1) || '_' || y, 1, 'bench_grid_large'
+FROM generate_series(0, 58) AS x, generate_series(0, 59) AS y
+UNION ALL
+SELECT 'd' || x || '_' || y, x || '_' || y, x || '_' || (y + 1), 1, 'bench_grid_large'
+FROM generate_series(0, 59) AS x, generate_series(0, 58) AS y;
+
+INSERT INTO nodes (node_id, name, graph_id)
+SELECT 'r' || r || '_' || k, 'r' || r || '_' || k, 'bench_rings'
+FROM generate_series(0, 499) AS r, generate_series(0, 3) AS k;
+INSERT INTO edges (edge_id, from_node, to_node, cost, graph_id)
+SELECT 'e' || r || '_' || k, 'r' || r || '_' || k, 'r' || r || '_' || ((k + 1) % 4), 1, 'bench_rings'
+FROM generate_series(0, 499) AS r, generate_series(0, 3) AS k;
+
+ANALYZE nodes;
+ANALYZE edges;
+
+-- Both versions have to agree before the timings mean anything
+DO
+$$
+BEGIN
+    IF EXISTS (
+        (SELECT * FROM find_all_paths('n0', 'n20', 'bench_ladder')
+         EXCEPT SELECT * FROM find_all_paths_legacy('n0', 'n20', 'bench_ladder'))
+        UNION ALL
+        (SELECT * FROM find_all_paths_legacy('0_0', '6_6', 'bench_grid')
+         EXCEPT SELECT * FROM find_all_paths('0_0', '6_6', 'bench_grid'))
+        UNION ALL
+        (SELECT * FROM find_all_paths_legacy('0_0', '3_3', 'bench_grid')
+         EXCEPT SELECT * FROM find_all_paths('0_0', '3_3', 'bench_grid'))
+    ) THEN
+        RAISE EXCEPTION 'find_all_paths() and find_all_paths_legacy() disagree';
+    END IF;
+END;
+$$;
+
+-- How long any one timing may take. Raise it to see how long the legacy functions really take.
+SET LOCAL statement_timeout = '30s';
+
+SELECT bench('paths g13 a->c', 'legacy', $q$SELECT * FROM find_all_paths_legacy('a', 'c', 'bench_g13')$q$, 20);
+SELECT bench('paths g13 a->c', 'current', $q$SELECT * FROM find_all_paths('a', 'c', 'bench_g13')$q$, 20);
+SELECT bench('paths ladder n0->n20 (10946 paths)', 'legacy',
+             $q$SELECT * FROM find_all_paths_legacy('n0', 'n20', 'bench_ladder')$q$);
+SELECT bench('paths ladder n0->n20 (10946 paths)', 'current',
+             $q$SELECT * FROM find_all_paths('n0', 'n20', 'bench_ladder')$q$);
+SELECT bench('paths grid 0_0->6_6 (924 paths)', 'legacy',
+             $q$SELECT * FROM find_all_paths_legacy('0_0', '6_6', 'bench_grid')$q$);
+SELECT bench('paths grid 0_0->6_6 (924 paths)', 'current',
+             $q$SELECT * FROM find_all_paths('0_0', '6_6', 'bench_grid')$q$);
+-- Most of the grid is past 3_3, where the pruned search never goes
+SELECT bench('paths grid 0_0->3_3 (20 paths)', 'legacy',
+             $q$SELECT * FROM find_all_paths_legacy('0_0', '3_3', 'bench_grid')$q$);
+SELECT bench('paths grid 0_0->3_3 (20 paths)', 'current',
+             $q$SELECT * FROM find_all_paths('0_0', '3_3', 'bench_grid')$q$);
+-- Paths 2,000 nodes long, which the legacy version copies on every push
+SELECT bench('paths long ladder n0->n1999 (2000 nodes, 1024 paths)', 'legacy',
+             $q$SELECT * FROM find_all_paths_legacy('n0', 'n1999', 'bench_long_ladder')$q$, 1);
+SELECT bench('paths long ladder n0->n1999 (2000 nodes, 1024 paths)', 'current',
+             $q$SELECT * FROM find_all_paths('n0', 'n1999', 'bench_long_ladder')$q$, 1);
+-- The legacy version walks every path out of 0_0, across the whole grid
+SELECT bench('paths large grid 0_0->3_3 (3600 nodes, 20 paths)', 'legacy',
+             $q$SELECT * FROM find_all_paths_legacy('0_0', '3_3', 'bench_grid_large')$q$, 1);
+SELECT bench('paths large grid 0_0->3_3 (3600 nodes, 20 paths)', 'current',
+             $q$SELECT * FROM find_all_paths('0_0', '3_3', 'bench_grid_large')$q$, 1);
+SELECT bench('cycles g13', 'legacy', $q$SELECT * FROM find_cycles_legacy('bench_g13')$q$, 20);
+SELECT bench('cycles g13', 'current', $q$SELECT * FROM find_cycles('bench_g13')$q$, 20);
+SELECT bench('cycles ring', 'legacy', $q$SELECT * FROM find_cycles_legacy('bench_ring')$q$);
+SELECT bench('cycles ring', 'current', $q$SELECT * FROM find_cycles('bench_ring')$q$);
+-- The legacy version starts with all 2,000 nodes on its stack, and array_remove() scans it on every pop
+SELECT bench('cycles 500 rings (2000 nodes, 500 cycles)', 'legacy',
+             $q$SELECT * FROM find_cycles_legacy('bench_rings')$q$, 1);
+SELECT bench('cycles 500 rings (2000 nodes, 500 cycles)', 'current',
+             $q$SELECT * FROM find_cycles('bench_rings')$q$, 1);
+
+RESET statement_timeout;
+
+SELECT legacy.benchmark,
+       coalesce(legacy.ms::text, 'timed out') AS legacy_ms,
+       coalesce(current.ms::text, 'timed out') AS current_ms,
+       CASE
+           WHEN legacy.ms IS NULL AND current.ms IS NOT NULL THEN 'legacy timed out'
+           ELSE round(legacy.ms / nullif(current.ms, 0), 1)::text
+       END AS speed_up
+FROM bench_results AS legacy
+JOIN bench_results AS current ON current.benchmark = legacy.benchmark AND current.version = 'current'
+WHERE legacy.version = 'legacy'
+ORDER BY legacy.run_order;
+
+ROLLBACK;
@@ -2,3 +2,84 @@ import os
 
 # Endpoint is set in compose.yaml. The default value is used for unit test patching.
 graph_data_endpoint = os.getenv("GRAPH_DATA_ENDPOINT", "http://default.endpoint")
+
+# To ingest many graphs at once, list their endpoints in GRAPH_DATA_ENDPOINTS (separated
+# by commas or whitespace), or in a GRAPH_DATA_MANIFEST file with one per line. Downloads,
+# parsing (in worker processes, defaulting to one per CPU) and inserts each get a pool
+# of workers.
+graph_data_endpoints = os.getenv("GRAPH_DATA_ENDPOINTS", "").replace(",", " ").split()
+graph_data_manifest = os.getenv("GRAPH_DATA_MANIFEST", "")
+ingest_download_workers = int(os.getenv("INGEST_DOWNLOAD_WORKERS", "8"))
+ingest_parse_workers = int(os.getenv("INGEST_PARSE_WORKERS", "0"))
+ingest_insert_workers = int(os.getenv("INGEST_INSERT_WORKERS", "4"))
+
+# Bulk insert tuning for the downloader. INSERT_METHOD is "copy" (COPY FROM STDIN)
+# or "values" (batched multi-row INSERTs).
+insert_method = os.getenv("INSERT_METHOD", "copy")
+insert_batch_size = int(os.getenv("INSERT_BATCH_SIZE", "10000"))
+
+# When a graph that's already stored is ingested again, update it in place with only
+# the differences, instead of refusing to go any further.
+delta_ingest = os.getenv("DELTA_INGEST", "false").lower() in ("1", "true", "yes")
+
+# Stream the download straight into the XML parser and bulk loader, instead of
+# downloading, parsing and inserting the whole document in separate steps.
+stream_ingest = os.getenv("STREAM_INGEST", "false").lower() in ("1", "true", "yes")
+download_chunk_size = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+# Ingest instrumentation. Each phase of set_up_graph_data() is logged to stderr as a
+# JSON line. INGEST_METRICS_FILE also writes them in Prometheus' text format, and
+# INGEST_TRACE_MEMORY records each phase's peak memory (tracemalloc slows things down).
+ingest_metrics = os.getenv("INGEST_METRICS", "true").lower() in ("1", "true", "yes")
+ingest_metrics_file = os.getenv("INGEST_METRICS_FILE", "")
+ingest_trace_memory = os.getenv("INGEST_TRACE_MEMORY", "false").lower() in ("1", "true", "yes")
+
+# Where graph snapshots are kept: compact binary copies of each graph, written at the end
+# of an ingest, which the query service memory-maps instead of reading the graph out of
+# Postgres. Leave it empty to turn snapshots off.
+graph_snapshot_dir = os.getenv("GRAPH_SNAPSHOT_DIR", "")
+# Also build a reachability index beside each snapshot, so the query service can tell
+# whether there's any path between two nodes with a single lookup, and never searches
+# down dead ends. Its size grows with the square of the number of strongly connected
+# components, so it's skipped for graphs where it would be bigger than the limit.
+reachability_index = os.getenv("REACHABILITY_INDEX", "false").lower() in ("1", "true", "yes")
+reachability_index_max_bytes = int(os.getenv("REACHABILITY_INDEX_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# The graph queries go to when they don't name one with "graph_id". If it's not set,
+# the query service uses the graph setup last inserted.
+default_graph_id = os.getenv("GRAPH_ID", "")
+# The graph setup last inserted in this process, so a query server started alongside it
+# (see manager.py) doesn't have to read graph_id.txt for every query. Not a setting.
+last_ingested_graph_id = ""
+
+# Where the query service finds paths. "memory" loads each graph once into an
+# in-process cache and searches it in Python, "database" calls the PL/pgSQL
+# functions for every query.
+query_engine = os.getenv("QUERY_ENGINE", "memory")
+# With the memory engine, share each batch's searches out between this many worker
+# processes, to use more than one core. 0 or 1 searches in the query's own process.
+query_processes = int(os.getenv("QUERY_PROCESSES", "0"))
+
+# Remember answers to queries, so repeats skip the search. "memory" keeps them in the
+# query server's process, "database" in an UNLOGGED table (for one-off query_listener.py
+# runs), and "off" turns it off. Least recently used answers are dropped to stay
+# under RESULT_CACHE_MAX_BYTES.
+result_cache = os.getenv("RESULT_CACHE", "memory")
+result_cache_max_bytes = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# How query responses are sent by default: "json" is one pretty-printed document once
+# everything's answered, "ndjson" is one compact answer per line as each is ready.
+# Clients can choose per request with "format" in the query document.
+response_format = os.getenv("RESPONSE_FORMAT", "json")
+# Rows fetched per round trip when streamed paths are read from a server-side cursor.
+query_fetch_size = int(os.getenv("QUERY_FETCH_SIZE", "2000"))
+
+# Where the long-running query server listens. See src/query_service/query_server.py.
+query_server_host = os.getenv("QUERY_SERVER_HOST", "0.0.0.0")
+query_server_port = int(os.getenv("QUERY_SERVER_PORT", "7878"))
+# How many queries the query server works on at once. Each may hold a pooled DB
+# connection, so keep it no bigger than POSTGRES_POOL_MAX.
+query_server_workers = int(os.getenv("QUERY_SERVER_WORKERS", "8"))
+# The biggest query document the query server will read. Bigger ones are turned away,
+# so a client can't have it buffer forever.
+query_server_max_request_bytes = int(os.getenv("QUERY_SERVER_MAX_REQUEST_BYTES", str(16 * 1024 * 1024)))
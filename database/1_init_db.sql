@@ -1,14 +1,20 @@
 -- \c graphs;
 
+CREATE SEQUENCE public.graph_version_seq;
+COMMENT ON SEQUENCE public.graph_version_seq IS 'Source of graph version stamps.';
+
+
 CREATE TABLE public.graphs
 (
     graph_id character varying(64) NOT NULL,
     name character varying(255) NOT NULL,
+    version bigint NOT NULL DEFAULT nextval('public.graph_version_seq'),
     PRIMARY KEY (graph_id)
 );
 COMMENT ON TABLE public.graphs IS 'Holds a reference for each graph.';
 COMMENT ON COLUMN public.graphs.graph_id IS 'The unique identifier for the graph.';
 COMMENT ON COLUMN public.graphs.name IS 'The name of the graph.';
+COMMENT ON COLUMN public.graphs.version IS 'Changes whenever the graph is (re)inserted or updated, so caches know to reload it.';
 
 
 CREATE TABLE public.nodes
@@ -56,3 +62,21 @@ COMMENT ON COLUMN public.edges.from_node IS 'The node the edge starts from.';
 COMMENT ON COLUMN public.edges.to_node IS 'The node the edge ends at.';
 COMMENT ON COLUMN public.edges.cost IS 'The cost of traversing the edge.';
 COMMENT ON COLUMN public.edges.graph_id IS 'The graph the edge belongs to.';
+
+
+-- Path and cycle finding look up a node's outgoing edges over and over, with
+-- WHERE graph_id = ... AND from_node = .... Without an index that's a sequential
+-- scan of every edge in every graph. Including to_node and cost means the
+-- lookup can be answered from the index alone.
+CREATE INDEX edges_from_node_idx ON public.edges (graph_id, from_node) INCLUDE (to_node, cost);
+COMMENT ON INDEX public.edges_from_node_idx IS 'Index-only lookup of the edges leaving a node.';
+
+-- find_all_paths() first works backwards from the end node, to find every node
+-- which can reach it, so it needs the edges coming into a node as well.
+CREATE INDEX edges_to_node_idx ON public.edges (graph_id, to_node) INCLUDE (from_node);
+COMMENT ON INDEX public.edges_to_node_idx IS 'Index-only lookup of the edges coming into a node.';
+
+-- The nodes primary key starts with node_id, so it can't help with
+-- WHERE graph_id = ..., which we use to load or walk a whole graph.
+CREATE INDEX nodes_graph_id_idx ON public.nodes (graph_id, node_id);
+COMMENT ON INDEX public.nodes_graph_id_idx IS 'Lookup of all the nodes in a graph.';
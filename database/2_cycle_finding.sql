@@ -1,3 +1,4 @@
+-- Not used by the functions below any more, but kept for anything that was built on it.
 CREATE TYPE stack_item AS (
     current_node character varying,
     path text[],
@@ -8,49 +9,53 @@ CREATE OR REPLACE FUNCTION find_cycles(curr_graph_id varchar(64))
 RETURNS TABLE(cycle_path text[]) AS
 $$
 DECLARE
-    stack stack_item[] = '{}';
-    stack_item stack_item;
+    -- The stack is kept in parallel arrays, with stack_top pointing at the top
+    -- entry, and a single path is shared by every entry. See find_all_paths()
+    -- in 3_path_finding.sql for how that works.
+    stack_node text[] = '{}';
+    stack_depth integer[] = '{}';
+    stack_top integer = 0;
+    current_path text[] = '{}';
     current_node character varying;
-    path text[] = '{}';
+    current_depth integer;
     next_node character varying;
-    cycle_start character varying;
+    cycle text[];
+    cycle_start_index integer;
 BEGIN
     FOR current_node IN
         SELECT node_id FROM nodes WHERE graph_id = curr_graph_id ORDER BY node_id
     LOOP
-        stack = stack || (ROW(current_node, ARRAY[current_node], 0.0)::stack_item);
+        stack_top = stack_top + 1;
+        stack_node[stack_top] = current_node;
+        stack_depth[stack_top] = 1;
     END LOOP;
 
-    WHILE array_length(stack, 1) > 0 LOOP
+    WHILE stack_top > 0 LOOP
         -- Pop the top element from the stack
-        stack_item = stack[array_upper(stack, 1)];
-        stack = array_remove(stack, stack_item);
-        current_node = stack_item.current_node;
-        path = stack_item.path;
+        current_node = stack_node[stack_top];
+        current_depth = stack_depth[stack_top];
+        stack_top = stack_top - 1;
+        current_path[current_depth] = current_node;
 
         -- Explore neighbours of the current node
         FOR next_node IN
             SELECT to_node FROM edges WHERE from_node = current_node AND graph_id = curr_graph_id
         LOOP
             -- Check if we've seen this node in the current path
-            IF next_node = ANY(path) THEN
+            cycle_start_index = array_position(current_path[1:current_depth], next_node::text);
+            IF cycle_start_index IS NOT NULL THEN
                 -- Remove the nodes from before the cycle started
-                WHILE path[1] != next_node LOOP
-                    path = path[2:];
-                END LOOP;
+                cycle = current_path[cycle_start_index:current_depth];
                 -- Rotate the cycle to start from the lexicographically smallest node
-                -- Get the smallest node id in the cycle
-                SELECT min(node) FROM unnest(path) AS node
-                    INTO cycle_start;
-                -- Move first node to the end of the path array until cycle_start is at the beginning
-                WHILE path[1] != cycle_start LOOP
-                    path = path[2:] || path[1];
-                END LOOP;
-                -- Return the sorted path
-                RETURN QUERY SELECT path;
+                SELECT position FROM unnest(cycle) WITH ORDINALITY AS cycle_node(node_id, position)
+                    ORDER BY node_id LIMIT 1
+                    INTO cycle_start_index;
+                RETURN QUERY SELECT cycle[cycle_start_index:] || cycle[:cycle_start_index - 1];
             ELSE
-                -- Push the next node onto the stack with the updated path
-                stack = stack || (ROW(next_node, path || next_node, 0.0)::stack_item);
+                -- Push the next node onto the stack, one step deeper
+                stack_top = stack_top + 1;
+                stack_node[stack_top] = next_node;
+                stack_depth[stack_top] = current_depth + 1;
             END IF;
         END LOOP;
     END LOOP;
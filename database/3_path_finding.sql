@@ -6,43 +6,82 @@ CREATE OR REPLACE FUNCTION find_all_paths(
 RETURNS TABLE(path text[], total_cost double precision) AS
 $$
 DECLARE
-    stack stack_item[] = '{}';  -- Array to store the stack. stack_item type defined in 2_cycle_finding.sql
-    stack_item stack_item;
+    -- The stack is kept in three parallel arrays, with stack_top pointing at the
+    -- top entry. Pushing and popping just move the pointer, and assigning past
+    -- the end of an array grows it, so neither has to copy the stack.
+    stack_node text[] = '{}';
+    stack_depth integer[] = '{}';
+    stack_cost double precision[] = '{}';
+    stack_top integer = 0;
+    -- Rather than a copy of the path on every stack entry, we keep a single
+    -- path. An entry's depth is its position in the path, so popping it
+    -- overwrites whatever a previously explored branch left there.
+    current_path text[] = '{}';
     current_node character varying;
-    path text[] = '{}';
+    current_depth integer;
+    current_cost double precision;
     next_node character varying;
     edge_cost double precision;
-    total_cost double precision = 0;
+    -- Every node which can reach the end node, as the keys of a jsonb object, so
+    -- checking one is a binary search rather than a scan
+    reaching_nodes jsonb;
 BEGIN
+    -- Work backwards from the end node to find every node which can reach it.
+    -- UNION (rather than UNION ALL) drops nodes we've already found, so this
+    -- stops even if the graph has cycles.
+    WITH RECURSIVE reaching(node_id) AS (
+        SELECT end_node::text
+        UNION
+        SELECT edges.from_node::text
+        FROM reaching
+        JOIN edges ON edges.to_node = reaching.node_id AND edges.graph_id = curr_graph_id
+    )
+    SELECT jsonb_object_agg(node_id, true) INTO reaching_nodes FROM reaching;
+
+    -- If the start node can't reach the end node, there's nothing to find
+    IF NOT reaching_nodes ? start_node THEN
+        RETURN;
+    END IF;
+
     -- Initialize the stack with the starting node and zero cost
-    stack = stack || (ROW(start_node, ARRAY[start_node], 0)::stack_item);
+    stack_top = 1;
+    stack_node[1] = start_node;
+    stack_depth[1] = 1;
+    stack_cost[1] = 0;
 
     -- Iterate while the stack is not empty
-    WHILE array_length(stack, 1) > 0 LOOP
+    WHILE stack_top > 0 LOOP
         -- Pop the top element from the stack
-        stack_item = stack[array_upper(stack, 1)];
-        stack = array_remove(stack, stack_item);
-        current_node = stack_item.current_node;
-        path = stack_item.path;
-        total_cost = stack_item.total_cost;
+        current_node = stack_node[stack_top];
+        current_depth = stack_depth[stack_top];
+        current_cost = stack_cost[stack_top];
+        stack_top = stack_top - 1;
+        current_path[current_depth] = current_node;
 
-        -- If we've reached the end node, return the current path and total cost
+        -- If we've reached the end node, return the current path and total cost.
+        -- Going any further can't bring us back to the end node without a cycle.
         IF current_node = end_node THEN
-            RETURN QUERY SELECT path, total_cost;
+            RETURN QUERY SELECT current_path[1:current_depth], current_cost;
+            CONTINUE;
         END IF;
 
-        -- Explore neighbours of the current node
+        -- Explore neighbours of the current node, skipping any which can't reach
+        -- the end node, so we never search down a dead end
         FOR next_node, edge_cost IN
             SELECT to_node, cost FROM edges
             WHERE from_node = current_node AND graph_id = curr_graph_id
+            AND reaching_nodes ? to_node
         LOOP
             -- Check if we've seen this node in the current path
-            IF next_node = ANY(path) THEN
+            IF next_node = ANY(current_path[1:current_depth]) THEN
                 CONTINUE;  -- Skip this node to avoid cycles
             END IF;
 
-            -- Push the next node onto the stack with the updated path and total cost
-            stack = stack || (ROW(next_node, path || next_node, total_cost + edge_cost)::stack_item);
+            -- Push the next node onto the stack, one step deeper, with the updated total cost
+            stack_top = stack_top + 1;
+            stack_node[stack_top] = next_node;
+            stack_depth[stack_top] = current_depth + 1;
+            stack_cost[stack_top] = current_cost + edge_cost;
         END LOOP;
     END LOOP;
 
@@ -57,3 +96,4 @@ $$ LANGUAGE plpgsql;
 -- SELECT * FROM find_all_paths('a', 'c', 'g13')
 -- ORDER BY total_cost ASC
 -- LIMIT 1;
+-- (or better, use find_cheapest_path() from 4_cheapest_path.sql)
@@ -0,0 +1,151 @@
+CREATE OR REPLACE FUNCTION find_cheapest_path(
+    start_node character varying,
+    end_node character varying,
+    curr_graph_id varchar(64)
+)
+RETURNS TABLE(path text[], total_cost double precision) AS
+$$
+DECLARE
+    -- Nodes are numbered in the order we come across them, so we never have to read
+    -- every node in the graph up front: node_names[i] is node i's id, and i is its
+    -- index in the arrays below. To find a node's number from its id, there's a hash
+    -- table of node numbers in slot_node, with open addressing, which is doubled
+    -- whenever it gets half full. (A jsonb map would be copied on every insert.)
+    node_names text[] = '{}';
+    node_count integer;
+    slot_node integer[];
+    slot_mask integer = 63;
+    slot integer;
+    node integer;
+    best_cost double precision[] = '{}';  -- Cheapest cost found so far to each node
+    previous integer[] = '{}';  -- The node before each node on its cheapest path
+    done boolean[] = '{}';  -- Whether we've found the cheapest path to each node
+    heap_cost double precision[] = '{}';  -- Binary min-heap of (cost, node index) pairs,
+    heap_node integer[] = '{}';           -- stored in two parallel arrays
+    heap_size integer = 0;
+    end_index integer;
+    current_index integer;
+    current_cost double precision;
+    next_index integer;
+    next_node character varying;
+    edge_cost double precision;
+    i integer;
+    child integer;
+    parent integer;
+    swap_cost double precision;
+    swap_node integer;
+BEGIN
+    -- Same as find_all_paths(), a node is reachable from itself for free
+    IF start_node = end_node THEN
+        RETURN QUERY SELECT ARRAY[start_node]::text[], 0::double precision;
+        RETURN;
+    END IF;
+
+    -- The start node is node 1. If it isn't in the graph, it has no edges, so we find no path.
+    node_names[1] = start_node;
+    node_count = 1;
+    slot_node = array_fill(NULL::integer, ARRAY[slot_mask + 1]);
+    slot_node[(hashtext(start_node) & slot_mask) + 1] = 1;
+    best_cost[1] = 0;
+    done[1] = false;
+    heap_size = 1;
+    heap_cost[1] = 0;
+    heap_node[1] = 1;
+
+    WHILE heap_size > 0 LOOP
+        -- Pop the cheapest entry: take the root, move the last entry there, and sift it down
+        current_cost = heap_cost[1];
+        current_index = heap_node[1];
+        heap_cost[1] = heap_cost[heap_size];
+        heap_node[1] = heap_node[heap_size];
+        heap_size = heap_size - 1;
+        i = 1;
+        LOOP
+            child = 2 * i;
+            EXIT WHEN child > heap_size;
+            IF child < heap_size AND heap_cost[child + 1] < heap_cost[child] THEN
+                child = child + 1;
+            END IF;
+            EXIT WHEN heap_cost[i] <= heap_cost[child];
+            swap_cost = heap_cost[i]; heap_cost[i] = heap_cost[child]; heap_cost[child] = swap_cost;
+            swap_node = heap_node[i]; heap_node[i] = heap_node[child]; heap_node[child] = swap_node;
+            i = child;
+        END LOOP;
+
+        -- A stale heap entry, we've already found a cheaper way here
+        CONTINUE WHEN done[current_index];
+        done[current_index] = true;
+        -- The first time we pop the end node, we've got its cheapest path
+        IF node_names[current_index] = end_node THEN
+            end_index = current_index;
+            EXIT;
+        END IF;
+
+        FOR next_node, edge_cost IN
+            SELECT to_node, cost FROM edges
+            WHERE from_node = node_names[current_index] AND graph_id = curr_graph_id
+        LOOP
+            -- Look up the node's number, or give it the next one if it's new
+            slot = hashtext(next_node) & slot_mask;
+            LOOP
+                next_index = slot_node[slot + 1];
+                EXIT WHEN next_index IS NULL OR node_names[next_index] = next_node;
+                slot = (slot + 1) & slot_mask;
+            END LOOP;
+            IF next_index IS NULL THEN
+                node_count = node_count + 1;
+                next_index = node_count;
+                node_names[next_index] = next_node;
+                done[next_index] = false;
+                slot_node[slot + 1] = next_index;
+                IF 2 * node_count > slot_mask THEN
+                    -- Half full, so double the table and put every node back in it
+                    slot_mask = 2 * slot_mask + 1;
+                    slot_node = array_fill(NULL::integer, ARRAY[slot_mask + 1]);
+                    FOR node IN 1..node_count LOOP
+                        slot = hashtext(node_names[node]) & slot_mask;
+                        WHILE slot_node[slot + 1] IS NOT NULL LOOP
+                            slot = (slot + 1) & slot_mask;
+                        END LOOP;
+                        slot_node[slot + 1] = node;
+                    END LOOP;
+                END IF;
+            END IF;
+            CONTINUE WHEN done[next_index];
+            CONTINUE WHEN best_cost[next_index] <= current_cost + edge_cost;
+            best_cost[next_index] = current_cost + edge_cost;
+            previous[next_index] = current_index;
+
+            -- Push: add to the end of the heap and sift it up
+            heap_size = heap_size + 1;
+            heap_cost[heap_size] = best_cost[next_index];
+            heap_node[heap_size] = next_index;
+            i = heap_size;
+            WHILE i > 1 LOOP
+                parent = i / 2;
+                EXIT WHEN heap_cost[parent] <= heap_cost[i];
+                swap_cost = heap_cost[i]; heap_cost[i] = heap_cost[parent]; heap_cost[parent] = swap_cost;
+                swap_node = heap_node[i]; heap_node[i] = heap_node[parent]; heap_node[parent] = swap_node;
+                i = parent;
+            END LOOP;
+        END LOOP;
+    END LOOP;
+
+    IF end_index IS NULL THEN
+        RETURN;  -- No path
+    END IF;
+
+    -- Follow the previous links back to the start
+    path = ARRAY[end_node]::text[];
+    i = end_index;
+    WHILE previous[i] IS NOT NULL LOOP
+        i = previous[i];
+        path = node_names[i] || path;
+    END LOOP;
+    total_cost = best_cost[end_index];
+    RETURN NEXT;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Usage:
+-- SELECT * FROM find_cheapest_path('a', 'c', 'g13');
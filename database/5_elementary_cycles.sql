@@ -0,0 +1,216 @@
+-- Unlike find_cycles() in 2_cycle_finding.sql, which starts a search from every
+-- node and finds each cycle once per node on it, this uses Johnson's algorithm to
+-- find each elementary cycle exactly once. Cycles come out rotated to start from
+-- their lexicographically smallest node, so no SELECT DISTINCT is needed.
+CREATE OR REPLACE FUNCTION find_elementary_cycles(curr_graph_id varchar(64))
+RETURNS TABLE(cycle_path text[]) AS
+$$
+DECLARE
+    node_names text[];  -- Sorted node ids. A node's position in here is its index in the arrays below
+    node_count integer;
+    -- Edges as pairs of node indexes, sorted by from node (out_*) and by to node (in_*),
+    -- with the range of each node's edges in first_*/last_*
+    out_from integer[];
+    out_to integer[];
+    first_out integer[];
+    last_out integer[];
+    in_from integer[];
+    in_to integer[];
+    first_in integer[];
+    last_in integer[];
+    -- Searching from each start node, we only use nodes in its strongly connected component,
+    -- among the nodes that come after it. That's everything that can be reached both from it and back to it.
+    -- These flags are allocated once, and after each start node we only reset the ones it set: the nodes
+    -- in queue (everything reached forwards) and component_nodes.
+    reached_forward boolean[];
+    in_component boolean[];
+    queue integer[] = '{}';
+    queue_head integer;
+    queue_tail integer;
+    component_nodes integer[] = '{}';
+    component_size integer;
+    slot integer;
+    -- Johnson's blocking: blocked nodes can't currently lead back to the start. blocked_by holds,
+    -- for each node, a linked list (in list_value/list_next) of nodes to unblock when it's unblocked.
+    blocked boolean[];
+    blocked_by integer[];
+    list_value integer[] = '{}';
+    list_next integer[] = '{}';
+    list_size integer;
+    unblock_stack integer[] = '{}';
+    unblock_top integer;
+    -- The search's stack frames: the node, the next of its edges to try, and whether a cycle was found below it
+    frame_node integer[] = '{}';
+    frame_edge integer[] = '{}';
+    frame_found boolean[] = '{}';
+    depth integer;
+    start_index integer;
+    current_index integer;
+    next_index integer;
+    edge integer;
+BEGIN
+    SELECT array_agg(node_id::text ORDER BY node_id::text) INTO node_names
+    FROM nodes WHERE graph_id = curr_graph_id;
+    node_count = coalesce(array_length(node_names, 1), 0);
+    IF node_count = 0 THEN
+        RETURN;
+    END IF;
+
+    -- Parallel edges would give the same cycle twice, so only count each pair of nodes once
+    SELECT array_agg(f.position::integer ORDER BY f.position, t.position),
+           array_agg(t.position::integer ORDER BY f.position, t.position)
+    INTO out_from, out_to
+    FROM (SELECT DISTINCT from_node, to_node FROM edges WHERE graph_id = curr_graph_id) AS e
+    JOIN unnest(node_names) WITH ORDINALITY AS f(name, position) ON f.name = e.from_node
+    JOIN unnest(node_names) WITH ORDINALITY AS t(name, position) ON t.name = e.to_node;
+    SELECT array_agg(f ORDER BY t, f), array_agg(t ORDER BY t, f)
+    INTO in_from, in_to
+    FROM unnest(out_from, out_to) AS e(f, t);
+
+    first_out = array_fill(NULL::integer, ARRAY[node_count]);
+    last_out = array_fill(NULL::integer, ARRAY[node_count]);
+    first_in = array_fill(NULL::integer, ARRAY[node_count]);
+    last_in = array_fill(NULL::integer, ARRAY[node_count]);
+    FOR edge IN 1..coalesce(array_length(out_from, 1), 0) LOOP
+        first_out[out_from[edge]] = coalesce(first_out[out_from[edge]], edge);
+        last_out[out_from[edge]] = edge;
+        first_in[in_to[edge]] = coalesce(first_in[in_to[edge]], edge);
+        last_in[in_to[edge]] = edge;
+    END LOOP;
+
+    reached_forward = array_fill(false, ARRAY[node_count]);
+    in_component = array_fill(false, ARRAY[node_count]);
+    blocked = array_fill(false, ARRAY[node_count]);
+    blocked_by = array_fill(NULL::integer, ARRAY[node_count]);
+
+    FOR start_index IN 1..node_count LOOP
+        -- A start node is only on a cycle among the later nodes if it has edges both out to
+        -- and in from them (or itself). Each node's edges are sorted, so its last one has the
+        -- highest index. Most nodes of an acyclic graph stop here.
+        CONTINUE WHEN last_out[start_index] IS NULL OR last_in[start_index] IS NULL
+            OR out_to[last_out[start_index]] < start_index OR in_from[last_in[start_index]] < start_index;
+
+        -- Find everything reachable from the start node, without going back to earlier nodes
+        reached_forward[start_index] = true;
+        queue[1] = start_index;
+        queue_head = 1;
+        queue_tail = 1;
+        WHILE queue_head <= queue_tail LOOP
+            current_index = queue[queue_head];
+            queue_head = queue_head + 1;
+            FOR edge IN coalesce(first_out[current_index], 1)..coalesce(last_out[current_index], 0) LOOP
+                next_index = out_to[edge];
+                IF next_index > start_index AND NOT reached_forward[next_index] THEN
+                    reached_forward[next_index] = true;
+                    queue_tail = queue_tail + 1;
+                    queue[queue_tail] = next_index;
+                END IF;
+            END LOOP;
+        END LOOP;
+
+        -- Then which of those can get back to the start node. That's the start node's component.
+        in_component[start_index] = true;
+        component_nodes[1] = start_index;
+        component_size = 1;
+        queue_head = 1;
+        WHILE queue_head <= component_size LOOP
+            current_index = component_nodes[queue_head];
+            queue_head = queue_head + 1;
+            FOR edge IN coalesce(first_in[current_index], 1)..coalesce(last_in[current_index], 0) LOOP
+                next_index = in_from[edge];
+                IF reached_forward[next_index] AND NOT in_component[next_index] THEN
+                    in_component[next_index] = true;
+                    component_size = component_size + 1;
+                    component_nodes[component_size] = next_index;
+                END IF;
+            END LOOP;
+        END LOOP;
+        FOR slot IN 1..queue_tail LOOP
+            reached_forward[queue[slot]] = false;
+        END LOOP;
+
+        -- Johnson's CIRCUIT search from the start node, with an explicit stack of frames
+        list_size = 0;
+        depth = 1;
+        frame_node[1] = start_index;
+        frame_edge[1] = coalesce(first_out[start_index], 1);
+        frame_found[1] = false;
+        blocked[start_index] = true;
+
+        WHILE depth > 0 LOOP
+            current_index = frame_node[depth];
+            edge = frame_edge[depth];
+            IF edge <= coalesce(last_out[current_index], 0) THEN
+                frame_edge[depth] = edge + 1;
+                next_index = out_to[edge];
+                CONTINUE WHEN NOT in_component[next_index];
+                IF next_index = start_index THEN
+                    -- Everything else on the path comes after the start node, so it's already rotated
+                    RETURN QUERY SELECT ARRAY(
+                        SELECT node_names[node]
+                        FROM unnest(frame_node[1:depth]) WITH ORDINALITY AS p(node, position)
+                        ORDER BY position
+                    );
+                    frame_found[depth] = true;
+                ELSIF NOT blocked[next_index] THEN
+                    depth = depth + 1;
+                    frame_node[depth] = next_index;
+                    frame_edge[depth] = coalesce(first_out[next_index], 1);
+                    frame_found[depth] = false;
+                    blocked[next_index] = true;
+                END IF;
+                CONTINUE;
+            END IF;
+
+            -- We've tried every edge out of the current node
+            IF frame_found[depth] THEN
+                -- Unblock it, and everything waiting on it
+                unblock_top = 1;
+                unblock_stack[1] = current_index;
+                WHILE unblock_top > 0 LOOP
+                    next_index = unblock_stack[unblock_top];
+                    unblock_top = unblock_top - 1;
+                    IF blocked[next_index] THEN
+                        blocked[next_index] = false;
+                        edge = blocked_by[next_index];
+                        WHILE edge IS NOT NULL LOOP
+                            unblock_top = unblock_top + 1;
+                            unblock_stack[unblock_top] = list_value[edge];
+                            edge = list_next[edge];
+                        END LOOP;
+                        blocked_by[next_index] = NULL;
+                    END IF;
+                END LOOP;
+            ELSE
+                -- It stays blocked until one of its neighbours is unblocked
+                FOR edge IN coalesce(first_out[current_index], 1)..coalesce(last_out[current_index], 0) LOOP
+                    next_index = out_to[edge];
+                    IF in_component[next_index] THEN
+                        list_size = list_size + 1;
+                        list_value[list_size] = current_index;
+                        list_next[list_size] = blocked_by[next_index];
+                        blocked_by[next_index] = list_size;
+                    END IF;
+                END LOOP;
+            END IF;
+            depth = depth - 1;
+            IF depth > 0 AND frame_found[depth + 1] THEN
+                frame_found[depth] = true;
+            END IF;
+        END LOOP;
+
+        -- Only nodes in the component were ever blocked or waited on
+        FOR slot IN 1..component_size LOOP
+            current_index = component_nodes[slot];
+            in_component[current_index] = false;
+            blocked[current_index] = false;
+            blocked_by[current_index] = NULL;
+        END LOOP;
+    END LOOP;
+
+    RETURN;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Usage:
+-- SELECT * FROM find_elementary_cycles('g13');
@@ -0,0 +1,25 @@
+-- Answers to queries, so a repeated query can skip the search. The query service
+-- uses this with RESULT_CACHE=database; see src/query_service/result_cache.py.
+-- It's UNLOGGED because it's only a cache: losing it in a crash costs nothing
+-- but a few repeated searches, and skipping the WAL makes writes cheaper.
+CREATE UNLOGGED TABLE public.query_results
+(
+    graph_id character varying(64) NOT NULL,
+    version bigint NOT NULL,
+    query_key text NOT NULL,
+    result text NOT NULL,
+    size integer NOT NULL,
+    last_used timestamp with time zone NOT NULL DEFAULT clock_timestamp(),
+    PRIMARY KEY (graph_id, query_key),
+    CONSTRAINT "Graph reference" FOREIGN KEY (graph_id)
+        REFERENCES public.graphs (graph_id) MATCH SIMPLE
+        ON UPDATE NO ACTION
+        ON DELETE CASCADE
+);
+COMMENT ON TABLE public.query_results IS 'Cached answers to path and cycle queries.';
+COMMENT ON COLUMN public.query_results.graph_id IS 'The graph the query was answered for.';
+COMMENT ON COLUMN public.query_results.version IS 'The graph''s version when it was answered. Answers for other versions are stale.';
+COMMENT ON COLUMN public.query_results.query_key IS 'The query as a JSON array of start, end, query type and limit.';
+COMMENT ON COLUMN public.query_results.result IS 'The answer, as JSON.';
+COMMENT ON COLUMN public.query_results.size IS 'Roughly how many bytes the answer takes, for keeping the cache in budget.';
+COMMENT ON COLUMN public.query_results.last_used IS 'When the answer was last stored or read. The least recently used are evicted first.';
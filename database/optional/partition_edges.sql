@@ -0,0 +1,61 @@
+-- Optional: hash partition public.edges by graph_id.
+--
+-- When lots of graphs are stored, this keeps each graph's edges (and its
+-- slice of edges_from_node_idx and edges_to_node_idx) in a smaller partition. It's not loaded
+-- when the db container starts. Apply it to a running database with:
+-- $ docker exec -i postgres psql -U postgres -d graphs < database/optional/partition_edges.sql
+
+BEGIN;
+
+ALTER TABLE public.edges RENAME TO edges_unpartitioned;
+
+CREATE TABLE public.edges
+(
+    edge_id character varying(64) NOT NULL,
+    from_node character varying(64) NOT NULL,
+    to_node character varying(64) NOT NULL,
+    cost double precision NOT NULL,
+    graph_id character varying NOT NULL
+) PARTITION BY HASH (graph_id);
+
+DO
+$$
+DECLARE
+    partition_count integer = 8;
+BEGIN
+    FOR i IN 0..partition_count - 1 LOOP
+        EXECUTE format(
+            'CREATE TABLE public.edges_p%s PARTITION OF public.edges FOR VALUES WITH (MODULUS %s, REMAINDER %s)',
+            i, partition_count, i
+        );
+    END LOOP;
+END;
+$$;
+
+INSERT INTO public.edges (edge_id, from_node, to_node, cost, graph_id)
+SELECT edge_id, from_node, to_node, cost, graph_id FROM public.edges_unpartitioned;
+
+DROP TABLE public.edges_unpartitioned;
+
+ALTER TABLE public.edges
+    ADD CONSTRAINT "Edge is unique to graph" PRIMARY KEY (edge_id, graph_id),
+    ADD CONSTRAINT "From-Node reference" FOREIGN KEY (from_node, graph_id)
+        REFERENCES public.nodes (node_id, graph_id) MATCH SIMPLE
+        ON UPDATE CASCADE
+        ON DELETE CASCADE,
+    ADD CONSTRAINT "To-Node Reference" FOREIGN KEY (to_node, graph_id)
+        REFERENCES public.nodes (node_id, graph_id) MATCH SIMPLE
+        ON UPDATE CASCADE
+        ON DELETE CASCADE;
+
+CREATE INDEX edges_from_node_idx ON public.edges (graph_id, from_node) INCLUDE (to_node, cost);
+CREATE INDEX edges_to_node_idx ON public.edges (graph_id, to_node) INCLUDE (from_node);
+
+COMMENT ON TABLE public.edges IS 'Details for each edge, hash partitioned by graph.';
+COMMENT ON CONSTRAINT "Edge is unique to graph" ON public.edges IS 'The unique identifier for the edge.';
+COMMENT ON CONSTRAINT "From-Node reference" ON public.edges IS 'Each from_node must reference a node in the same graph.';
+COMMENT ON CONSTRAINT "To-Node Reference" ON public.edges IS 'Each to_node must reference a node in the same graph.';
+COMMENT ON INDEX public.edges_from_node_idx IS 'Index-only lookup of the edges leaving a node.';
+COMMENT ON INDEX public.edges_to_node_idx IS 'Index-only lookup of the edges coming into a node.';
+
+COMMIT;
@@ -1,16 +1,24 @@
-from src.downloader import setup
+from src.downloader import parallel_ingest, setup
+from src.query_service import query_server
 
 
 def run_setup():
-    """Call the graph data setup function."""
+    """Call the graph data setup function.
+
+    With a list of endpoints (GRAPH_DATA_ENDPOINTS or GRAPH_DATA_MANIFEST),
+    they're all ingested in parallel instead of the single GRAPH_DATA_ENDPOINT.
+    """
     print("Running initial graph data setup...", flush=True)
-    setup.set_up_graph_data()
+    endpoints = parallel_ingest.get_graph_endpoints()
+    if endpoints:
+        parallel_ingest.set_up_many_graphs(endpoints)
+    else:
+        setup.set_up_graph_data()
 
 
 def wait_for_queries():
-    """Keep container idle but up."""
-    print("Waiting for queries...", flush=True)
-    input()
+    """Keep the container up, answering queries on the query server's port."""
+    query_server.serve_queries()
 
 
 if __name__ == "__main__":
@@ -1,20 +1,47 @@
 #!/bin/bash
 
-# This file is a convenience wrapper around the docker container for sending
-# graph queries. You can send json queries via stdin to this file like this:
+# This file is a convenience wrapper for sending graph queries to the query
+# server running in the graph_info container. You can send json queries via
+# stdin to this file like this:
 # $ cat my_query.json | ./query.sh
+#
+# It talks to the server directly over TCP using bash's /dev/tcp, so there's
+# no docker exec or Python start up for each query.
 
 
 CONTAINER_NAME="graph_info"
+QUERY_HOST="${QUERY_HOST:-localhost}"
+QUERY_PORT="${QUERY_PORT:-55433}"
+
+send_query() {
+    exec 3<>"/dev/tcp/$QUERY_HOST/$QUERY_PORT" || return 1
+    # The server reads up to a NUL byte, since bash can't half-close the socket
+    { printf '%s' "$QUERY"; printf '\0'; } >&3
+    cat <&3
+    exec 3<&-
+}
+
+wait_for_server() {
+    for _ in $(seq 1 60); do
+        if (exec 3<>"/dev/tcp/$QUERY_HOST/$QUERY_PORT") 2>/dev/null; then
+            return 0
+        fi
+        sleep 1
+    done
+    echo "Query server didn't start on port $QUERY_PORT." >&2
+    return 1
+}
+
+QUERY="$(cat)"
 
 # Check if the container is running
 if [[ $(docker ps --quiet --filter name=$CONTAINER_NAME) ]]; then
-    docker exec -i $CONTAINER_NAME python src/query_service/query_listener.py
+    send_query
 else
     echo "Container '$CONTAINER_NAME' is not running."
     echo "Starting the container..."
     docker compose up -d
-    echo "Container started. Now attaching to the query listener service..."
-    docker exec -i $CONTAINER_NAME python src/query_service/query_listener.py
+    echo "Container started. Waiting for the query server..."
+    wait_for_server && send_query
     docker compose down
 fi
@@ -1,21 +1,117 @@
+from contextlib import contextmanager
 import os
+import threading
 
 import psycopg2
+from psycopg2 import pool
 
 
-def get_db_connection():
-    db_host = os.getenv('POSTGRES_HOST')
-    db_port = os.getenv('POSTGRES_PORT')
-    db_name = os.getenv('POSTGRES_DB')
-    db_user = os.getenv('POSTGRES_USER')
-    db_password = os.getenv('POSTGRES_PASSWORD')
+def get_connection_settings():
+    return {
+        "host": os.getenv('POSTGRES_HOST'),
+        "port": os.getenv('POSTGRES_PORT'),
+        "dbname": os.getenv('POSTGRES_DB'),
+        "user": os.getenv('POSTGRES_USER'),
+        "password": os.getenv('POSTGRES_PASSWORD'),
+    }
+
 
+def get_db_connection():
     # Connect to the PostgreSQL database
-    conn = psycopg2.connect(
-        host=db_host,
-        port=db_port,
-        dbname=db_name,
-        user=db_user,
-        password=db_password
-    )
+    conn = psycopg2.connect(**get_connection_settings())
     return conn
+
+
+class BlockingConnectionPool(pool.ThreadedConnectionPool):
+    """A ThreadedConnectionPool which waits for a free connection instead of raising.
+
+    With lots of threads (query server clients, ingest workers) asking for
+    connections at once, it's nicer to queue up than to fail.
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self._available = threading.BoundedSemaphore(maxconn)
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        self._available.acquire()
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._available.release()
+            raise
+
+    def putconn(self, conn=None, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._available.release()
+
+
+_connection_pool = None
+_connection_pool_lock = threading.Lock()
+
+
+def get_connection_pool() -> BlockingConnectionPool:
+    """The process-wide connection pool, created the first time it's needed.
+
+    Its size comes from POSTGRES_POOL_MIN and POSTGRES_POOL_MAX.
+    """
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is None or _connection_pool.closed:
+            _connection_pool = BlockingConnectionPool(
+                int(os.getenv('POSTGRES_POOL_MIN', '1')),
+                int(os.getenv('POSTGRES_POOL_MAX', '10')),
+                **get_connection_settings()
+            )
+        return _connection_pool
+
+
+def close_connection_pool():
+    global _connection_pool
+    with _connection_pool_lock:
+        if _connection_pool is not None and not _connection_pool.closed:
+            _connection_pool.closeall()
+        _connection_pool = None
+
+
+def connection_is_healthy(conn) -> bool:
+    """Check a pooled connection still works before we hand it out.
+
+    Connections can be dropped while they sit in the pool (DB restarts,
+    idle timeouts), so we run a trivial query on it first.
+    """
+    if conn.closed:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+    except psycopg2.Error:
+        return False
+    return True
+
+
+@contextmanager
+def pooled_connection():
+    """Borrow a connection from the pool, and give it back afterwards.
+
+    Like `with get_db_connection() as conn:`, the block runs in a
+    transaction which is committed if it finishes and rolled back if it
+    raises. Connections that fail their health check, or are closed when
+    we're done, are thrown away rather than going back in the pool.
+    """
+    connection_pool = get_connection_pool()
+    conn = connection_pool.getconn()
+    # Every idle connection in the pool could have gone stale, but a new one won't have
+    for _ in range(connection_pool.maxconn):
+        if connection_is_healthy(conn):
+            break
+        connection_pool.putconn(conn, close=True)
+        conn = connection_pool.getconn()
+    try:
+        with conn:
+            yield conn
+    finally:
+        connection_pool.putconn(conn, close=bool(conn.closed))
@@ -0,0 +1,136 @@
+from contextlib import contextmanager
+import json
+import os
+import time
+import tracemalloc
+from typing import Iterator, Optional, TextIO
+
+
+class Phase:
+    """What happened in one phase of an ingest. Rows and bytes are filled in by the caller."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+        self.rows = None
+        self.bytes = None
+        self.peak_memory_bytes = None
+        self.ok = True
+
+    def as_dict(self) -> dict:
+        return {
+            "phase": self.name,
+            "seconds": round(self.seconds, 6),
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "peak_memory_bytes": self.peak_memory_bytes,
+            "ok": self.ok,
+        }
+
+
+class IngestMetrics:
+    """Times each phase of set_up_graph_data(), so we can see where a slow ingest spends its time.
+
+    Each phase is written as a JSON line to `log` (usually stderr, so it
+    doesn't get mixed up with the status messages on stdout) as soon as
+    it finishes, followed by a summary line from report(). If
+    `prometheus_file` is set, report() also writes the last run's numbers
+    there in Prometheus' text format, for node_exporter's textfile
+    collector to pick up.
+
+    Peak memory comes from tracemalloc, which slows Python down a fair
+    bit, so it's only tracked with `trace_memory`.
+    """
+
+    def __init__(self, log: Optional[TextIO] = None, prometheus_file: Optional[str] = None,
+                 trace_memory: bool = False):
+        self.log = log
+        self.prometheus_file = prometheus_file
+        self.trace_memory = trace_memory
+        self.phases = []
+        self.graph_id = None
+        self._start_time = time.perf_counter()
+        self._started_tracing = False
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[Phase]:
+        phase = Phase(name)
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        start_time = time.perf_counter()
+        try:
+            yield phase
+        except BaseException:
+            phase.ok = False
+            raise
+        finally:
+            phase.seconds = time.perf_counter() - start_time
+            if self.trace_memory:
+                phase.peak_memory_bytes = tracemalloc.get_traced_memory()[1]
+            self.phases.append(phase)
+            self._log_line({"event": "ingest_phase", **phase.as_dict()})
+
+    def report(self, succeeded: bool):
+        """Log the summary line, and write the Prometheus file if there is one."""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        total_seconds = time.perf_counter() - self._start_time
+        self._log_line({
+            "event": "ingest",
+            "graph_id": self.graph_id,
+            "ok": succeeded,
+            "seconds": round(total_seconds, 6),
+            "phases": [phase.name for phase in self.phases],
+        })
+        if self.prometheus_file:
+            write_prometheus_file(self.prometheus_file, self.phases, succeeded, total_seconds)
+
+    def _log_line(self, record: dict):
+        if self.log is None:
+            return
+        print(json.dumps(record), file=self.log, flush=True)
+
+
+PROMETHEUS_METRICS = (
+    ("seconds", "graph_ingest_phase_seconds", "Wall time of each phase of the last graph ingest."),
+    ("rows", "graph_ingest_phase_rows", "Rows processed by each phase of the last graph ingest."),
+    ("bytes", "graph_ingest_phase_bytes", "Bytes read by each phase of the last graph ingest."),
+    ("peak_memory_bytes", "graph_ingest_phase_peak_memory_bytes",
+     "Peak traced Python memory during each phase of the last graph ingest."),
+)
+
+
+def format_prometheus(phases: list, succeeded: bool, total_seconds: float) -> str:
+    lines = []
+    for attribute, metric, description in PROMETHEUS_METRICS:
+        samples = [(phase.name, getattr(phase, attribute)) for phase in phases
+                   if getattr(phase, attribute) is not None]
+        if not samples:
+            continue
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} gauge")
+        lines.extend(f'{metric}{{phase="{name}"}} {value}' for name, value in samples)
+    lines.extend([
+        "# HELP graph_ingest_seconds Wall time of the last graph ingest.",
+        "# TYPE graph_ingest_seconds gauge",
+        f"graph_ingest_seconds {total_seconds}",
+        "# HELP graph_ingest_success Whether the last graph ingest succeeded.",
+        "# TYPE graph_ingest_success gauge",
+        f"graph_ingest_success {int(succeeded)}",
+        "# HELP graph_ingest_last_run_timestamp_seconds When the last graph ingest finished.",
+        "# TYPE graph_ingest_last_run_timestamp_seconds gauge",
+        f"graph_ingest_last_run_timestamp_seconds {time.time()}",
+    ])
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file(path: str, phases: list, succeeded: bool, total_seconds: float):
+    # Write then rename, so the collector never reads a half-written file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as out:
+        out.write(format_prometheus(phases, succeeded, total_seconds))
+    os.replace(temp_path, path)
@@ -0,0 +1,166 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import redirect_stdout
+import io
+import multiprocessing
+import os
+import time
+from typing import Optional
+
+import config
+from src.downloader import setup
+
+
+class GraphIngestResult:
+    """How ingesting one endpoint went, for the summary at the end."""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.graph_id = None
+        self.ok = False
+        self.stage = "download"  # Where it got to: download, parse or insert
+        self.message = ""
+        self.rows = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def finish(self, ok: bool, message: str = ""):
+        self.ok = ok
+        self.message = message
+        self.seconds = time.perf_counter() - self.started
+
+
+def read_manifest(path: str) -> list:
+    """Read a list of endpoints from a file: one per line, ignoring blank lines and # comments."""
+    with open(path, "r") as file:
+        lines = (line.split("#", 1)[0].strip() for line in file)
+        return [line for line in lines if line]
+
+
+def get_graph_endpoints() -> list:
+    """Every endpoint to ingest: GRAPH_DATA_MANIFEST's, then GRAPH_DATA_ENDPOINTS'."""
+    endpoints = read_manifest(config.graph_data_manifest) if config.graph_data_manifest else []
+    endpoints += config.graph_data_endpoints
+    return list(dict.fromkeys(endpoints))
+
+
+def parse_graph(xml_string: str) -> (bool, object):
+    """Verify and extract a graph. Runs in a worker process.
+
+    Returns (True, graph_data), or (False, the reason it's invalid). The
+    messages the checks print are captured as the reason, rather than
+    interleaving with every other worker's output.
+    """
+    output = io.StringIO()
+    with redirect_stdout(output):
+        valid, xml_data = setup.verify_graph_data(xml_string)
+        if not valid:
+            return False, output.getvalue().strip() or "Problem validating graph data."
+        graph_data = setup.extract_graph_data(xml_data)
+    _, _, nodes, edges = graph_data
+    if not setup.verify_unique_ids(nodes):
+        return False, "Problem validating unique node IDs."
+    if not setup.verify_unique_ids(edges):
+        return False, "Problem validating unique edge IDs."
+    return True, graph_data
+
+
+def store_graph(graph_data) -> (bool, object):
+    """Insert a parsed graph, or update it with DELTA_INGEST. Returns (True, row count) or (False, reason).
+
+    With GRAPH_SNAPSHOT_DIR set, the graph's snapshot is written too, and
+    with REACHABILITY_INDEX its reachability index.
+    """
+    if not setup.graph_id_exists(graph_data[0]):
+        row_count = setup.insert_graph_data(graph_data)
+    elif config.delta_ingest:
+        row_count = setup.update_graph_data(graph_data)
+    else:
+        return False, "Graph ID already exists."
+    if config.graph_snapshot_dir:
+        if setup.save_graph_snapshot(graph_data[0]) is not None and config.reachability_index:
+            setup.save_reachability_index(graph_data[0])
+    return True, row_count
+
+
+def ingest_many(endpoints: list, download_workers: Optional[int] = None, parse_workers: Optional[int] = None,
+                insert_workers: Optional[int] = None) -> list:
+    """Download, parse and insert many graphs at once. Returns a GraphIngestResult per endpoint, in order.
+
+    Each graph moves through three pools: downloads run on threads,
+    since they spend their time waiting on the network; parsing is CPU
+    bound, so it runs in worker processes to get around the GIL; and
+    inserts run on threads, each borrowing a connection from the pool.
+    Only so many graphs are in flight at once (enough to keep every
+    worker busy), so we never hold hundreds of downloaded documents
+    waiting to be parsed. One graph failing doesn't stop the others. The
+    parsers are started by a fork server, since forking this process
+    while the download and insert threads are running could copy a lock
+    one of them holds.
+    """
+    download_workers = download_workers or config.ingest_download_workers
+    parse_workers = parse_workers or config.ingest_parse_workers or os.cpu_count() or 1
+    insert_workers = insert_workers or config.ingest_insert_workers
+    max_in_flight = download_workers + parse_workers + insert_workers
+
+    results = [GraphIngestResult(endpoint) for endpoint in endpoints]
+    waiting = list(reversed(results))
+    in_flight = {}  # future -> result
+    with ThreadPoolExecutor(download_workers) as downloads, \
+            ProcessPoolExecutor(parse_workers, mp_context=multiprocessing.get_context("forkserver")) as parsers, \
+            ThreadPoolExecutor(insert_workers) as inserts:
+        while waiting or in_flight:
+            while waiting and len(in_flight) < max_in_flight:
+                result = waiting.pop()
+                in_flight[downloads.submit(setup.download_graph, result.endpoint)] = result
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = in_flight.pop(future)
+                try:
+                    value = future.result()
+                except Exception as e:
+                    result.finish(False, f"{type(e).__name__}: {e}")
+                    continue
+                if result.stage == "download":
+                    if value is None:
+                        result.finish(False, "Problem downloading graph data.")
+                        continue
+                    result.stage = "parse"
+                    in_flight[parsers.submit(parse_graph, value)] = result
+                elif result.stage == "parse":
+                    ok, value = value
+                    if not ok:
+                        result.finish(False, value)
+                        continue
+                    result.graph_id = value[0]
+                    result.stage = "insert"
+                    in_flight[inserts.submit(store_graph, value)] = result
+                else:
+                    ok, value = value
+                    if ok:
+                        result.rows = value
+                        result.finish(True)
+                    else:
+                        result.finish(False, value)
+    return results
+
+
+def format_summary(results: list, seconds: float) -> str:
+    succeeded = sum(result.ok for result in results)
+    lines = [f"Ingested {succeeded} of {len(results)} graphs in {seconds:.2f}s."]
+    for result in results:
+        if result.ok:
+            lines.append(f"  ok      {result.endpoint} ({result.graph_id}, {result.rows} rows, {result.seconds:.2f}s)")
+        else:
+            lines.append(f"  FAILED  {result.endpoint} at {result.stage}: {result.message}")
+    return "\n".join(lines)
+
+
+def set_up_many_graphs(endpoints: list) -> list:
+    """Ingest every endpoint, print a summary, and point the query service at the first graph that made it."""
+    start_time = time.perf_counter()
+    results = ingest_many(endpoints)
+    print(format_summary(results, time.perf_counter() - start_time), flush=True)
+    first_ok = next((result for result in results if result.ok), None)
+    if first_ok is not None:
+        setup.set_graph_id(first_ok.graph_id)
+    return results
@@ -1,48 +1,166 @@
-from typing import Optional
+from itertools import islice
+import os
+import sys
+import time
+from typing import Iterable, Optional
 import xml.etree.ElementTree as ET
 
+import psycopg2
 import requests
+from psycopg2.extras import execute_values
 
 import config
-from src.db_connection.postgres import get_db_connection
+from src.db_connection.postgres import pooled_connection
+from src.downloader.instrumentation import IngestMetrics
+from src.downloader.streaming import (
+    ChunkReader, GraphDataError, GraphStream, decompress_chunks, parse_edge_cost, zstandard)
+from src.query_service.graph_cache import get_graph_version, load_graph
+from src.query_service.graph_snapshot import SnapshotError, load_snapshot, snapshot_path, write_snapshot
+from src.query_service.reachability import ReachabilityIndex, index_path, write_index
 
 
 def set_up_graph_data():
-    xml_string = download_graph()
+    metrics = IngestMetrics(
+        log=sys.stderr if config.ingest_metrics else None,
+        prometheus_file=config.ingest_metrics_file or None,
+        trace_memory=config.ingest_trace_memory,
+    )
+    succeeded = False
+    try:
+        succeeded = download_and_ingest(metrics)
+        if succeeded and config.graph_snapshot_dir:
+            with metrics.phase("snapshot") as phase:
+                phase.bytes = save_graph_snapshot(metrics.graph_id)
+            if phase.bytes is not None and config.reachability_index:
+                with metrics.phase("reachability_index") as phase:
+                    phase.bytes = save_reachability_index(metrics.graph_id)
+    finally:
+        metrics.report(succeeded)
+
+
+def download_and_ingest(metrics: IngestMetrics) -> bool:
+    if config.stream_ingest:
+        with metrics.phase("connect"):
+            graph_stream = open_graph_stream()
+        if graph_stream is None:
+            print("Problem downloading graph data.")
+            return False
+        with graph_stream:
+            return ingest_graph_stream(graph_stream, metrics)
+    with metrics.phase("download") as phase:
+        xml_string, byte_count = fetch_graph()
+        phase.bytes = byte_count
     if xml_string is None:
         print("Problem downloading graph data.")
-        return
-    valid, xml_data = verify_graph_data(xml_string)
+        return False
+    with metrics.phase("verify") as phase:
+        valid, xml_data = verify_graph_data(xml_string)
+        phase.bytes = byte_count
     if not valid:
         print("Problem validating graph data.")
-        return
-    graph_id, graph_name, nodes, edges = extract_graph_data(xml_data)
-    if not verify_unique_ids(nodes):
+        return False
+    with metrics.phase("extract") as phase:
+        graph_id, graph_name, nodes, edges = extract_graph_data(xml_data)
+        phase.rows = len(nodes) + len(edges)
+    metrics.graph_id = graph_id
+    with metrics.phase("unique_ids") as phase:
+        unique_nodes = verify_unique_ids(nodes)
+        unique_edges = unique_nodes and verify_unique_ids(edges)
+        phase.rows = len(nodes) + len(edges)
+    if not unique_nodes:
         print("Problem validating unique node IDs.")
-        return
-    if not verify_unique_ids(edges):
+        return False
+    if not unique_edges:
         print("Problem validating unique edge IDs.")
-        return
+        return False
     set_graph_id(graph_id)
-    if graph_id_exists(graph_id):
+    with metrics.phase("graph_id_check"):
+        exists = graph_id_exists(graph_id)
+    if exists and not config.delta_ingest:
         print("Graph ID already exists.")
-        return
+        return False
     graph_data = graph_id, graph_name, nodes, edges
-    insert_graph_data(graph_data)
+    if exists:
+        with metrics.phase("update") as phase:
+            phase.rows = update_graph_data(graph_data)
+        print("Graph data successfully updated.")
+        return True
+    with metrics.phase("insert") as phase:
+        phase.rows = insert_graph_data(graph_data)
     print("Graph data successfully inserted.")
+    return True
+
+
+def ingest_graph_stream(source, metrics: Optional[IngestMetrics] = None) -> bool:
+    """Validate and insert graph XML from a file or stream in a single pass.
+
+    This covers the same ground as the verify, extract and insert steps of
+    set_up_graph_data(), without ever holding the whole document in memory.
+    GraphStream hands nodes and edges straight to insert_graph_data() as it
+    parses them. If a problem turns up part way through, the exception
+    rolls the insert's transaction back. Since downloading, parsing and
+    inserting all overlap, `metrics` gets them as a single "stream_insert"
+    phase.
+    """
+    metrics = metrics or IngestMetrics()
+    try:
+        with metrics.phase("parse_header"):
+            graph = GraphStream(source)
+        metrics.graph_id = graph.graph_id
+        set_graph_id(graph.graph_id)
+        with metrics.phase("graph_id_check"):
+            exists = graph_id_exists(graph.graph_id)
+        if exists and not config.delta_ingest:
+            print("Graph ID already exists.")
+            return False
+        with metrics.phase("stream_update" if exists else "stream_insert") as phase:
+            store = update_graph_data if exists else insert_graph_data
+            phase.rows = store(graph.as_graph_data())
+            phase.bytes = getattr(source, "bytes_read", None)
+    except GraphDataError as e:
+        print(e)
+        print("Problem validating graph data.")
+        return False
+    print("Graph data successfully updated." if exists else "Graph data successfully inserted.")
+    return True
 
 
-def download_graph() -> Optional[str]:
+def download_graph(endpoint: Optional[str] = None) -> Optional[str]:
     """Retrieve xml graph data.
 
-    Based on endpoint in the config file, download and return the data.
-    Note that this function assumes the endpoint is wide open, without
-    any auth requirements.
+    Based on endpoint in the config file (unless we're given one),
+    download and return the data. Note that this function assumes the
+    endpoint is wide open, without any auth requirements.
+    """
+    return fetch_graph(endpoint)[0]
+
+
+def fetch_graph(endpoint: Optional[str] = None) -> (Optional[str], int):
+    """download_graph(), plus the size in bytes of the body we received, for the ingest metrics."""
+    response = requests.get(endpoint or config.graph_data_endpoint)
+    if response.status_code != 200:
+        return None, 0
+    return response.text, len(response.content)
+
+
+def open_graph_stream(chunk_size: Optional[int] = None) -> Optional[ChunkReader]:
+    """Start a streaming download of the xml graph data.
+
+    Rather than reading the whole body into memory like download_graph(),
+    this returns a file-like object that pulls the response down
+    `chunk_size` bytes at a time, so it can be fed straight into
+    ingest_graph_stream(). We ask for gzip (and zstd, if zstandard is
+    installed) transfer compression, and also accept payloads that are
+    compressed files in their own right.
     """
-    response = requests.get(config.graph_data_endpoint)
+    chunk_size = chunk_size or config.download_chunk_size
+    accept_encoding = "gzip, deflate, zstd" if zstandard is not None else "gzip, deflate"
+    response = requests.get(config.graph_data_endpoint, stream=True,
+                            headers={"Accept-Encoding": accept_encoding})
     if response.status_code != 200:
+        response.close()
         return None
-    return response.text
+    return ChunkReader(decompress_chunks(response.iter_content(chunk_size)), on_close=response.close)
 
 
 def verify_graph_data(xml_string) -> (bool, ET.Element):
@@ -158,13 +276,9 @@ def extract_graph_data(graph_data: ET.Element) -> (str, str, list, list):
         edge_id = edge.find('id').text
         edge_from = edge.find('from').text
         edge_to = edge.find('to').text
-        try:  # If cost is missing or empty, set to zero
-            edge_cost_str = edge.find('cost').text
-            edge_cost = float(edge_cost_str)
-            if edge_cost < 0:
-                raise ValueError
-        except (TypeError, AttributeError, ValueError):
-            edge_cost = 0.0
+        # If cost is missing, empty or negative, set to zero
+        edge_cost_elem = edge.find('cost')
+        edge_cost = parse_edge_cost(edge_cost_elem.text if edge_cost_elem is not None else None)
         edges.append((edge_id, edge_from, edge_to, edge_cost))
 
     return graph_id, graph_name, nodes, edges
@@ -178,29 +292,252 @@ def verify_unique_ids(nodes) -> bool:
 
 def graph_id_exists(graph_id: str) -> bool:
     """Check if a graph with the given ID already exists."""
-    with get_db_connection() as conn:
+    with pooled_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT graph_id FROM public.graphs WHERE graph_id = %s", (graph_id,))
             result = cur.fetchone()
     return result is not None
 
 
-def insert_graph_data(graph_data):
-    """Insert into PostGres."""
-    with get_db_connection() as conn:
+def save_graph_snapshot(graph_id: str) -> Optional[int]:
+    """Write the graph, as it now stands in the database, to its snapshot in GRAPH_SNAPSHOT_DIR.
+
+    Reading it back out of Postgres covers every way it could have got
+    there (inserted, streamed or updated). The version is read first, so
+    if the graph changes while we're reading it, the snapshot looks stale
+    and the query service ignores it. Returns the snapshot's size, or None
+    if it couldn't be read or written; the query service can always fall
+    back to Postgres, so that's not a reason to fail the ingest, which has
+    already been committed.
+    """
+    start_time = time.perf_counter()
+    try:
+        with pooled_connection() as conn:
+            with conn.cursor() as cur:
+                version = get_graph_version(cur, graph_id)
+                graph = load_graph(cur, graph_id)
+        os.makedirs(config.graph_snapshot_dir, exist_ok=True)
+        size = write_snapshot(snapshot_path(config.graph_snapshot_dir, graph_id), graph_id, version, graph)
+    except (OSError, psycopg2.Error) as e:
+        print(f"Problem writing graph snapshot: {e}")
+        return None
+    elapsed = time.perf_counter() - start_time
+    print(f"Wrote {size} byte snapshot of graph {graph_id} in {elapsed:.2f}s.")
+    return size
+
+
+def save_reachability_index(graph_id: str) -> Optional[int]:
+    """Build the graph's reachability index from its snapshot, and write it beside it.
+
+    Returns the index's size, or None if the graph was too big for one
+    (see REACHABILITY_INDEX_MAX_BYTES) or it couldn't be written.
+    """
+    start_time = time.perf_counter()
+    path = snapshot_path(config.graph_snapshot_dir, graph_id)
+    try:
+        graph = load_snapshot(path)
+        index = ReachabilityIndex.build(graph, graph.version, config.reachability_index_max_bytes)
+        if index is None:
+            print(f"Graph {graph_id} has too many strongly connected components for a reachability index.")
+            return None
+        size = write_index(index_path(path), index)
+    except (OSError, SnapshotError) as e:
+        print(f"Problem writing reachability index: {e}")
+        return None
+    elapsed = time.perf_counter() - start_time
+    print(f"Wrote {size} byte reachability index of graph {graph_id} in {elapsed:.2f}s.")
+    return size
+
+
+NODE_COLUMNS = ("node_id", "name", "graph_id")
+EDGE_COLUMNS = ("edge_id", "from_node", "to_node", "cost", "graph_id")
+
+
+def insert_graph_data(graph_data, batch_size: Optional[int] = None, conn=None):
+    """Bulk load into PostGres.
+
+    Everything goes in within a single transaction. Nodes and edges are
+    streamed through COPY FROM STDIN, `batch_size` rows at a time, so a
+    big graph costs a handful of round trips rather than one per row.
+    With INSERT_METHOD=values we fall back to batched multi-row INSERTs
+    via execute_values, for setups where COPY isn't available.
+    Without a `conn`, one is borrowed from the connection pool.
+    """
+    graph_id, graph_name, nodes, edges = graph_data
+    batch_size = batch_size or config.insert_batch_size
+    node_rows = ((*node, graph_id) for node in nodes)
+    edge_rows = ((*edge, graph_id) for edge in edges)
+    start_time = time.perf_counter()
+    with pooled_connection() if conn is None else conn as conn:
         with conn.cursor() as cur:
-            cur.execute("INSERT INTO public.graphs (graph_id, name) VALUES (%s, %s)", (graph_data[0], graph_data[1]))
-            for node in graph_data[2]:
-                cur.execute("INSERT INTO public.nodes (node_id, name, graph_id) VALUES (%s, %s, %s)", (*node, graph_data[0]))
-            for edge in graph_data[3]:
-                cur.execute("INSERT INTO public.edges (edge_id, from_node, to_node, cost, graph_id) VALUES (%s, %s, %s, %s, %s)", (*edge, graph_data[0]))
+            cur.execute("INSERT INTO public.graphs (graph_id, name) VALUES (%s, %s)", (graph_id, graph_name))
+            if config.insert_method == "values":
+                row_count = insert_rows_with_values(cur, "public.nodes", NODE_COLUMNS, node_rows, batch_size)
+                row_count += insert_rows_with_values(cur, "public.edges", EDGE_COLUMNS, edge_rows, batch_size)
+            else:
+                row_count = copy_rows(cur, "public.nodes", NODE_COLUMNS, node_rows, batch_size)
+                row_count += copy_rows(cur, "public.edges", EDGE_COLUMNS, edge_rows, batch_size)
             conn.commit()
+    elapsed = time.perf_counter() - start_time
+    print(f"Inserted {row_count} rows in {elapsed:.2f}s ({insert_rate(row_count, elapsed):.0f} rows/s).")
+    return row_count
+
+
+def update_graph_data(graph_data, batch_size: Optional[int] = None, conn=None) -> int:
+    """Bring a graph that's already stored in line with new graph data, changing only what's different.
+
+    Deleting the graph and inserting it again means cascading deletes
+    through every node and edge, which is slow on big graphs. Instead we
+    COPY the new nodes and edges into temporary staging tables, upsert
+    them with INSERT ... ON CONFLICT (skipping rows which haven't
+    changed), and delete whatever's no longer there, all in one
+    transaction. If anything changed, the graph gets a new version, so
+    caches of this graph (and only this graph) know to reload. Returns
+    the number of rows inserted, updated or deleted.
+    """
+    graph_id, graph_name, nodes, edges = graph_data
+    batch_size = batch_size or config.insert_batch_size
+    start_time = time.perf_counter()
+    with pooled_connection() if conn is None else conn as conn:
+        with conn.cursor() as cur:
+            cur.execute("CREATE TEMPORARY TABLE staged_nodes "
+                        "(node_id character varying(64) PRIMARY KEY, name character varying(255)) ON COMMIT DROP")
+            cur.execute("CREATE TEMPORARY TABLE staged_edges "
+                        "(edge_id character varying(64) PRIMARY KEY, from_node character varying(64), "
+                        "to_node character varying(64), cost double precision) ON COMMIT DROP")
+            copy_rows(cur, "staged_nodes", NODE_COLUMNS[:2], nodes, batch_size)
+            copy_rows(cur, "staged_edges", EDGE_COLUMNS[:4], edges, batch_size)
+            cur.execute("ANALYZE staged_nodes; ANALYZE staged_edges")
+
+            # New nodes first, so the edges can refer to them
+            node_counts = upsert_counts(cur, """
+                INSERT INTO public.nodes AS n (node_id, name, graph_id)
+                SELECT node_id, name, %(graph_id)s FROM staged_nodes
+                ON CONFLICT (node_id, graph_id) DO UPDATE SET name = EXCLUDED.name
+                WHERE n.name IS DISTINCT FROM EXCLUDED.name""", graph_id)
+            cur.execute("""
+                DELETE FROM public.edges AS e WHERE e.graph_id = %s
+                AND NOT EXISTS (SELECT 1 FROM staged_edges AS s WHERE s.edge_id = e.edge_id)""", (graph_id,))
+            edges_deleted = cur.rowcount
+            edge_counts = upsert_counts(cur, """
+                INSERT INTO public.edges AS e (edge_id, from_node, to_node, cost, graph_id)
+                SELECT edge_id, from_node, to_node, cost, %(graph_id)s FROM staged_edges
+                ON CONFLICT (edge_id, graph_id) DO UPDATE
+                SET from_node = EXCLUDED.from_node, to_node = EXCLUDED.to_node, cost = EXCLUDED.cost
+                WHERE (e.from_node, e.to_node, e.cost)
+                    IS DISTINCT FROM (EXCLUDED.from_node, EXCLUDED.to_node, EXCLUDED.cost)""", graph_id)
+            # Every edge left refers to a node that's staying, so this doesn't cascade
+            cur.execute("""
+                DELETE FROM public.nodes AS n WHERE n.graph_id = %s
+                AND NOT EXISTS (SELECT 1 FROM staged_nodes AS s WHERE s.node_id = n.node_id)""", (graph_id,))
+            nodes_deleted = cur.rowcount
+
+            change_count = sum(node_counts) + nodes_deleted + sum(edge_counts) + edges_deleted
+            cur.execute("""
+                UPDATE public.graphs SET name = %s, version = nextval('public.graph_version_seq')
+                WHERE graph_id = %s AND (%s OR name IS DISTINCT FROM %s)""",
+                        (graph_name, graph_id, change_count > 0, graph_name))
+            conn.commit()
+    elapsed = time.perf_counter() - start_time
+    print(f"Updated graph {graph_id} in {elapsed:.2f}s: "
+          f"nodes {node_counts[0]} inserted, {node_counts[1]} updated, {nodes_deleted} deleted; "
+          f"edges {edge_counts[0]} inserted, {edge_counts[1]} updated, {edges_deleted} deleted.")
+    return change_count
+
+
+def upsert_counts(cur, upsert_sql: str, graph_id: str) -> (int, int):
+    """Run an INSERT ... ON CONFLICT, and count the rows it inserted and updated.
+
+    A row's xmax is 0 if this transaction inserted it, rather than
+    updating one that was already there.
+    """
+    cur.execute(f"""
+        WITH changed AS ({upsert_sql} RETURNING (xmax = 0) AS inserted)
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM changed""",
+                {"graph_id": graph_id})
+    inserted, updated = cur.fetchone()
+    return inserted, updated
+
+
+def copy_rows(cur, table: str, columns: tuple, rows: Iterable[tuple], batch_size: int) -> int:
+    """Stream rows into a table with COPY FROM STDIN. Returns the row count."""
+    stream = CopyStream(rows, batch_size)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", stream)
+    return stream.row_count
+
+
+def insert_rows_with_values(cur, table: str, columns: tuple, rows: Iterable[tuple], batch_size: int) -> int:
+    """Insert rows using multi-row INSERTs of `batch_size` rows each. Returns the row count."""
+    rows = iter(rows)
+    row_count = 0
+    while batch := list(islice(rows, batch_size)):
+        execute_values(cur, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s", batch, page_size=batch_size)
+        row_count += len(batch)
+    return row_count
+
+
+class CopyStream:
+    """File-like object which feeds rows to copy_expert() as they're needed.
+
+    psycopg2 pulls data through read(), so we only ever hold one batch of
+    encoded rows in memory, no matter how many rows there are.
+    """
+
+    def __init__(self, rows: Iterable[tuple], batch_size: int):
+        self._rows = iter(rows)
+        self._batch_size = batch_size
+        self._buffer = ""
+        self.row_count = 0
+
+    def read(self, size: int = -1) -> str:
+        while (size < 0 or len(self._buffer) < size) and self._fill_buffer():
+            pass
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def _fill_buffer(self) -> bool:
+        batch = list(islice(self._rows, self._batch_size))
+        if not batch:
+            return False
+        self._buffer += "".join(format_copy_row(row) for row in batch)
+        self.row_count += len(batch)
+        return True
+
+
+def format_copy_row(row: tuple) -> str:
+    """Encode a row in COPY's text format."""
+    return "\t".join(escape_copy_value(value) for value in row) + "\n"
+
+
+def escape_copy_value(value) -> str:
+    """Escape a single value for COPY's text format. None becomes NULL."""
+    if value is None:
+        return "\\N"
+    return (str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r"))
+
+
+def insert_rate(row_count: int, elapsed: float) -> float:
+    """Rows per second, guarding against a zero elapsed time."""
+    return row_count / elapsed if elapsed > 0 else float(row_count)
 
 
 def set_graph_id(graph_id):
-    """Set the graph id for the query service."""
+    """Set the graph id for the query service.
+
+    It's written to graph_id.txt for query_listener.py runs in other
+    processes. A query server started in this process (see manager.py)
+    picks it up from config, without reading the file for every query.
+    Either way, GRAPH_ID still takes precedence.
+    """
     with open("graph_id.txt", "w") as f:
         f.write(graph_id)
+    config.last_ingested_graph_id = graph_id
 
 if __name__ == '__main__':
     set_up_graph_data()
@@ -0,0 +1,251 @@
+from collections import Counter
+from itertools import chain
+from typing import Callable, Iterable, Iterator, Optional
+import xml.etree.ElementTree as ET
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd payloads are optional, gzip is always available
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class GraphDataError(ValueError):
+    """Raised when streamed graph XML turns out to be invalid."""
+
+
+def invalid(reason: str) -> GraphDataError:
+    return GraphDataError(f"Invalid graph data. {reason}")
+
+
+def parse_edge_cost(cost_str: Optional[str]) -> float:
+    """Convert an edge's cost text to a float. Missing, empty or negative costs become zero."""
+    try:
+        edge_cost = float(cost_str)
+        if edge_cost < 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        edge_cost = 0.0
+    return edge_cost
+
+
+class GraphStream:
+    """Validate and extract graph XML in a single streaming pass.
+
+    This does the same checks as verify_graph_data() and returns the same
+    tuples as extract_graph_data(), but it's built on ET.iterparse, so each
+    <node> is checked, handed over, and thrown away before the next one is
+    read. The only things we hang on to are the node and edge IDs, which we
+    need for the uniqueness and from/to checks.
+
+    The graph's id and name are read as soon as the stream is opened, so
+    they must come before <nodes> in the document. After that, nodes() and
+    then edges() should be consumed in that order. Both draw from the same
+    parse, and raise GraphDataError as soon as a problem is found.
+    """
+
+    def __init__(self, source):
+        self._records = self._parse(source)
+        _, self.graph_id, self.graph_name = next(self._records)
+
+    def nodes(self) -> Iterator[tuple]:
+        for record in self._records:
+            if record[0] == "nodes done":
+                return
+            yield record[1:]
+
+    def edges(self) -> Iterator[tuple]:
+        for record in self._records:
+            yield record[1:]
+
+    def as_graph_data(self) -> (str, str, Iterator[tuple], Iterator[tuple]):
+        """Same shape as extract_graph_data(), but with lazy node and edge iterators."""
+        return self.graph_id, self.graph_name, self.nodes(), self.edges()
+
+    def _parse(self, source) -> Iterator[tuple]:
+        try:
+            yield from self._parse_events(ET.iterparse(source, events=("start", "end")))
+        except ET.ParseError:
+            raise invalid("Check XML structure.")
+
+    def _parse_events(self, events) -> Iterator[tuple]:
+        node_ids = set()
+        edge_ids = set()
+        header = {}
+        sections = Counter()
+        depth = 0
+        root = None
+        section = None
+
+        for event, elem in events:
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    if elem.tag != "graph":
+                        raise invalid("Root element is not 'graph'.")
+                    root = elem
+                elif depth == 2:
+                    sections[elem.tag] += 1
+                    if elem.tag in ("id", "name", "nodes", "edges") and sections[elem.tag] > 1:
+                        raise invalid(f"Expected one '{elem.tag}' element.")
+                    if elem.tag == "nodes":
+                        for tag in ("id", "name"):
+                            if tag not in header:
+                                raise invalid(f"Expected one '{tag}' element.")
+                        yield "header", header["id"], header["name"]
+                    elif elem.tag == "edges" and not sections["nodes"]:
+                        raise invalid("Expected one 'nodes' element.")
+                    section = elem
+                continue
+
+            depth -= 1
+            if depth == 1:
+                if elem.tag in ("id", "name"):
+                    if elem.text is None:
+                        raise invalid(f"Missing required element '{elem.tag}'.")
+                    header[elem.tag] = elem.text
+                elif elem.tag == "nodes":
+                    if not node_ids:
+                        raise invalid("Expected at least one 'node' element.")
+                    yield "nodes done",
+                root.remove(elem)
+            elif depth == 2 and elem.tag == "node":
+                if section.tag == "nodes":
+                    yield "node", *self._read_node(elem, node_ids)
+                elif section.tag == "edges":
+                    yield "edge", *self._read_edge(elem, node_ids, edge_ids)
+                section.remove(elem)
+
+        if not sections["nodes"]:
+            raise invalid("Expected one 'nodes' element.")
+        if not sections["edges"]:
+            raise invalid("Expected one 'edges' element.")
+
+    @staticmethod
+    def _read_node(elem: ET.Element, node_ids: set) -> (str, str):
+        node_id = single_child_text(elem, "id", "node")
+        if node_id in node_ids:
+            raise invalid("Node ID is not unique.")
+        node_ids.add(node_id)
+        return node_id, single_child_text(elem, "name", "node")
+
+    @staticmethod
+    def _read_edge(elem: ET.Element, node_ids: set, edge_ids: set) -> (str, str, str, float):
+        edge_id = single_child_text(elem, "id", "edge")
+        if edge_id in edge_ids:
+            raise invalid("Edge ID is not unique.")
+        edge_ids.add(edge_id)
+        edge_from = single_child_text(elem, "from", "edge")
+        if edge_from not in node_ids:
+            raise invalid("'from' node ID not found.")
+        edge_to = single_child_text(elem, "to", "edge")
+        if edge_to not in node_ids:
+            raise invalid("'to' node ID not found.")
+        cost_elems = elem.findall("cost")
+        if len(cost_elems) > 1:
+            raise invalid("Expected one or zero 'cost' elements in 'edge'.")
+        return edge_id, edge_from, edge_to, parse_edge_cost(cost_elems[0].text if cost_elems else None)
+
+
+def single_child_text(elem: ET.Element, tag: str, parent_name: str) -> str:
+    """Return the text of the one and only `tag` child, or raise GraphDataError."""
+    children = elem.findall(tag)
+    if len(children) != 1:
+        raise invalid(f"Expected one '{tag}' element in '{parent_name}'.")
+    if children[0].text is None:
+        raise invalid(f"Missing required element '{tag}' in '{parent_name}'.")
+    return children[0].text
+
+
+class ChunkReader:
+    """Minimal read-only file object over an iterator of byte chunks.
+
+    This lets ET.iterparse pull straight from a streaming HTTP response, so
+    the download and the parse overlap and only a chunk or two is ever
+    buffered.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], on_close: Optional[Callable] = None):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+        self._on_close = on_close
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+            self.bytes_read += len(chunk)
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def close(self):
+        if self._on_close is not None:
+            self._on_close()
+            self._on_close = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def decompress_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Decompress a gzip or zstd payload on the fly. Anything else passes through untouched.
+
+    The format is sniffed from the magic bytes at the start of the payload,
+    so this works for compressed files (e.g. graph.xml.gz) as well as a
+    Content-Encoding that the HTTP client didn't decode itself. A payload
+    can be several gzip members or zstd frames one after another (like
+    `cat a.gz b.gz`), which decompress to all their data joined up. A
+    corrupt or truncated payload raises GraphDataError.
+    """
+    chunks = iter(chunks)
+    head = b""
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= len(ZSTD_MAGIC):
+            break
+    if head.startswith(GZIP_MAGIC):
+        def new_decompressor():
+            return zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        errors = (zlib.error,)
+    elif head.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise GraphDataError("Graph data is zstd compressed, but the zstandard package isn't installed.")
+
+        def new_decompressor():
+            return zstandard.ZstdDecompressor().decompressobj()
+        errors = (zstandard.ZstdError,)
+    else:
+        yield head
+        yield from chunks
+        return
+
+    decompressor = None  # None between members
+    try:
+        for chunk in chain([head], chunks):
+            while chunk:
+                if decompressor is None:
+                    decompressor = new_decompressor()
+                yield decompressor.decompress(chunk)
+                chunk = b""
+                if decompressor.eof:
+                    # Anything after the end of this member is the start of the next one
+                    chunk = decompressor.unused_data
+                    decompressor = None
+        if decompressor is not None:
+            yield decompressor.flush()
+    except errors as e:
+        raise GraphDataError(f"Graph data couldn't be decompressed: {e}")
+    if decompressor is not None and not decompressor.eof:
+        raise GraphDataError("Graph data is truncated, the compressed payload ended part way through.")
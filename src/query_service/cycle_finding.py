@@ -0,0 +1,131 @@
+from typing import Callable, Iterator
+
+from src.query_service.graph_cache import CSRGraph
+
+
+def strongly_connected_components(graph: CSRGraph) -> list:
+    """Label each node with its strongly connected component, using Tarjan's algorithm.
+
+    Returns a list mapping node -> component number. Components are
+    numbered in the order Tarjan's algorithm completes them, which is a
+    reverse topological order of the condensed graph. The depth first
+    search is iterative, so deep graphs don't hit the recursion limit.
+    """
+    node_count = len(graph)
+    index = [-1] * node_count
+    low_link = [0] * node_count
+    on_stack = bytearray(node_count)
+    component = [-1] * node_count
+    stack = []
+    counter = 0
+    component_count = 0
+
+    for root in range(node_count):
+        if index[root] != -1:
+            continue
+        index[root] = low_link[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        work = [(root, graph.neighbours(root))]
+        while work:
+            node, neighbours = work[-1]
+            for next_node, _ in neighbours:
+                if index[next_node] == -1:
+                    index[next_node] = low_link[next_node] = counter
+                    counter += 1
+                    stack.append(next_node)
+                    on_stack[next_node] = 1
+                    work.append((next_node, graph.neighbours(next_node)))
+                    break
+                if on_stack[next_node]:
+                    low_link[node] = min(low_link[node], index[next_node])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low_link[parent] = min(low_link[parent], low_link[node])
+                if low_link[node] == index[node]:
+                    # node is the root of a component, which is everything above it on the stack
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        component[member] = component_count
+                        if member == node:
+                            break
+                    component_count += 1
+    return component
+
+
+def find_cycles(graph: CSRGraph) -> list:
+    """Find every elementary cycle in the graph, each exactly once.
+
+    This is Johnson's algorithm. Nodes are taken in order of their names,
+    and for each one we find the cycles whose smallest node it is, only
+    searching the rest of its strongly connected component. Every cycle
+    therefore comes out once, already rotated to start from its
+    lexicographically smallest node, which is the same canonical form
+    find_cycles() in SQL uses. Blocking nodes that can't lead back to the
+    start keeps the work proportional to the number of cycles found.
+    """
+    component = strongly_connected_components(graph)
+    order = sorted(range(len(graph)), key=lambda node: graph.names[node])
+    rank = [0] * len(graph)
+    for position, node in enumerate(order):
+        rank[node] = position
+
+    cycles = []
+    for start in order:
+        def successors(node, start=start):
+            # Parallel edges would give the same cycle twice, so only count each target once
+            return list(dict.fromkeys(
+                next_node for next_node, _ in graph.neighbours(node)
+                if component[next_node] == component[start] and rank[next_node] >= rank[start]))
+
+        for cycle in circuits_through(start, successors):
+            cycles.append([graph.names[node] for node in cycle])
+    return cycles
+
+
+def circuits_through(start: int, successors: Callable) -> Iterator[list]:
+    """Yield each cycle through `start` in the subgraph given by `successors`.
+
+    This is the CIRCUIT procedure from Johnson's algorithm, with the
+    recursion replaced by an explicit stack of frames.
+    """
+    blocked = {start}
+    blocked_by = {}  # node -> nodes to unblock when it's unblocked
+    path = [start]
+    frames = [iter(successors(start))]
+    found_cycle = [False]
+    while frames:
+        for next_node in frames[-1]:
+            if next_node == start:
+                yield list(path)
+                found_cycle[-1] = True
+            elif next_node not in blocked:
+                blocked.add(next_node)
+                path.append(next_node)
+                frames.append(iter(successors(next_node)))
+                found_cycle.append(False)
+                break
+        else:
+            node = path.pop()
+            frames.pop()
+            if found_cycle.pop():
+                unblock(node, blocked, blocked_by)
+                if found_cycle:
+                    found_cycle[-1] = True
+            else:
+                # node stays blocked until one of its successors is unblocked
+                for next_node in successors(node):
+                    blocked_by.setdefault(next_node, set()).add(node)
+
+
+def unblock(node: int, blocked: set, blocked_by: dict):
+    to_unblock = [node]
+    while to_unblock:
+        node = to_unblock.pop()
+        if node in blocked:
+            blocked.remove(node)
+            to_unblock.extend(blocked_by.pop(node, ()))
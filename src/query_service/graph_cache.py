@@ -0,0 +1,184 @@
+from array import array
+from functools import cached_property
+import threading
+from typing import Callable, Iterable, Iterator, Optional, Sequence
+
+
+class CSRGraph:
+    """Compact, read-only adjacency for one graph, in compressed sparse row form.
+
+    Nodes are interned to integers 0..n-1. The outgoing edges of node `i`
+    sit at positions offsets[i] to offsets[i + 1] of the `targets` and
+    `costs` arrays. That's three flat arrays and a name table, rather than
+    a dict of lists of tuples, so even big graphs stay small and quick to
+    walk.
+    """
+
+    # A ReachabilityIndex, for graphs which have one (see reachability.py)
+    reachability = None
+
+    def __init__(self, names: Sequence[str], offsets: Sequence[int], targets: Sequence[int],
+                 costs: Sequence[float]):
+        self.names = names
+        self.ids = {name: node for node, name in enumerate(names)}
+        self.offsets = offsets
+        self.targets = targets
+        self.costs = costs
+
+    @classmethod
+    def from_edges(cls, node_names: Iterable[str], edges: Iterable[tuple]) -> "CSRGraph":
+        """Build from node names and (from_node, to_node, cost) tuples.
+
+        Each node's edges keep the order they were given in.
+        """
+        names = list(node_names)
+        ids = {name: node for node, name in enumerate(names)}
+        sources = array("q")
+        unsorted_targets = array("q")
+        unsorted_costs = array("d")
+        for from_node, to_node, cost in edges:
+            sources.append(ids[from_node])
+            unsorted_targets.append(ids[to_node])
+            unsorted_costs.append(cost)
+
+        # Counting sort of the edges by source node
+        offsets = array("q", bytes(8 * (len(names) + 1)))
+        for source in sources:
+            offsets[source + 1] += 1
+        for node in range(len(names)):
+            offsets[node + 1] += offsets[node]
+        targets = array("q", bytes(8 * len(sources)))
+        costs = array("d", bytes(8 * len(sources)))
+        next_slot = array("q", offsets[:-1])
+        for edge, source in enumerate(sources):
+            slot = next_slot[source]
+            targets[slot] = unsorted_targets[edge]
+            costs[slot] = unsorted_costs[edge]
+            next_slot[source] += 1
+        return cls(names, offsets, targets, costs)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.targets)
+
+    def node_id(self, name: str) -> Optional[int]:
+        return self.ids.get(name)
+
+    def neighbours(self, node: int) -> Iterator[tuple]:
+        """Yield (target, cost) for each edge leaving `node`."""
+        for edge in range(self.offsets[node], self.offsets[node + 1]):
+            yield self.targets[edge], self.costs[edge]
+
+    @cached_property
+    def reverse_adjacency(self) -> tuple:
+        """(offsets, sources, costs) of the edges coming into each node, in the same CSR form.
+
+        It's only needed by searches which work backwards from the end
+        node, so it's built the first time one asks for it. A graph mapped
+        from a snapshot (see graph_snapshot.py) has it already.
+        """
+        node_count = len(self)
+        offsets = array("q", bytes(8 * (node_count + 1)))
+        for target in self.targets:
+            offsets[target + 1] += 1
+        for node in range(node_count):
+            offsets[node + 1] += offsets[node]
+        sources = array("q", bytes(8 * self.edge_count))
+        costs = array("d", bytes(8 * self.edge_count))
+        next_slot = array("q", offsets[:-1])
+        for source in range(node_count):
+            for edge in range(self.offsets[source], self.offsets[source + 1]):
+                target = self.targets[edge]
+                slot = next_slot[target]
+                sources[slot] = source
+                costs[slot] = self.costs[edge]
+                next_slot[target] += 1
+        return offsets, sources, costs
+
+    def predecessors(self, node: int) -> Iterator[tuple]:
+        """Yield (source, cost) for each edge coming into `node`."""
+        offsets, sources, costs = self.reverse_adjacency
+        for edge in range(offsets[node], offsets[node + 1]):
+            yield sources[edge], costs[edge]
+
+
+def load_graph(cur, graph_id: str) -> CSRGraph:
+    """Read a graph's nodes and edges out of PostGres."""
+    cur.execute("SELECT node_id FROM public.nodes WHERE graph_id = %s", (graph_id,))
+    node_names = [row[0] for row in cur]
+    cur.execute("SELECT from_node, to_node, cost FROM public.edges WHERE graph_id = %s", (graph_id,))
+    return CSRGraph.from_edges(node_names, cur)
+
+
+def get_graph_version(cur, graph_id: str):
+    """The graph's current version stamp, or None if there's no such graph."""
+    cur.execute("SELECT version FROM public.graphs WHERE graph_id = %s", (graph_id,))
+    row = cur.fetchone()
+    return row[0] if row is not None else None
+
+
+class GraphCache:
+    """Graphs held in memory, keyed by graph_id.
+
+    This is the registry of every graph the query service has been asked
+    about. Graphs are loaded lazily, the first time a query needs them.
+    Each entry is stamped with the graph's `version` from public.graphs.
+    Checking that is a single-row lookup, and when it changes (the graph
+    was re-inserted or updated) the graph is loaded again. Loading takes
+    a lock per graph, so several threads asking for a new graph load it
+    once, and a big graph loading doesn't hold up queries on the others.
+
+    If there's a `load_snapshot(graph_id, version)`, it's tried before
+    reading the graph out of Postgres, and returns the graph or None.
+    """
+
+    def __init__(self, load_snapshot: Optional[Callable] = None):
+        self._load_snapshot = load_snapshot
+        self._graphs = {}
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, cur, graph_id: str) -> Optional[CSRGraph]:
+        """Return the graph, loading it if it's new or stale, or None if there's no such graph."""
+        version = get_graph_version(cur, graph_id)
+        if version is None:
+            self._graphs.pop(graph_id, None)
+            return None
+        cached = self._graphs.get(graph_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with self._load_lock(graph_id):
+            # Someone else may have loaded it while we waited
+            cached = self._graphs.get(graph_id)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            graph = self._load_snapshot(graph_id, version) if self._load_snapshot is not None else None
+            if graph is None:
+                graph = load_graph(cur, graph_id)
+            self._graphs[graph_id] = (version, graph)
+        return graph
+
+    def version(self, graph_id: str, graph: Optional[CSRGraph] = None):
+        """The version of the graph we last returned from get(), or None.
+
+        With `graph`, only if that's still the graph we hold, so a reload in
+        another thread can't pair it with the wrong version.
+        """
+        cached = self._graphs.get(graph_id)
+        if cached is None or (graph is not None and cached[1] is not graph):
+            return None
+        return cached[0]
+
+    def graph_ids(self) -> list:
+        """The graphs currently loaded."""
+        return list(self._graphs)
+
+    def clear(self):
+        self._graphs.clear()
+
+    def _load_lock(self, graph_id: str) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(graph_id, threading.Lock())
@@ -0,0 +1,194 @@
+from array import array
+from collections.abc import Sequence
+import mmap
+import os
+import struct
+import sys
+from typing import Optional
+from urllib.parse import quote
+
+import config
+from src.query_service.graph_cache import CSRGraph
+
+# The file starts with this header:
+#   magic, format version, byte order (0 little, 1 big), node count, edge count,
+#   graph version (-1 if there isn't one), graph ID length, string table length
+# and then, each padded to a multiple of 8 bytes so the arrays can be cast in place:
+#   the graph ID (UTF-8)
+#   name offsets: node count + 1 int64s into the string table
+#   name order: node count int64s, the nodes sorted by name, for looking names up
+#   the string table: every node's name (UTF-8), one after the other
+#   CSR offsets: node count + 1 int64s
+#   CSR targets: edge count int64s
+#   CSR costs: edge count float64s
+#   reverse CSR offsets: node count + 1 int64s, for the edges coming into each node
+#   reverse CSR sources: edge count int64s
+#   reverse CSR costs: edge count float64s
+MAGIC = b"CSRGRAPH"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<8sIIqqqqq")
+BYTE_ORDER = 0 if sys.byteorder == "little" else 1
+
+
+class SnapshotError(Exception):
+    """The file isn't a graph snapshot we can read."""
+
+
+class SnapshotNames(Sequence):
+    """Node names, decoded from the snapshot's string table as they're asked for."""
+
+    def __init__(self, string_table: memoryview, name_offsets: memoryview):
+        self._string_table = string_table
+        self._name_offsets = name_offsets
+
+    def __len__(self) -> int:
+        return len(self._name_offsets) - 1
+
+    def __getitem__(self, node: int) -> str:
+        if not 0 <= node < len(self):
+            raise IndexError(node)
+        return str(self._string_table[self._name_offsets[node]:self._name_offsets[node + 1]], "utf-8")
+
+
+class SnapshotGraph(CSRGraph):
+    """A CSRGraph whose arrays are views straight onto a memory-mapped snapshot file.
+
+    Nothing is copied or parsed when it's loaded, so opening even a huge
+    graph is quick, and every process which maps the same file shares the
+    same pages of memory. Instead of a dict from name to node, names are
+    looked up with a binary search of the snapshot's name order. The
+    reverse adjacency is in the snapshot too, so searching backwards
+    doesn't have to build it first.
+    """
+
+    def __init__(self, path: str, graph_id: str, version: Optional[int], names: SnapshotNames,
+                 name_order: memoryview, offsets: memoryview, targets: memoryview, costs: memoryview,
+                 reverse_adjacency: tuple, mapped: mmap.mmap):
+        self.path = path
+        self.graph_id = graph_id
+        self.version = version
+        self.names = names
+        self.name_order = name_order
+        self.offsets = offsets
+        self.targets = targets
+        self.costs = costs
+        self.reverse_adjacency = reverse_adjacency
+        self._mapped = mapped  # The views above are only good while this is open
+
+    def node_id(self, name: str) -> Optional[int]:
+        low, high = 0, len(self.name_order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.names[self.name_order[middle]] < name:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.name_order) and self.names[self.name_order[low]] == name:
+            return self.name_order[low]
+        return None
+
+
+def snapshot_path(directory: str, graph_id: str) -> str:
+    return os.path.join(directory, quote(graph_id, safe="") + ".graph")
+
+
+def padding(length: int) -> bytes:
+    return bytes(-length % 8)
+
+
+def write_snapshot(path: str, graph_id: str, version: Optional[int], graph: CSRGraph) -> int:
+    """Write `graph` to a snapshot file, and return its size in bytes.
+
+    It's written to a temporary file which then replaces `path`, so a
+    reader never sees half a snapshot, and processes which already have
+    the old one mapped keep using it undisturbed.
+    """
+    encoded_names = [name.encode() for name in graph.names]
+    name_offsets = array("q", [0])
+    for name in encoded_names:
+        name_offsets.append(name_offsets[-1] + len(name))
+    name_order = array("q", sorted(range(len(graph)), key=graph.names.__getitem__))
+    string_table = b"".join(encoded_names)
+    graph_id_bytes = graph_id.encode()
+    reverse_offsets, reverse_sources, reverse_costs = graph.reverse_adjacency
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, BYTE_ORDER, len(graph), graph.edge_count,
+                         -1 if version is None else version, len(graph_id_bytes), len(string_table))
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as out:
+        for part in (header, graph_id_bytes, padding(len(graph_id_bytes)), name_offsets, name_order,
+                     string_table, padding(len(string_table)), as_array("q", graph.offsets),
+                     as_array("q", graph.targets), as_array("d", graph.costs), as_array("q", reverse_offsets),
+                     as_array("q", reverse_sources), as_array("d", reverse_costs)):
+            out.write(part)
+        size = out.tell()
+    os.replace(temp_path, path)
+    return size
+
+
+def as_array(typecode: str, values):
+    """`values` as something we can write out as raw machine values, without copying if we can help it."""
+    if isinstance(values, memoryview) and values.format == typecode:
+        return values
+    if isinstance(values, array) and values.typecode == typecode:
+        return values
+    return array(typecode, values)
+
+
+def load_snapshot(path: str) -> SnapshotGraph:
+    """Memory-map a snapshot file. Raises SnapshotError if it isn't a valid one."""
+    with open(path, "rb") as file:
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise SnapshotError(f"{path} is empty")
+    view = memoryview(mapped)
+    if len(view) < HEADER.size:
+        raise SnapshotError(f"{path} is too short to be a graph snapshot")
+    (magic, format_version, byte_order, node_count, edge_count, version, graph_id_length,
+     string_table_length) = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise SnapshotError(f"{path} isn't a graph snapshot")
+    if format_version != FORMAT_VERSION:
+        raise SnapshotError(f"{path} is snapshot format {format_version}, we can only read {FORMAT_VERSION}")
+    if byte_order != BYTE_ORDER:
+        raise SnapshotError(f"{path} was written on a machine with a different byte order")
+
+    position = HEADER.size
+
+    def take(length: int, typecode: Optional[str] = None) -> memoryview:
+        nonlocal position
+        section = view[position:position + length]
+        position += length + (-length % 8)
+        if len(section) < length:
+            raise SnapshotError(f"{path} is truncated")
+        return section.cast(typecode) if typecode else section
+
+    graph_id = str(take(graph_id_length), "utf-8")
+    name_offsets = take(8 * (node_count + 1), "q")
+    name_order = take(8 * node_count, "q")
+    string_table = take(string_table_length)
+    offsets = take(8 * (node_count + 1), "q")
+    targets = take(8 * edge_count, "q")
+    costs = take(8 * edge_count, "d")
+    reverse_adjacency = (take(8 * (node_count + 1), "q"), take(8 * edge_count, "q"), take(8 * edge_count, "d"))
+    return SnapshotGraph(path, graph_id, None if version == -1 else version,
+                         SnapshotNames(string_table, name_offsets), name_order, offsets, targets, costs,
+                         reverse_adjacency, mapped)
+
+
+def load_current_snapshot(graph_id: str, version) -> Optional[SnapshotGraph]:
+    """The graph's snapshot from GRAPH_SNAPSHOT_DIR, if there is one and it's of this version.
+
+    Anything else (no snapshot, an old one, or one we can't read) returns
+    None, and the graph is loaded from Postgres instead.
+    """
+    if not config.graph_snapshot_dir:
+        return None
+    try:
+        graph = load_snapshot(snapshot_path(config.graph_snapshot_dir, graph_id))
+    except (OSError, SnapshotError):
+        return None
+    if graph.graph_id != graph_id or graph.version != version:
+        return None
+    return graph
@@ -0,0 +1,170 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import suppress
+import multiprocessing
+import os
+import tempfile
+import threading
+from typing import Iterator, Optional
+
+import config
+from src.query_service import query_planner
+from src.query_service.graph_cache import CSRGraph
+from src.query_service.graph_snapshot import (
+    SnapshotError, SnapshotGraph, load_snapshot, snapshot_path, write_snapshot)
+from src.query_service.reachability import attach_index
+
+# How many shards to cut a batch into for each worker process. More shards balance
+# the load better when some searches take much longer than others, fewer keep more
+# queries from the same start node together, to share a search.
+SHARDS_PER_PROCESS = 4
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+# Snapshots we've written for graphs which didn't come from one: (graph_id, version) -> path
+_shared_snapshots = {}
+_shared_snapshots_lock = threading.Lock()
+
+# In each worker process, the graphs it has mapped: path -> SnapshotGraph
+_worker_graphs = {}
+
+
+def get_process_pool(processes: Optional[int] = None) -> ProcessPoolExecutor:
+    """The process-wide pool of worker processes (QUERY_PROCESSES of them), started the first time it's needed.
+
+    The workers are started by a fork server rather than forked from this
+    process, which by then has other threads running (the query server's
+    workers, the connection pool). A fork copies locks those threads might
+    be holding, and the worker could wait on them forever.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(processes or config.query_processes,
+                                                mp_context=multiprocessing.get_context("forkserver"))
+        return _process_pool
+
+
+def shutdown_process_pool():
+    """Stop the worker processes, and remove the snapshots we wrote for them."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+    with _shared_snapshots_lock:
+        for path in _shared_snapshots.values():
+            with suppress(FileNotFoundError):
+                os.remove(path)
+        _shared_snapshots.clear()
+
+
+def discard_process_pool(pool: ProcessPoolExecutor):
+    """Forget a pool which has broken (one of its workers died), so the next batch starts a new one."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shard_keys(keys: list, shard_count: int) -> list:
+    """Split a batch's (start, end, query_type) keys into at most `shard_count` shards of about the same size.
+
+    Queries between the same two nodes always go in the same shard, since
+    a cheapest query can be answered by the paths search for the same
+    pair. Pairs are ordered by start node before they're split, so
+    queries from the same node tend to end up together too.
+    """
+    pairs = {}
+    for key in keys:
+        pairs.setdefault(key[:2], []).append(key)
+    units = sorted(pairs.values(), key=lambda unit: (unit[0][0] is not None, str(unit[0][0])))
+    shard_count = max(1, min(shard_count, len(units)))
+    shards = []
+    for shard in range(shard_count):
+        shard_units = units[len(units) * shard // shard_count:len(units) * (shard + 1) // shard_count]
+        shards.append([key for unit in shard_units for key in unit])
+    return shards
+
+
+def shared_snapshot_path(graph_id: str, version, graph: CSRGraph) -> str:
+    """A snapshot file of `graph` for the worker processes to map, written the first time it's needed.
+
+    A graph loaded from GRAPH_SNAPSHOT_DIR already has one. Otherwise it's
+    written to a temporary directory, once per graph version.
+    """
+    if isinstance(graph, SnapshotGraph):
+        return graph.path
+    with _shared_snapshots_lock:
+        path = _shared_snapshots.get((graph_id, version))
+        if path is None:
+            directory = os.path.join(tempfile.gettempdir(), f"graph-snapshots-{os.getpid()}")
+            os.makedirs(directory, exist_ok=True)
+            path = snapshot_path(directory, f"{graph_id}.{version}")
+            write_snapshot(path, graph_id, version, graph)
+            # Only the latest version of each graph is any use now
+            for old_key in [key for key in _shared_snapshots if key[0] == graph_id]:
+                with suppress(FileNotFoundError):
+                    os.remove(_shared_snapshots.pop(old_key))
+            _shared_snapshots[(graph_id, version)] = path
+        return path
+
+
+def search_shard(path: str, version, keys: list, limits: dict, use_index: bool = False) -> list:
+    """Answer one shard of a batch. Runs in a worker process.
+
+    The graph is mapped from its snapshot the first time this worker sees
+    it (with its reachability index, if `use_index`), and kept for the
+    shards after.
+    """
+    graph = _worker_graphs.get(path)
+    if graph is None or graph.version != version:
+        graph = load_snapshot(path)
+        if graph.version != version:
+            raise SnapshotError(f"{path} is version {graph.version}, not {version}")
+        if use_index:
+            attach_index(graph)
+        _worker_graphs[path] = graph
+    return list(query_planner.iter_batch(graph, keys, limits))
+
+
+def iter_batch(graph_id: str, version, graph: CSRGraph, keys: list, limits: Optional[dict] = None,
+               processes: Optional[int] = None) -> Iterator[tuple]:
+    """Yield (key, paths) for each of `keys` in order, like query_planner.iter_batch(), using many processes.
+
+    Searching all the paths is CPU bound, and in one process the GIL
+    keeps it to one core. So the batch is cut into shards, which are
+    searched in a pool of worker processes, all sharing the one copy of
+    the graph through its memory-mapped snapshot. The answers come back
+    in the same order as `keys` however the shards finish. Batches too
+    small to share out are answered here, as are ones we can't hand to the
+    workers (if the snapshot can't be written or changes under us, or a
+    worker dies, in which case the next batch gets a new pool).
+    """
+    limits = limits or {}
+    processes = processes or config.query_processes
+    shards = shard_keys(keys, processes * SHARDS_PER_PROCESS)
+    if len(shards) < 2 or version is None:
+        yield from query_planner.iter_batch(graph, keys, limits)
+        return
+    pool = None
+    try:
+        path = shared_snapshot_path(graph_id, version, graph)
+        pool = get_process_pool(processes)
+        futures = [pool.submit(search_shard, path, version, shard, {key: limits.get(key) for key in shard},
+                               config.reachability_index)
+                   for shard in shards]
+        answers = {}
+        for future in futures:
+            answers.update(future.result())
+    except BrokenProcessPool:
+        discard_process_pool(pool)
+        yield from query_planner.iter_batch(graph, keys, limits)
+        return
+    except (OSError, SnapshotError):
+        yield from query_planner.iter_batch(graph, keys, limits)
+        return
+    for key in keys:
+        yield key, answers[key]
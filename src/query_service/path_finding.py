@@ -0,0 +1,307 @@
+from collections import deque
+from heapq import heappop, heappush
+from typing import Iterable, Iterator
+
+from src.query_service.graph_cache import CSRGraph
+
+
+def iter_all_paths(graph: CSRGraph, start: str, end: str) -> Iterator[tuple]:
+    """Yield every simple path from start to end, with its total cost.
+
+    This is the in-memory version of the find_all_paths() SQL function,
+    and yields the same (path, total_cost) rows. It's a depth first search
+    which backtracks, so we keep one path and a flag per node for "is this
+    node on the current path", instead of a copy of the path for every
+    item on the stack. We never step onto a node that can't reach the
+    end (see nodes_reaching()), so the search doesn't wander down dead
+    ends, however much of the graph they lead to.
+    """
+    if start == end:
+        yield [start], 0.0
+        return
+    start_id = graph.node_id(start)
+    end_id = graph.node_id(end)
+    if start_id is None or end_id is None or not is_reachable(graph, start_id, end_id):
+        return
+    can_reach = nodes_reaching(graph, [end_id])
+
+    on_path = bytearray(len(graph))
+    on_path[start_id] = 1
+    path = [start_id]
+    path_costs = [0.0]
+    stack = [graph.neighbours(start_id)]
+    while stack:
+        for next_node, edge_cost in stack[-1]:
+            if on_path[next_node]:
+                continue  # Skip this node to avoid cycles
+            if not can_reach[next_node]:
+                continue  # A dead end
+            total_cost = path_costs[-1] + edge_cost
+            if next_node == end_id:
+                yield [graph.names[node] for node in path] + [end], total_cost
+                continue
+            # Go deeper, and come back to the rest of this node's neighbours later
+            on_path[next_node] = 1
+            path.append(next_node)
+            path_costs.append(total_cost)
+            stack.append(graph.neighbours(next_node))
+            break
+        else:
+            # Every neighbour has been explored, so backtrack
+            stack.pop()
+            on_path[path.pop()] = 0
+            path_costs.pop()
+
+
+def find_all_paths(graph: CSRGraph, start: str, end: str) -> list:
+    return list(iter_all_paths(graph, start, end))
+
+
+def find_all_paths_from(graph: CSRGraph, start: str, ends: Iterable[str]) -> dict:
+    """Find every simple path from start to each of `ends`, with a single search.
+
+    Returns {end: [(path, total_cost), ...]}, the same rows
+    find_all_paths() gives for each end, in the same order. It's the same
+    depth first search as iter_all_paths(), but it records a path whenever
+    it reaches any of the ends, and only stops at an end if there are no
+    others it could lead to.
+    """
+    results = {end: [] for end in ends}
+    if start in results:
+        results[start] = [([start], 0.0)]
+    start_id = graph.node_id(start)
+    if start_id is None:
+        return results
+    targets = reachable_targets(graph, start_id, results)
+    if not targets:
+        return results
+    pass_through_targets = len(targets) > 1
+    can_reach = nodes_reaching(graph, list(targets))
+
+    on_path = bytearray(len(graph))
+    on_path[start_id] = 1
+    path = [start_id]
+    path_costs = [0.0]
+    stack = [graph.neighbours(start_id)]
+    while stack:
+        for next_node, edge_cost in stack[-1]:
+            if on_path[next_node]:
+                continue  # Skip this node to avoid cycles
+            if not can_reach[next_node]:
+                continue  # A dead end
+            total_cost = path_costs[-1] + edge_cost
+            if next_node in targets:
+                results[targets[next_node]].append(([graph.names[node] for node in path] + [targets[next_node]],
+                                                    total_cost))
+                if not pass_through_targets:
+                    continue
+            on_path[next_node] = 1
+            path.append(next_node)
+            path_costs.append(total_cost)
+            stack.append(graph.neighbours(next_node))
+            break
+        else:
+            stack.pop()
+            on_path[path.pop()] = 0
+            path_costs.pop()
+    return results
+
+
+def is_reachable(graph: CSRGraph, start_id: int, end_id: int) -> bool:
+    """Whether there's any path from start to end, by a bidirectional breadth first search.
+
+    We search forwards from start and backwards from end, a level at a
+    time, always growing whichever side has seen less, and stop as soon
+    as they meet. When end can't be reached, one side usually runs out
+    after exploring a small corner of the graph, so we find out long
+    before a full search from start would have. With a reachability
+    index, it's a single lookup instead.
+    """
+    if start_id == end_id:
+        return True
+    if graph.reachability is not None:
+        return graph.reachability.reaches(start_id, end_id)
+    seen = ({start_id}, {end_id})
+    frontiers = ([start_id], [end_id])
+    while frontiers[0] and frontiers[1]:
+        side = 0 if len(seen[0]) <= len(seen[1]) else 1
+        edges = graph.neighbours if side == 0 else graph.predecessors
+        next_frontier = []
+        for node in frontiers[side]:
+            for next_node, _ in edges(node):
+                if next_node in seen[1 - side]:
+                    return True
+                if next_node not in seen[side]:
+                    seen[side].add(next_node)
+                    next_frontier.append(next_node)
+        frontiers = (next_frontier, frontiers[1]) if side == 0 else (frontiers[0], next_frontier)
+    return False
+
+
+class ReachesTarget:
+    """Flags for which nodes can reach `target`, looked up in a reachability index as they're asked for."""
+
+    def __init__(self, index, target: int):
+        self.index = index
+        self.target = target
+
+    def __getitem__(self, node: int) -> bool:
+        return self.index.reaches(node, self.target)
+
+
+def nodes_reaching(graph: CSRGraph, target_ids: list):
+    """Which nodes can reach any of `target_ids`, as flags indexed by node.
+
+    A path search only needs to step onto these: from anywhere else, the
+    targets are out of reach, and everything past it is a dead end. For a
+    single target of a graph with a reachability index, that's a lookup.
+    Otherwise it's a breadth first search backwards from the targets,
+    which only visits the nodes it's looking for, so for a target that few
+    nodes lead to it's quick however big the graph is.
+    """
+    if graph.reachability is not None and len(target_ids) == 1:
+        return ReachesTarget(graph.reachability, target_ids[0])
+    can_reach = bytearray(len(graph))
+    queue = deque(target_ids)
+    for target in target_ids:
+        can_reach[target] = 1
+    while queue:
+        for previous_node, _ in graph.predecessors(queue.popleft()):
+            if not can_reach[previous_node]:
+                can_reach[previous_node] = 1
+                queue.append(previous_node)
+    return can_reach
+
+
+def reachable_targets(graph: CSRGraph, start_id: int, ends: Iterable[str]) -> dict:
+    """Map node -> end name for each of `ends` (other than start) that start can reach.
+
+    With a reachability index, each end is a lookup, and a single end gets
+    is_reachable()'s bidirectional search. Otherwise one breadth first
+    search forwards from start marks them all, stopping once it has found
+    every end, so a batch of ends costs no more than one.
+    """
+    wanted = {}
+    for end in ends:
+        end_id = graph.node_id(end)
+        if end_id is not None and end_id != start_id:
+            wanted[end_id] = end
+    if graph.reachability is not None or len(wanted) < 2:
+        return {end_id: end for end_id, end in wanted.items() if is_reachable(graph, start_id, end_id)}
+    targets = {}
+    seen = bytearray(len(graph))
+    seen[start_id] = 1
+    queue = deque([start_id])
+    while queue and len(targets) < len(wanted):
+        for next_node, _ in graph.neighbours(queue.popleft()):
+            if not seen[next_node]:
+                seen[next_node] = 1
+                queue.append(next_node)
+                if next_node in wanted:
+                    targets[next_node] = wanted[next_node]
+    return {end_id: end for end_id, end in wanted.items() if end_id in targets}
+
+
+def find_cheapest_path(graph: CSRGraph, start: str, end: str) -> list:
+    """Find the cheapest path from start to end with a bidirectional version of Dijkstra's algorithm.
+
+    Rather than enumerating every path and sorting them, we always expand
+    the cheapest node we haven't finished yet, using a binary heap. Here
+    there are two searches, one forwards from start and one backwards from
+    end, taking turns by whichever has the cheaper node to expand next.
+    Every time they touch, we've found a path. Once the two cheapest
+    unfinished nodes together cost at least as much as the best path
+    found, nothing cheaper is left. Each search only has to get about half
+    way, which on big graphs means exploring far fewer nodes. Returns
+    [(path, total_cost)], or [] if there's no path, the same shape as
+    find_all_paths().
+    """
+    if start == end:
+        return [([start], 0.0)]
+    start_id = graph.node_id(start)
+    end_id = graph.node_id(end)
+    if start_id is None or end_id is None or not is_reachable(graph, start_id, end_id):
+        return []
+
+    best_costs = ({start_id: 0.0}, {end_id: 0.0})
+    links = ({}, {})  # Forwards: node -> the node before it. Backwards: node -> the node after it.
+    done = (set(), set())
+    heaps = ([(0.0, start_id)], [(0.0, end_id)])
+    best_cost = float("inf")
+    meeting_node = None
+    while heaps[0] and heaps[1]:
+        if heaps[0][0][0] + heaps[1][0][0] >= best_cost:
+            break
+        side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+        cost, node = heappop(heaps[side])
+        if node in done[side]:
+            continue  # A stale heap entry, we've already found a cheaper way here
+        done[side].add(node)
+        edges = graph.neighbours(node) if side == 0 else graph.predecessors(node)
+        for next_node, edge_cost in edges:
+            next_cost = cost + edge_cost
+            if next_node not in done[side] and next_cost < best_costs[side].get(next_node, float("inf")):
+                best_costs[side][next_node] = next_cost
+                links[side][next_node] = node
+                heappush(heaps[side], (next_cost, next_node))
+            if next_node in best_costs[1 - side]:
+                # The two searches have touched, at the cheapest way each knows to get here
+                path_cost = best_costs[0][next_node] + best_costs[1][next_node]
+                if path_cost < best_cost:
+                    best_cost = path_cost
+                    meeting_node = next_node
+    if meeting_node is None:
+        return []
+    path = rebuild_path(graph, links[0], meeting_node)
+    node = meeting_node
+    while node in links[1]:
+        node = links[1][node]
+        path.append(graph.names[node])
+    return [(path, best_cost)]
+
+
+def find_cheapest_paths_from(graph: CSRGraph, start: str, ends: Iterable[str]) -> dict:
+    """Find the cheapest path from start to each of `ends`, with one run of Dijkstra's algorithm.
+
+    Returns {end: [(path, total_cost)]}, or {end: []} for ends that can't
+    be reached. The search stops once every end has been finished.
+    """
+    results = {end: [] for end in ends}
+    if start in results:
+        results[start] = [([start], 0.0)]
+    start_id = graph.node_id(start)
+    if start_id is None:
+        return results
+    # Leave out ends we can't reach, so we don't search everything looking for them
+    targets = reachable_targets(graph, start_id, results)
+
+    best_costs = {start_id: 0.0}
+    previous = {}
+    done = bytearray(len(graph))
+    heap = [(0.0, start_id)]
+    remaining = len(targets)
+    while heap and remaining:
+        cost, node = heappop(heap)
+        if done[node]:
+            continue  # A stale heap entry, we've already found a cheaper way here
+        done[node] = 1
+        if node in targets:
+            results[targets[node]] = [(rebuild_path(graph, previous, node), cost)]
+            remaining -= 1
+            if not remaining:
+                break
+        for next_node, edge_cost in graph.neighbours(node):
+            next_cost = cost + edge_cost
+            if not done[next_node] and next_cost < best_costs.get(next_node, float("inf")):
+                best_costs[next_node] = next_cost
+                previous[next_node] = node
+                heappush(heap, (next_cost, next_node))
+    return results
+
+
+def rebuild_path(graph: CSRGraph, previous: dict, end_id: int) -> list:
+    """Follow the `previous` links back from the end node, and return the path by name."""
+    path = [end_id]
+    while path[-1] in previous:
+        path.append(previous[path[-1]])
+    return [graph.names[node] for node in reversed(path)]
@@ -1,68 +1,231 @@
+import itertools
 import json
 import sys
 
 import psycopg2
 
-from src.db_connection.postgres import get_db_connection
+import config
+from src.db_connection.postgres import pooled_connection
+from src.query_service import parallel_search, query_planner, result_cache
+from src.query_service.graph_cache import GraphCache, get_graph_version
+from src.query_service.reachability import load_indexed_snapshot
+
+# Graphs loaded into memory (or mapped from their snapshots). They're kept for as
+# long as this process runs, and reloaded if their version in the DB changes.
+graph_cache = GraphCache(load_snapshot=load_indexed_snapshot)
+
+# Answers to queries we've seen before. See RESULT_CACHE in config.py.
+memory_result_cache = result_cache.ResultCache(config.result_cache_max_bytes)
+database_result_cache = result_cache.DatabaseResultCache(config.result_cache_max_bytes)
+
+
+QUERY_TYPES = ("paths", "cheapest", "cycles")
+RESPONSE_FORMATS = ("json", "ndjson")
+
+INVALID_FORMAT_MESSAGE = (
+    "Invalid format. Please try again. Valid format looks like: "
+    '{"queries": [{"paths": {"start": "node id","end": "node id"}}, '
+    '{"cheapest": {"start": "node id", "end": "node id"}}, {"cycles": {}}]}. '
+    'Optionally, a paths query can have a "limit" (the most paths to return), and the document a '
+    '"format" ("json" or "ndjson") and a "graph_id".')
 
 
 def get_graph_id():
+    """The graph to query when the query document doesn't say.
+
+    That's GRAPH_ID if it's set, or else the graph setup last inserted,
+    which it records in graph_id.txt.
+    """
+    if config.default_graph_id:
+        return config.default_graph_id
+    if config.last_ingested_graph_id:
+        return config.last_ingested_graph_id
     with open("graph_id.txt", "r") as file:
         return file.read().strip()
 
 
+def resolve_graph_id(queries):
+    return queries.get("graph_id") or get_graph_id()
+
+
 def get_query_type_and_nodes(query):
     if "paths" in query:
         query_type = "paths"
+    elif "cycles" in query:
+        # Cycles are a property of the whole graph, there are no start or end nodes
+        return "cycles", None, None
     else:
         query_type = "cheapest"
     return query_type, query[query_type]["start"], query[query_type]["end"]
 
 
-def process_queries(queries):
-    graph_id = get_graph_id()
-    results = {}
+def get_query_limit(query):
+    """The most paths a paths query wants back, or None for all of them."""
+    return query["paths"].get("limit") if "paths" in query else None
+
+
+def distinct_queries(queries) -> list:
+    """The (start, end, query_type) of each distinct query, in the order they were asked."""
+    return list(dict.fromkeys(
+        (start, end, query_type)
+        for query_type, start, end in map(get_query_type_and_nodes, queries["queries"])))
+
+
+def query_limits(queries) -> dict:
+    """Map (start, end, query_type) to the limit asked for, the first time each query was asked."""
+    limits = {}
+    for query in queries["queries"]:
+        query_type, start, end = get_query_type_and_nodes(query)
+        limits.setdefault((start, end, query_type), get_query_limit(query))
+    return limits
+
+
+def process_queries(queries, conn=None):
+    try:
+        return dict(iter_query_results(queries, conn))
+    except psycopg2.Error as e:
+        print(f"Database error: {e}")
+        return None
+
+
+def iter_query_results(queries, conn=None, lazy=False):
+    """Yield ((start, end, query_type), paths) for each distinct query, as soon as it's answered.
+
+    With `lazy`, the paths for a paths query come as an iterator rather
+    than a list, which has to be used up before asking for the next
+    result. They're read from a server-side cursor, or generated by the
+    in-memory search, as they're needed, so memory stays bounded however
+    many paths there are. Results we've answered before come from the
+    result cache, if there is one. The connection is held until the last
+    result has been yielded. Database problems are raised as
+    psycopg2.Error.
+    """
+    graph_id = resolve_graph_id(queries)
+    keys = distinct_queries(queries)
+    limits = query_limits(queries)
 
-    with get_db_connection() as conn:
+    with pooled_connection() if conn is None else conn as conn:
         with conn.cursor() as cur:
-            for query in queries["queries"]:
-                query_type, start, end = get_query_type_and_nodes(query)
-                other_query_type = "cheapest" if query_type == "paths" else "paths"
+            graph = graph_cache.get(cur, graph_id) if config.query_engine == "memory" else None
+            cache = get_result_cache()
+            if cache is not None:
+                version = graph_cache.version(graph_id, graph) if graph is not None else get_graph_version(cur, graph_id)
+                if version is None:
+                    cache = None  # No such graph, or one we can't tell the version of
+            cached = {}
+            if cache is not None:
+                for key in keys:
+                    result = cache.get(cur, graph_id, version, (*key, limits[key]))
+                    if result is not None:
+                        cached[key] = result
+            missing = [key for key in keys if key not in cached]
 
-                if (start, end, query_type) in results:
+            if not missing:
+                answers = iter(())
+            elif graph is not None and config.query_processes > 1 and not lazy:
+                answers = parallel_search.iter_batch(
+                    graph_id, graph_cache.version(graph_id, graph), graph, missing, limits)
+            elif graph is not None:
+                answers = query_planner.iter_batch(graph, missing, limits, lazy)
+            else:
+                answers = iter_database_results(cur, graph_id, missing, limits, lazy)
+            for key in keys:
+                if key in cached:
+                    yield key, cached[key]
                     continue
-                if (start, end, other_query_type) in results:
-                    # Don't hit DB again for the same set of nodes. Both query types
-                    # share the same results, we just pull out different info.
-                    results[(start, end, query_type)] = results[(start, end, other_query_type)]
-                    continue
-                else:
-                    try:
-                        cur.execute("SELECT * FROM find_all_paths(%s, %s, %s);",
-                                    (start, end, graph_id))
-                        paths = cur.fetchall()
-                        results[(start, end, query_type)] = paths
-                    except psycopg2.Error as e:
-                        print(f"Database error: {e}")
-                        return None
-    return results
+                _, paths = next(answers)
+                if cache is not None:
+                    paths = result_cache.cache_results(cache, cur, graph_id, version, (*key, limits[key]), paths)
+                yield key, paths
+
+
+def iter_database_results(cur, graph_id, keys, limits, lazy=False):
+    """Yield ((start, end, query_type), paths) for each of `keys`, using the PL/pgSQL functions."""
+    paths_results = {}
+    for start, end, query_type in keys:
+        if query_type == "cheapest" and (start, end) in paths_results:
+            # We already have every path between these nodes, so the
+            # cheapest one is in there. No need to search again.
+            yield (start, end, query_type), paths_results[(start, end)]
+            continue
+        limit = limits[(start, end, query_type)]
+        paths = find_paths(cur, graph_id, query_type, start, end, limit, lazy)
+        if query_type == "paths" and limit is None and not lazy:
+            paths_results[(start, end)] = paths
+        yield (start, end, query_type), paths
+
+
+def get_result_cache():
+    """The result cache RESULT_CACHE asks for, or None if it's turned off."""
+    if config.result_cache == "memory":
+        return memory_result_cache
+    if config.result_cache == "database":
+        return database_result_cache
+    return None
+
+
+# Server-side cursors need a name that's unique within their session
+cursor_ids = itertools.count()
+
+
+def find_paths(cur, graph_id, query_type, start, end, limit=None, lazy=False):
+    """Answer a single query with the PL/pgSQL functions, as a list of (path, total_cost) rows.
+
+    "cheapest" queries use Dijkstra's algorithm and return at most one row.
+    "cycles" queries return a list of cycles, each one a list of nodes.
+    Only "paths" queries enumerate every path, up to `limit` of them, and
+    with `lazy` they come back as an iterator over a server-side cursor.
+    With the in-memory graph, query_planner.iter_batch() does this for a
+    whole batch at once.
+    """
+    if query_type == "cycles":
+        cur.execute("SELECT cycle_path FROM find_elementary_cycles(%s);", (graph_id,))
+        return [row[0] for row in cur.fetchall()]
+    if query_type == "cheapest":
+        cur.execute("SELECT * FROM find_cheapest_path(%s, %s, %s);", (start, end, graph_id))
+        return cur.fetchall()
+    if lazy:
+        return iter_paths_from_cursor(cur.connection, graph_id, start, end, limit)
+    if limit is None:
+        cur.execute("SELECT * FROM find_all_paths(%s, %s, %s);", (start, end, graph_id))
+    else:
+        cur.execute("SELECT * FROM find_all_paths(%s, %s, %s) LIMIT %s;", (start, end, graph_id, limit))
+    return cur.fetchall()
+
+
+def iter_paths_from_cursor(conn, graph_id, start, end, limit=None):
+    """Yield find_all_paths() rows through a server-side cursor, QUERY_FETCH_SIZE rows at a time.
+
+    A PL/pgSQL function builds its whole result on the database server
+    before returning any of it, so this doesn't make the search any
+    cheaper, but we only ever hold one fetch's worth of rows in Python.
+    """
+    with conn.cursor(name=f"paths_{next(cursor_ids)}") as named_cur:
+        named_cur.itersize = config.query_fetch_size
+        named_cur.execute("SELECT * FROM find_all_paths(%s, %s, %s) LIMIT %s;", (start, end, graph_id, limit))
+        yield from named_cur
 
 
 def tidy_up_results(results):
     """Clean up the results to make them easier to work with."""
-    tidy_results = []
-    for (start, end, query_type), paths in results.items():
-        if query_type == "paths":
-            tidy_result = format_paths_result(start, end, paths)
-        else:
-            tidy_result = format_cheapest_result(start, end, paths)
-        tidy_results.append(tidy_result)
+    tidy_results = [tidy_up_result(key, paths) for key, paths in results.items()]
     # tidy_results looks like:
     # [ ("paths", "a", "c", [["a","b","c"], ["a","c"], ...]), ("cheapest", "a", "c", ["a","c"]), ... ]
     return tidy_results
 
+def tidy_up_result(key, paths):
+    start, end, query_type = key
+    if query_type == "paths":
+        return format_paths_result(start, end, paths)
+    if query_type == "cycles":
+        return format_cycles_result(paths)
+    return format_cheapest_result(start, end, paths)
+
 def format_paths_result(start, end, paths):
-    paths_list = [path[0] for path in paths]  # Drop the cost info
+    if isinstance(paths, list):
+        paths_list = [path[0] for path in paths]  # Drop the cost info
+    else:
+        paths_list = (path[0] for path in paths)  # Keep lazy results lazy
     return "paths", start, end, paths_list
 
 def format_cheapest_result(start, end, paths):
@@ -73,19 +236,68 @@ def format_cheapest_result(start, end, paths):
     cheapest_path = sorted_list[0][0] if sorted_list else False
     return "cheapest", start, end, cheapest_path
 
+def format_cycles_result(cycles):
+    return "cycles", None, None, cycles
+
+
+def format_answer(result):
+    query_type, start, end, data = result
+    if query_type == "cycles":
+        return {query_type: {"cycles": data}}
+    return {query_type: {"from": start, "to": end, "paths": data}}
 
-def format_results_to_json(results):
-    formatted_results = {"answers": []}
-    for result in results:
-        query_type, start, end, data = result
-        formatted_result = {
-            query_type: {"from": start, "to": end, "paths": data}
-        }
-        formatted_results["answers"].append(formatted_result)
 
+def format_results_to_json(results):
+    formatted_results = {"answers": [format_answer(result) for result in results]}
     return json.dumps(formatted_results, indent=2)
 
 
+def iter_ndjson_answers(queries, conn=None):
+    """Yield the answers as NDJSON text, one compact JSON answer per line.
+
+    Unlike format_results_to_json(), nothing waits for the whole batch:
+    each answer is sent as soon as it's ready, so a client can start
+    reading while later queries are still being searched. The paths come
+    from iter_query_results() lazily, and are written out a few hundred
+    at a time, so even an answer with millions of paths never has to be
+    held at once. A database problem ends the stream with an
+    {"error": ...} line.
+    """
+    line_started = False
+    try:
+        for key, paths in iter_query_results(queries, conn, lazy=True):
+            for text in iter_answer_chunks(tidy_up_result(key, paths)):
+                line_started = True
+                yield text
+            yield "\n"
+            line_started = False
+    except psycopg2.Error as e:
+        print(f"Database error: {e}", file=sys.stderr)
+        # Don't leave the error on the end of a half-written answer
+        yield ("\n" if line_started else "") + json.dumps({"error": "Problem querying the database."}) + "\n"
+
+
+ANSWER_CHUNK_PATHS = 500
+
+
+def iter_answer_chunks(result):
+    """Yield the compact JSON for one answer in pieces. Joined up, it's json.dumps(format_answer(result))."""
+    query_type, start, end, data = result
+    if isinstance(data, (list, bool)):
+        yield json.dumps(format_answer(result))
+        return
+    yield f'{{{json.dumps(query_type)}: {{"from": {json.dumps(start)}, "to": {json.dumps(end)}, "paths": ['
+    separator = ""
+    while chunk := list(itertools.islice(data, ANSWER_CHUNK_PATHS)):
+        yield separator + ", ".join(json.dumps(path) for path in chunk)
+        separator = ", "
+    yield "]}}"
+
+
+def get_response_format(queries):
+    return queries.get("format", config.response_format)
+
+
 def verify_correct_query_format(queries):
     if "queries" not in queries:
         return False
@@ -94,16 +306,25 @@ def verify_correct_query_format(queries):
     for query in queries["queries"]:
         if not isinstance(query, dict):
             return False
-        if "paths" not in query and "cheapest" not in query:
+        if sum(query_type in query for query_type in QUERY_TYPES) != 1:
             return False
-        if "paths" in query and "cheapest" in query:
+        if "cycles" in query and not isinstance(query["cycles"], dict):
             return False
         if "paths" in query and ("start" not in query["paths"] or "end" not in query["paths"]):
             return False
+        if "paths" in query and not valid_limit(query["paths"].get("limit")):
+            return False
         if "cheapest" in query and ("start" not in query["cheapest"] or "end" not in query["cheapest"]):
             return False
+    if queries.get("format", "json") not in RESPONSE_FORMATS:
+        return False
+    if "graph_id" in queries and not isinstance(queries["graph_id"], str):
+        return False
     return True
 
+def valid_limit(limit):
+    return limit is None or (isinstance(limit, int) and not isinstance(limit, bool) and limit >= 0)
+
 def verify_valid_json(query):
     try:
         return json.loads(query)
@@ -111,21 +332,47 @@ def verify_valid_json(query):
         return None
 
 
-def receive_and_send_query():
-    query_str = sys.stdin.read()
+def answer_query(query_str, conn=None):
+    """Turn a JSON query document into the text of the response.
+
+    This is shared by the stdin listener below and the long-running query
+    server. Without a `conn`, one is borrowed from the connection pool.
+    """
+    return "".join(iter_response(query_str, conn)).rstrip("\n")
+
+
+def iter_response(query_str, conn=None):
+    """Yield the text of the response to a JSON query document, in pieces.
+
+    Normally that's a single pretty-printed JSON document, once every
+    query has been answered. With "format": "ndjson" in the query document
+    (or RESPONSE_FORMAT=ndjson), each answer is its own line, sent as soon
+    as it's ready. Every line ends in a newline.
+    """
     query = verify_valid_json(query_str)
 
     if not query or not verify_correct_query_format(query):
-        print("Invalid format. Please try again. Valid format looks like: "
-              '{"queries": [{"paths": {"start": "node id","end": "node id"}}, '
-              '{"cheapest": {"start": "node id", "end": "node id"}}]}', flush=True)
+        yield INVALID_FORMAT_MESSAGE + "\n"
+        return
+
+    if get_response_format(query) == "ndjson":
+        yield from iter_ndjson_answers(query, conn)
         return
 
-    results = process_queries(query)
+    results = process_queries(query, conn)
+    if results is None:
+        yield "Problem querying the database.\n"
+        return
     tidy_results = tidy_up_results(results)
-    result = format_results_to_json(tidy_results)
-    print(result, flush=True)
+    yield format_results_to_json(tidy_results) + "\n"
+
 
+def receive_and_send_query():
+    query_str = sys.stdin.read()
+    for text in iter_response(query_str):
+        sys.stdout.write(text)
+        if text.endswith("\n"):
+            sys.stdout.flush()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,79 @@
+from itertools import islice
+from typing import Iterator, Optional
+
+from src.query_service import cycle_finding, path_finding
+from src.query_service.graph_cache import CSRGraph
+
+
+def plan_searches(keys: list) -> dict:
+    """Group a batch's (start, end, query_type) keys into one search per start node and query type.
+
+    Returns {(query_type, start): [end, ...]}. A cheapest query between
+    nodes which also have a paths query doesn't need a search of its own,
+    since the cheapest path is one of the paths we'll find anyway.
+    """
+    paths_pairs = {(start, end) for start, end, query_type in keys if query_type == "paths"}
+    searches = {}
+    for start, end, query_type in keys:
+        if query_type == "cheapest" and (start, end) in paths_pairs:
+            continue
+        ends = searches.setdefault((query_type, start), [])
+        if end not in ends:
+            ends.append(end)
+    return searches
+
+
+def answer_batch(graph: CSRGraph, keys: list) -> dict:
+    """Answer a batch of queries against the in-memory graph.
+
+    Rather than one search per query, this does one search per distinct
+    start node: a single run of Dijkstra's algorithm finds the cheapest
+    path to every end asked for, and a single depth first search finds
+    every path to all of them. So a batch of 200 queries from the same
+    node costs about as much as one. The results come back keyed and
+    ordered by `keys`, the same as searching for each one separately.
+    """
+    return dict(iter_batch(graph, keys))
+
+
+def iter_batch(graph: CSRGraph, keys: list, limits: Optional[dict] = None, lazy: bool = False) -> Iterator[tuple]:
+    """Yield (key, paths) for each of `keys` in order, as answer_batch() works through them.
+
+    Each search runs when the first query which needs it comes up, and
+    its answers for later queries are held until their turn. Paths
+    queries with a limit in `limits`, or all of them when `lazy`, get a
+    search of their own instead, which stops as soon as it's found enough
+    paths. With `lazy` their paths are an iterator, generated as they're
+    read, rather than a list.
+    """
+    limits = limits or {}
+    own_search = {key for key in keys if key[2] == "paths" and (lazy or limits.get(key) is not None)}
+    shared_keys = [key for key in keys if key not in own_search]
+    searches = plan_searches(shared_keys)
+    paths_pairs = {(start, end) for start, end, query_type in shared_keys if query_type == "paths"}
+    answers = {}
+    for key in keys:
+        start, end, query_type = key
+        if key in own_search:
+            paths = islice(path_finding.iter_all_paths(graph, start, end), limits.get(key))
+            yield key, paths if lazy else list(paths)
+            continue
+        # Cheapest queries which plan_searches() folded into a paths search get that search's answer
+        search_type = "paths" if query_type == "cheapest" and (start, end) in paths_pairs else query_type
+        if (search_type, start, end) not in answers:
+            answers.update(run_search(graph, search_type, start, searches.pop((search_type, start))))
+        yield key, answers[(search_type, start, end)]
+
+
+def run_search(graph: CSRGraph, query_type: str, start: str, ends: list) -> dict:
+    """Run one planned search, and return its answers keyed by (query_type, start, end)."""
+    if query_type == "cycles":
+        return {("cycles", None, None): cycle_finding.find_cycles(graph)}
+    if query_type == "cheapest" and len(ends) == 1:
+        # With only one end, searching from both ends at once explores less
+        paths_by_end = {ends[0]: path_finding.find_cheapest_path(graph, start, ends[0])}
+    elif query_type == "cheapest":
+        paths_by_end = path_finding.find_cheapest_paths_from(graph, start, ends)
+    else:
+        paths_by_end = path_finding.find_all_paths_from(graph, start, ends)
+    return {(query_type, start, end): paths for end, paths in paths_by_end.items()}
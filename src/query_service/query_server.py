@@ -0,0 +1,130 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import config
+from src.db_connection.postgres import close_connection_pool
+from src.query_service import parallel_search
+from src.query_service.query_listener import INVALID_FORMAT_MESSAGE, iter_response
+
+# Clients send a JSON query document, then either close their end of the
+# socket or send this byte. JSON can't contain a raw NUL, so it's a safe
+# terminator for clients (like bash's /dev/tcp) that can't half-close.
+END_OF_REQUEST = b"\0"
+
+
+class RequestTooLarge(Exception):
+    """The client sent more than we're willing to read as one request."""
+
+
+async def read_request(reader: asyncio.StreamReader, max_bytes: Optional[int] = None) -> str:
+    """Read one request from the socket, up to END_OF_REQUEST or EOF.
+
+    Raises RequestTooLarge if it goes on for more than `max_bytes`, and
+    UnicodeDecodeError if it isn't UTF-8.
+    """
+    data = bytearray()
+    while chunk := await reader.read(64 * 1024):
+        end = chunk.find(END_OF_REQUEST)
+        data += chunk if end == -1 else chunk[:end]
+        if max_bytes is not None and len(data) > max_bytes:
+            raise RequestTooLarge(f"Request is too large. The most we'll read is {max_bytes} bytes.")
+        if end != -1:
+            break
+    return data.decode()
+
+
+class QueryServer:
+    """Answers queries over TCP, in the same JSON format as query_listener.py.
+
+    Unlike running query_listener.py for every query, this process stays
+    up, so the pooled DB connections, the graph cache, and the imports are
+    all already warm when a query arrives.
+
+    Connections are accepted by an asyncio event loop, so any number of
+    clients can be connected at once. The queries themselves (searches and
+    DB calls, which block) run on a pool of `workers` threads, each piece
+    of a response being produced in a worker and then written out. After
+    each piece we wait for that client's socket to drain before producing
+    the next one, so a client reading a huge answer slowly only holds up
+    its own query, and we never buffer more of its answer than the socket
+    will take. At most `workers` responses are in progress at once (each
+    may be holding a pooled connection while it waits on its client),
+    and other requests wait their turn.
+    """
+
+    def __init__(self, host: str, port: int, workers: Optional[int] = None, max_request_bytes: Optional[int] = None):
+        self.host = host
+        self.port = port
+        self.workers = workers or config.query_server_workers
+        self.max_request_bytes = max_request_bytes or config.query_server_max_request_bytes
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="query")
+        self._active = asyncio.Semaphore(self.workers)
+        self._server = None
+
+    async def start(self) -> asyncio.AbstractServer:
+        self._server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        return self._server
+
+    @property
+    def address(self) -> tuple:
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        parallel_search.shutdown_process_pool()
+        close_connection_pool()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                query_str = await read_request(reader, self.max_request_bytes)
+            except RequestTooLarge as e:
+                writer.write(f"{e}\n".encode())
+                await writer.drain()
+                return
+            except UnicodeDecodeError:
+                writer.write(f"{INVALID_FORMAT_MESSAGE}\n".encode())
+                await writer.drain()
+                return
+            async with self._active:
+                await self.send_response(query_str, writer)
+        except ConnectionError:
+            pass  # The client went away, there's no one to answer
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def send_response(self, query_str: str, writer: asyncio.StreamWriter):
+        """Write the response to `writer` a piece at a time, as each is ready and the client keeps up."""
+        loop = asyncio.get_running_loop()
+        chunks = iter(iter_response(query_str))
+        try:
+            while (text := await loop.run_in_executor(self._executor, next, chunks, None)) is not None:
+                writer.write(text.encode())
+                await writer.drain()
+        finally:
+            # If the client left part way through, this gives the query's pooled connection back
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                await loop.run_in_executor(self._executor, close)
+
+
+async def run_query_server(host: str, port: int):
+    server = QueryServer(host, port)
+    listening = await server.start()
+    print(f"Waiting for queries on port {port}...", flush=True)
+    try:
+        await listening.serve_forever()
+    finally:
+        await server.stop()
+
+
+def serve_queries():
+    asyncio.run(run_query_server(config.query_server_host, config.query_server_port))
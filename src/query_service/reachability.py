@@ -0,0 +1,139 @@
+from array import array
+import mmap
+import os
+import struct
+from typing import Optional
+
+import config
+from src.query_service.cycle_finding import strongly_connected_components
+from src.query_service.graph_cache import CSRGraph
+from src.query_service.graph_snapshot import (
+    BYTE_ORDER, SnapshotError, SnapshotGraph, load_current_snapshot, padding)
+
+# A reachability index file is this header:
+#   magic, format version, byte order, graph version (-1 if there isn't one),
+#   node count, component count, label bytes
+# and then, each padded to a multiple of 8 bytes:
+#   components: node count int64s, each node's strongly connected component
+#   label offsets: component count + 1 int64s into the labels
+#   labels: for each component, a bitset of the components it can reach
+MAGIC = b"REACHIDX"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIqqqq")
+
+
+class ReachabilityIndex:
+    """Answers "is there any path from this node to that one?" with a single lookup.
+
+    Every node in a strongly connected component can reach every other, so
+    we only need to know which components reach which. Components are
+    numbered the way Tarjan's algorithm finishes them, which puts every
+    component after all the ones it can reach. So component c's label is a
+    bitset of c + 1 bits, with a bit set for each component it can reach
+    (itself included). Labels take about components² / 16 bytes, which is
+    why there's a limit on how big an index we'll build.
+    """
+
+    def __init__(self, version: Optional[int], components, label_offsets, labels,
+                 mapped: Optional[mmap.mmap] = None):
+        self.version = version
+        self.components = components
+        self.label_offsets = label_offsets
+        self.labels = labels
+        self._mapped = mapped  # The views above are only good while this is open
+
+    @classmethod
+    def build(cls, graph: CSRGraph, version: Optional[int] = None,
+              max_bytes: Optional[int] = None) -> Optional["ReachabilityIndex"]:
+        """Build the index for `graph`, or return None if its labels would take more than `max_bytes`."""
+        component = strongly_connected_components(graph)
+        component_count = max(component, default=-1) + 1
+        label_offsets = array("q", [0])
+        for number in range(component_count):
+            label_offsets.append(label_offsets[-1] + number // 8 + 1)
+        if max_bytes is not None and label_offsets[-1] > max_bytes:
+            return None
+
+        successors = [set() for _ in range(component_count)]
+        for node in range(len(graph)):
+            for next_node, _ in graph.neighbours(node):
+                if component[next_node] != component[node]:
+                    successors[component[node]].add(component[next_node])
+        # Every successor has a lower number, so its label is always ready before we need it
+        labels = []
+        for number in range(component_count):
+            label = 1 << number
+            for successor in successors[number]:
+                label |= labels[successor]
+            labels.append(label)
+        label_bytes = b"".join(label.to_bytes(number // 8 + 1, "little") for number, label in enumerate(labels))
+        return cls(version, array("q", component), label_offsets, label_bytes)
+
+    def reaches(self, source: int, target: int) -> bool:
+        source_component = self.components[source]
+        target_component = self.components[target]
+        if target_component > source_component:
+            return False
+        byte = self.labels[self.label_offsets[source_component] + (target_component >> 3)]
+        return bool(byte >> (target_component & 7) & 1)
+
+
+def index_path(snapshot_file: str) -> str:
+    """Where the index for the graph snapshot in `snapshot_file` goes."""
+    return os.path.splitext(snapshot_file)[0] + ".reach"
+
+
+def write_index(path: str, index: ReachabilityIndex) -> int:
+    """Write `index` to a file, and return its size in bytes. Like snapshots, it replaces the old one in one go."""
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, BYTE_ORDER, -1 if index.version is None else index.version,
+                         len(index.components), len(index.label_offsets) - 1, len(index.labels))
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as out:
+        for part in (header, index.components, index.label_offsets, index.labels, padding(len(index.labels))):
+            out.write(part)
+        size = out.tell()
+    os.replace(temp_path, path)
+    return size
+
+
+def load_index(path: str) -> ReachabilityIndex:
+    """Memory-map a reachability index file. Raises SnapshotError if it isn't a valid one."""
+    with open(path, "rb") as file:
+        try:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise SnapshotError(f"{path} is empty")
+    view = memoryview(mapped)
+    if len(view) < HEADER.size:
+        raise SnapshotError(f"{path} is too short to be a reachability index")
+    magic, format_version, byte_order, version, node_count, component_count, label_bytes = HEADER.unpack_from(view)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        raise SnapshotError(f"{path} isn't a reachability index we can read")
+    if byte_order != BYTE_ORDER:
+        raise SnapshotError(f"{path} was written on a machine with a different byte order")
+    components_end = HEADER.size + 8 * node_count
+    offsets_end = components_end + 8 * (component_count + 1)
+    if len(view) < offsets_end + label_bytes:
+        raise SnapshotError(f"{path} is truncated")
+    return ReachabilityIndex(None if version == -1 else version, view[HEADER.size:components_end].cast("q"),
+                             view[components_end:offsets_end].cast("q"),
+                             view[offsets_end:offsets_end + label_bytes], mapped)
+
+
+def attach_index(graph: SnapshotGraph) -> SnapshotGraph:
+    """Give a graph mapped from a snapshot its reachability index, if there's an up to date one beside it."""
+    try:
+        index = load_index(index_path(graph.path))
+    except (OSError, SnapshotError):
+        return graph
+    if index.version == graph.version and len(index.components) == len(graph):
+        graph.reachability = index
+    return graph
+
+
+def load_indexed_snapshot(graph_id: str, version) -> Optional[SnapshotGraph]:
+    """load_current_snapshot(), plus the graph's reachability index with REACHABILITY_INDEX."""
+    graph = load_current_snapshot(graph_id, version)
+    if graph is not None and config.reachability_index:
+        attach_index(graph)
+    return graph
@@ -0,0 +1,134 @@
+from collections import OrderedDict
+import json
+import threading
+from typing import Iterable, Iterator, Optional
+
+# Bookkeeping overhead we count for every entry, on top of the size of its result
+ENTRY_OVERHEAD = 200
+
+
+def estimate_size(result) -> int:
+    """Roughly how much memory a result takes. We use the length of its JSON, which tracks it closely enough."""
+    return len(json.dumps(result)) + ENTRY_OVERHEAD
+
+
+class ResultCache:
+    """Query results held in memory, with least recently used eviction.
+
+    Entries are keyed by graph_id and the query (start, end, query_type
+    and limit), and stamped with the graph's `version`, so once a graph is
+    re-ingested its old results are never returned. Once the estimated
+    size of everything held goes over `max_bytes`, the least recently
+    used results are dropped. This is for a long-running process like the
+    query server, where it lives as long as the process does.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # (graph_id, query_key) -> (version, result, size)
+        self._lock = threading.Lock()
+
+    def get(self, cur, graph_id: str, version, query_key: tuple):
+        """Return the cached result, or None if there isn't an up to date one."""
+        with self._lock:
+            entry = self._entries.get((graph_id, query_key))
+            if entry is None:
+                return None
+            if entry[0] != version:
+                self._remove((graph_id, query_key))
+                return None
+            self._entries.move_to_end((graph_id, query_key))
+            return entry[1]
+
+    def put(self, cur, graph_id: str, version, query_key: tuple, result: list, size: Optional[int] = None):
+        size = estimate_size(result) if size is None else size
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove((graph_id, query_key))
+            self._entries[(graph_id, query_key)] = (version, result, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+
+class DatabaseResultCache:
+    """Query results held in the public.query_results table, with least recently used eviction.
+
+    This works the same way as ResultCache, for when each query runs in a
+    new process (like query_listener.py run by hand), so an in-memory
+    cache would never see a repeat. The table is UNLOGGED, since it's
+    fine to lose it in a crash, and that makes writing to it cheaper.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+
+    def get(self, cur, graph_id: str, version, query_key: tuple):
+        cur.execute(
+            "UPDATE public.query_results SET last_used = clock_timestamp() "
+            "WHERE graph_id = %s AND query_key = %s AND version = %s RETURNING result",
+            (graph_id, json.dumps(query_key), version))
+        row = cur.fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, cur, graph_id: str, version, query_key: tuple, result: list, size: Optional[int] = None):
+        result_json = json.dumps(result)
+        size = len(result_json) + ENTRY_OVERHEAD if size is None else size
+        if size > self.max_bytes:
+            return
+        # Results from before the graph was last ingested are no use to anyone
+        cur.execute("DELETE FROM public.query_results WHERE graph_id = %s AND version <> %s", (graph_id, version))
+        cur.execute(
+            "INSERT INTO public.query_results (graph_id, version, query_key, result, size) "
+            "VALUES (%s, %s, %s, %s, %s) "
+            "ON CONFLICT (graph_id, query_key) DO UPDATE SET version = EXCLUDED.version, "
+            "result = EXCLUDED.result, size = EXCLUDED.size, last_used = clock_timestamp()",
+            (graph_id, version, json.dumps(query_key), result_json, size))
+        cur.execute(
+            "DELETE FROM public.query_results WHERE (graph_id, query_key) IN ("
+            "SELECT graph_id, query_key FROM ("
+            "SELECT graph_id, query_key, sum(size) OVER (ORDER BY last_used DESC) AS total_size "
+            "FROM public.query_results) AS newest_first WHERE total_size > %s)",
+            (self.max_bytes,))
+
+
+def cache_results(cache, cur, graph_id: str, version, query_key: tuple, result):
+    """Store a fresh result in `cache`, and return it for the caller to use.
+
+    Lazy results (iterators) are wrapped so they're stored once they've
+    been read to the end, unless they turn out too big to be worth it.
+    """
+    if isinstance(result, list):
+        cache.put(cur, graph_id, version, query_key, result)
+        return result
+    return iter_and_cache(cache, cur, graph_id, version, query_key, result)
+
+
+def iter_and_cache(cache, cur, graph_id: str, version, query_key: tuple, rows: Iterable) -> Iterator:
+    kept = []
+    size = ENTRY_OVERHEAD
+    for row in rows:
+        if kept is not None:
+            size += len(json.dumps(row)) + 2
+            if size > cache.max_bytes:
+                kept = None  # We'd never store it, so stop holding on to rows
+            else:
+                kept.append(row)
+        yield row
+    if kept is not None:
+        cache.put(cur, graph_id, version, query_key, kept, size)
@@ -0,0 +1,9 @@
+import pytest
+
+from sample_data import graph_samples
+from src.query_service.graph_cache import CSRGraph
+
+
+@pytest.fixture
+def g13():
+    return CSRGraph.from_edges(*graph_samples["g13"])
@@ -1,3 +1,9 @@
+import io
+
+from benchmarks.generator import write_graph_xml
+from src.downloader.setup import extract_graph_data, verify_graph_data
+from src.query_service.graph_cache import CSRGraph
+
 xml_samples = {
     "valid": """
         <graph>
@@ -556,3 +562,31 @@ json_samples = {
     "valid json": '{"some": "json"}',
     "incomplete": '{"some": "json"',
 }
+
+# (node names, (from, to, cost) edges) for building in-memory graphs.
+# These match the files in sample_graph_data/.
+graph_samples = {
+    "g13": (
+        ["a", "b", "c", "d", "e"],
+        [("a", "b", 1.0), ("b", "c", 1.0), ("a", "d", 1.5), ("d", "e", 0.5),
+         ("e", "c", 0.5), ("d", "c", 1.0), ("c", "a", 1.25), ("b", "b", 0.25)],
+    ),
+    "g10": (
+        ["a", "b", "c"],
+        [("a", "b", 10.0), ("b", "c", 20.0), ("a", "c", 15.0)],
+    ),
+}
+
+
+def generated_graph_xml(node_count, seed, shape="dag"):
+    """The XML of a graph from benchmarks.generator, for tests which need a bigger one."""
+    out = io.StringIO()
+    write_graph_xml(out, shape, node_count, seed)
+    return out.getvalue()
+
+
+def generated_graph(node_count, seed, shape="dag"):
+    """The same graph as generated_graph_xml(), parsed into an in-memory graph."""
+    _, xml_data = verify_graph_data(generated_graph_xml(node_count, seed, shape))
+    _, _, nodes, edges = extract_graph_data(xml_data)
+    return CSRGraph.from_edges([node_id for node_id, _ in nodes], [edge[1:] for edge in edges])
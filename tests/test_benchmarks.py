@@ -0,0 +1,66 @@
+import io
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import config
+from benchmarks.generator import GRAPH_SHAPES, write_graph_xml
+from benchmarks.runner import run_benchmark
+from src.downloader.setup import extract_graph_data, verify_graph_data
+
+
+def generate(shape, node_count, seed=0):
+    out = io.StringIO()
+    summary = write_graph_xml(out, shape, node_count, seed)
+    return summary, out.getvalue()
+
+
+@pytest.mark.parametrize("shape", GRAPH_SHAPES)
+def test_generated_graphs_are_valid(shape):
+    summary, xml_string = generate(shape, 50)
+    valid, root = verify_graph_data(xml_string)
+    assert valid
+    graph_id, _, nodes, edges = extract_graph_data(root)
+    assert graph_id == summary["graph_id"]
+    assert len(nodes) == summary["nodes"]
+    assert len(edges) == summary["edges"] > 0
+
+
+def test_generator_is_seeded():
+    assert generate("dense", 30, seed=1) == generate("dense", 30, seed=1)
+    assert generate("dense", 30, seed=1) != generate("dense", 30, seed=2)
+
+
+def test_dag_has_no_back_edges():
+    _, xml_string = generate("dag", 100)
+    _, _, _, edges = extract_graph_data(ET.fromstring(xml_string))
+    assert all(int(from_node[1:]) < int(to_node[1:]) for _, from_node, to_node, _ in edges)
+
+
+def test_grid_is_square():
+    summary, _ = generate("grid", 50)
+    assert summary["nodes"] == 49
+    assert summary["edges"] == 2 * 7 * 6
+
+
+def test_run_benchmark_with_stand_in(capsys):
+    endpoint = config.graph_data_endpoint
+    result = run_benchmark("dense", 40, seed=3, query_count=5, max_paths=10)
+
+    assert config.graph_data_endpoint == endpoint
+    assert set(result["phases"]) == {"download", "parse", "stream_parse", "insert", "load", "cheapest", "paths",
+                                     "query_batch", "query_batch_repeat"}
+    assert result["phases"]["parse"]["rows"] == result["nodes"] + result["edges"]
+    assert result["phases"]["stream_parse"]["rows"] == result["phases"]["parse"]["rows"]
+    assert result["phases"]["insert"]["backend"] == "stand-in"
+    assert result["phases"]["query_batch"]["queries"] == 10
+    assert result["phases"]["query_batch"]["response_bytes"] > 0
+    assert all(phase["seconds"] >= 0 for phase in result["phases"].values())
+    assert capsys.readouterr().out == ""
+
+
+def test_run_benchmark_gives_up_on_slow_paths_queries():
+    result = run_benchmark("dense", 300, seed=0, query_count=20, paths_timeout=0.2)
+
+    assert result["phases"]["paths"] == {"queries": 20, "max_paths": 1000, "seconds": 0.2, "timed_out": True}
+    assert result["phases"]["cheapest"]["queries"] == 20
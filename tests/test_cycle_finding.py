@@ -0,0 +1,50 @@
+from itertools import permutations
+
+from sample_data import graph_samples
+from src.query_service.cycle_finding import find_cycles, strongly_connected_components
+from src.query_service.graph_cache import CSRGraph
+
+
+def test_strongly_connected_components():
+    graph = CSRGraph.from_edges(
+        ["a", "b", "c", "d", "e"],
+        [("a", "b", 1.0), ("b", "a", 1.0), ("b", "c", 1.0), ("c", "d", 1.0), ("d", "c", 1.0), ("d", "e", 1.0)])
+    component = dict(zip(graph.names, strongly_connected_components(graph)))
+
+    assert component["a"] == component["b"]
+    assert component["c"] == component["d"]
+    assert len({component["a"], component["c"], component["e"]}) == 3
+    # Components come out in reverse topological order
+    assert component["e"] < component["c"] < component["a"]
+
+
+def test_find_cycles_g13():
+    graph = CSRGraph.from_edges(*graph_samples["g13"])
+    assert sorted(find_cycles(graph)) == [["a", "b", "c"], ["a", "d", "c"], ["a", "d", "e", "c"], ["b"]]
+
+
+def test_find_cycles_no_cycles():
+    graph = CSRGraph.from_edges(*graph_samples["g10"])
+    assert find_cycles(graph) == []
+
+
+def test_find_cycles_canonical_rotation():
+    graph = CSRGraph.from_edges(["z", "y", "x"], [("z", "x", 1.0), ("x", "y", 1.0), ("y", "z", 1.0)])
+    assert find_cycles(graph) == [["x", "y", "z"]]
+
+
+def test_find_cycles_parallel_edges_counted_once():
+    graph = CSRGraph.from_edges(["a", "b"], [("a", "b", 1.0), ("a", "b", 2.0), ("b", "a", 1.0)])
+    assert find_cycles(graph) == [["a", "b"]]
+
+
+def test_find_cycles_complete_graph():
+    # A complete directed graph on 4 nodes (with no self loops) has
+    # 6 two-node, 8 three-node and 6 four-node cycles
+    names = ["a", "b", "c", "d"]
+    graph = CSRGraph.from_edges(names, [(f, t, 1.0) for f, t in permutations(names, 2)])
+    cycles = find_cycles(graph)
+
+    assert len(cycles) == 20
+    assert len({tuple(cycle) for cycle in cycles}) == 20
+    assert all(cycle[0] == min(cycle) for cycle in cycles)
@@ -0,0 +1,121 @@
+import threading
+from unittest import mock
+
+from sample_data import graph_samples
+from src.query_service import graph_cache
+from src.query_service.graph_cache import CSRGraph, GraphCache
+
+
+def test_csr_graph_from_edges():
+    graph = CSRGraph.from_edges(*graph_samples["g13"])
+
+    assert len(graph) == 5
+    assert graph.edge_count == 8
+    assert list(graph.offsets) == [0, 2, 4, 5, 7, 8]
+    a, b, c, d, e = (graph.node_id(name) for name in "abcde")
+    assert list(graph.neighbours(a)) == [(b, 1.0), (d, 1.5)]
+    assert list(graph.neighbours(b)) == [(c, 1.0), (b, 0.25)]
+    assert list(graph.neighbours(c)) == [(a, 1.25)]
+    assert list(graph.neighbours(d)) == [(e, 0.5), (c, 1.0)]
+    assert list(graph.neighbours(e)) == [(c, 0.5)]
+
+
+def test_csr_graph_node_without_edges():
+    graph = CSRGraph.from_edges(["a", "b"], [("b", "a", 1.0)])
+    assert list(graph.neighbours(graph.node_id("a"))) == []
+    assert graph.node_id("missing") is None
+
+
+def mock_cursor(versions):
+    """A cursor which reports each version in turn, and the g10 graph when it's loaded."""
+    cur = mock.MagicMock()
+    cur.fetchone.side_effect = [(version,) if version is not None else None for version in versions]
+    nodes, edges = graph_samples["g10"]
+    rows = []
+    cur.execute.side_effect = lambda sql, params: rows.__setitem__(
+        slice(None), [(node,) for node in nodes] if "FROM public.nodes" in sql else edges)
+    cur.__iter__.side_effect = lambda: iter(list(rows))
+    return cur
+
+
+def test_graph_cache_loads_once_per_version():
+    cache = GraphCache()
+    cur = mock_cursor([1, 1, 2])
+
+    first = cache.get(cur, "g10")
+    assert first.names == ["a", "b", "c"]
+    assert cache.get(cur, "g10") is first
+    assert cache.get(cur, "g10") is not first
+
+    load_queries = [c for c in cur.execute.call_args_list if "public.edges" in c.args[0]]
+    assert len(load_queries) == 2
+
+
+def test_graph_cache_missing_graph():
+    cache = GraphCache()
+    cur = mock_cursor([1, None])
+
+    assert cache.get(cur, "g10") is not None
+    assert cache.get(cur, "g10") is None
+
+
+def test_graph_cache_holds_several_graphs():
+    cache = GraphCache()
+    cur = mock_cursor([1, 5, 1, 5])
+
+    first = cache.get(cur, "g10")
+    second = cache.get(cur, "other")
+
+    assert first is not second
+    assert cache.get(cur, "g10") is first
+    assert cache.get(cur, "other") is second
+    assert sorted(cache.graph_ids()) == ["g10", "other"]
+    assert (cache.version("g10"), cache.version("other")) == (1, 5)
+
+
+def test_graph_cache_version_of_replaced_graph():
+    cache = GraphCache()
+    cur = mock_cursor([1, 2])
+
+    first = cache.get(cur, "g10")
+    assert cache.version("g10", first) == 1
+    cache.get(cur, "g10")
+    assert cache.version("g10", first) is None
+    assert cache.version("g10") == 2
+    assert cache.version("unknown") is None
+
+
+def test_graph_cache_loads_new_graph_once_across_threads(monkeypatch):
+    cache = GraphCache()
+    loaded = []
+    release = threading.Event()
+
+    def slow_load(cur, graph_id):
+        loaded.append(graph_id)
+        release.wait(5)
+        return CSRGraph.from_edges(*graph_samples["g10"])
+    monkeypatch.setattr(graph_cache, "load_graph", slow_load)
+    monkeypatch.setattr(graph_cache, "get_graph_version", lambda cur, graph_id: 1)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(None, "g10"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert loaded == ["g10"]
+    assert len(results) == 4 and all(result is results[0] for result in results)
+
+
+def test_graph_cache_prefers_snapshot():
+    snapshot = CSRGraph.from_edges(*graph_samples["g13"])
+    load_snapshot = mock.MagicMock(side_effect=lambda graph_id, version: snapshot if version == 1 else None)
+    cache = GraphCache(load_snapshot=load_snapshot)
+    cur = mock_cursor([1, 2])
+
+    assert cache.get(cur, "g13") is snapshot
+    # A newer version than the snapshot's falls back to Postgres
+    assert len(cache.get(cur, "g13")) == len(graph_samples["g10"][0])
+    assert load_snapshot.call_args_list == [mock.call("g13", 1), mock.call("g13", 2)]
@@ -0,0 +1,94 @@
+import pytest
+
+import config
+from sample_data import graph_samples
+from src.query_service import path_finding
+from src.query_service.graph_cache import CSRGraph
+from src.query_service.graph_snapshot import (
+    SnapshotError, load_current_snapshot, load_snapshot, snapshot_path, write_snapshot)
+
+
+@pytest.fixture
+def snapshot_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "graph_snapshot_dir", str(tmp_path))
+    return tmp_path
+
+
+def test_snapshot_round_trip(tmp_path):
+    graph = CSRGraph.from_edges(*graph_samples["g13"])
+    path = str(tmp_path / "g13.graph")
+
+    size = write_snapshot(path, "g13", 7, graph)
+    loaded = load_snapshot(path)
+
+    assert size == (tmp_path / "g13.graph").stat().st_size
+    assert (loaded.graph_id, loaded.version) == ("g13", 7)
+    assert list(loaded.names) == list(graph.names)
+    assert list(loaded.offsets) == list(graph.offsets)
+    assert list(loaded.targets) == list(graph.targets)
+    assert list(loaded.costs) == list(graph.costs)
+    assert [list(part) for part in loaded.reverse_adjacency] == [list(part) for part in graph.reverse_adjacency]
+    for name in graph.names:
+        assert loaded.node_id(name) == graph.node_id(name)
+    assert loaded.node_id("missing") is None
+    assert path_finding.find_all_paths(loaded, "a", "e") == path_finding.find_all_paths(graph, "a", "e")
+
+
+def test_snapshot_maps_reverse_adjacency(tmp_path, monkeypatch):
+    graph = CSRGraph.from_edges(*graph_samples["g13"])
+    path = str(tmp_path / "g13.graph")
+    write_snapshot(path, "g13", 7, graph)
+
+    loaded = load_snapshot(path)
+    # Nothing is rebuilt: it's views onto the file, like the forward arrays
+    assert all(isinstance(part, memoryview) for part in loaded.reverse_adjacency)
+    c = graph.node_id("c")
+    assert sorted(loaded.predecessors(c)) == sorted(graph.predecessors(c))
+    assert path_finding.find_cheapest_path(loaded, "a", "e") == path_finding.find_cheapest_path(graph, "a", "e")
+
+    # A snapshot written from a mapped graph gets the same arrays
+    copy_path = str(tmp_path / "copy.graph")
+    write_snapshot(copy_path, "g13", 7, loaded)
+    assert [list(part) for part in load_snapshot(copy_path).reverse_adjacency] == \
+        [list(part) for part in graph.reverse_adjacency]
+
+
+def test_snapshot_unicode_names_and_no_edges(tmp_path):
+    graph = CSRGraph.from_edges(["zoë", "a", "日本"], [])
+    path = str(tmp_path / "g.graph")
+    write_snapshot(path, "g", None, graph)
+
+    loaded = load_snapshot(path)
+    assert loaded.version is None
+    assert list(loaded.names) == ["zoë", "a", "日本"]
+    assert loaded.node_id("日本") == 2
+    assert loaded.edge_count == 0
+
+
+def test_load_snapshot_rejects_bad_files(tmp_path):
+    path = tmp_path / "bad.graph"
+    path.write_bytes(b"")
+    with pytest.raises(SnapshotError):
+        load_snapshot(str(path))
+    path.write_bytes(b"not a graph snapshot at all, honestly, not even close........")
+    with pytest.raises(SnapshotError):
+        load_snapshot(str(path))
+
+    write_snapshot(str(path), "g13", 1, CSRGraph.from_edges(*graph_samples["g13"]))
+    path.write_bytes(path.read_bytes()[:-8])
+    with pytest.raises(SnapshotError, match="truncated"):
+        load_snapshot(str(path))
+
+
+def test_load_current_snapshot(snapshot_dir):
+    graph = CSRGraph.from_edges(*graph_samples["g13"])
+    write_snapshot(snapshot_path(str(snapshot_dir), "g/13"), "g/13", 3, graph)
+
+    assert load_current_snapshot("g/13", 3) is not None
+    assert load_current_snapshot("g/13", 4) is None  # Stale
+    assert load_current_snapshot("g10", 3) is None  # Missing
+
+
+def test_load_current_snapshot_turned_off(monkeypatch):
+    monkeypatch.setattr(config, "graph_snapshot_dir", "")
+    assert load_current_snapshot("g13", 1) is None
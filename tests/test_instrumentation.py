@@ -0,0 +1,67 @@
+import io
+import json
+
+import pytest
+
+from src.downloader.instrumentation import IngestMetrics, format_prometheus
+
+
+def test_phases_are_logged_as_json_lines():
+    log = io.StringIO()
+    metrics = IngestMetrics(log=log)
+    with metrics.phase("extract") as phase:
+        phase.rows = 10
+        phase.bytes = 200
+    metrics.graph_id = "g0"
+    metrics.report(True)
+
+    phase_line, summary_line = [json.loads(line) for line in log.getvalue().splitlines()]
+    assert phase_line["event"] == "ingest_phase"
+    assert phase_line["phase"] == "extract"
+    assert (phase_line["rows"], phase_line["bytes"], phase_line["ok"]) == (10, 200, True)
+    assert phase_line["seconds"] >= 0
+    assert phase_line["peak_memory_bytes"] is None
+    assert summary_line["event"] == "ingest"
+    assert (summary_line["graph_id"], summary_line["ok"], summary_line["phases"]) == ("g0", True, ["extract"])
+
+
+def test_failed_phase_is_still_recorded():
+    metrics = IngestMetrics()
+    with pytest.raises(RuntimeError):
+        with metrics.phase("insert"):
+            raise RuntimeError("connection lost")
+    assert [(phase.name, phase.ok) for phase in metrics.phases] == [("insert", False)]
+
+
+def test_trace_memory():
+    metrics = IngestMetrics(trace_memory=True)
+    with metrics.phase("extract"):
+        data = [str(i) for i in range(10000)]
+    metrics.report(True)
+    assert metrics.phases[0].peak_memory_bytes > 10000
+    assert len(data) == 10000
+
+
+def test_prometheus_file(tmp_path):
+    path = tmp_path / "ingest.prom"
+    metrics = IngestMetrics(prometheus_file=str(path))
+    with metrics.phase("download") as phase:
+        phase.bytes = 1234
+    with metrics.phase("insert") as phase:
+        phase.rows = 56
+    metrics.report(False)
+
+    text = path.read_text()
+    assert '# TYPE graph_ingest_phase_seconds gauge' in text
+    assert 'graph_ingest_phase_bytes{phase="download"} 1234' in text
+    assert 'graph_ingest_phase_rows{phase="insert"} 56' in text
+    assert 'graph_ingest_phase_rows{phase="download"}' not in text
+    assert 'graph_ingest_phase_peak_memory_bytes' not in text
+    assert 'graph_ingest_success 0' in text
+    assert not (tmp_path / "ingest.prom.tmp").exists()
+
+
+def test_format_prometheus_without_phases():
+    text = format_prometheus([], True, 1.5)
+    assert "graph_ingest_seconds 1.5\n" in text
+    assert "graph_ingest_success 1\n" in text
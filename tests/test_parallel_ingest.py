@@ -0,0 +1,79 @@
+import pytest
+import responses
+
+import config
+import src.downloader.setup as downloader
+from sample_data import generated_graph_xml, xml_samples
+from src.downloader import parallel_ingest
+
+
+@pytest.fixture
+def mock_database(monkeypatch):
+    inserted = []
+    monkeypatch.setattr(downloader, 'graph_id_exists', lambda graph_id: graph_id == "g0")
+    monkeypatch.setattr(downloader, 'insert_graph_data',
+                        lambda graph_data: inserted.append(graph_data[0]) or len(graph_data[2]) + len(graph_data[3]))
+    return inserted
+
+
+@responses.activate
+def test_ingest_many(mock_database):
+    endpoints = [f"http://graphs.example/{name}.xml" for name in ("one", "two", "exists", "missing", "invalid")]
+    responses.add(responses.GET, endpoints[0], body=generated_graph_xml(20, seed=1))
+    responses.add(responses.GET, endpoints[1], body=generated_graph_xml(30, seed=2))
+    responses.add(responses.GET, endpoints[2], body=xml_samples["valid"])
+    responses.add(responses.GET, endpoints[3], status=404)
+    responses.add(responses.GET, endpoints[4], body=xml_samples["invalid dup node id"])
+
+    results = parallel_ingest.ingest_many(endpoints, download_workers=2, parse_workers=2, insert_workers=2)
+
+    assert [result.endpoint for result in results] == endpoints
+    assert [(result.ok, result.stage) for result in results] == [
+        (True, "insert"), (True, "insert"), (False, "insert"), (False, "download"), (False, "parse")]
+    assert results[0].graph_id == "dag_20_1"
+    assert results[0].rows > 20
+    assert results[2].message == "Graph ID already exists."
+    assert results[3].message == "Problem downloading graph data."
+    assert results[4].message == "Invalid graph data. Node ID is not unique."
+    assert sorted(mock_database) == ["dag_20_1", "dag_30_2"]
+
+
+@responses.activate
+def test_set_up_many_graphs(mock_database, monkeypatch, capsys):
+    graph_ids = []
+    monkeypatch.setattr(downloader, 'set_graph_id', graph_ids.append)
+    monkeypatch.setattr(config, 'ingest_parse_workers', 1)
+    endpoints = ["http://graphs.example/missing.xml", "http://graphs.example/one.xml"]
+    responses.add(responses.GET, endpoints[0], status=500)
+    responses.add(responses.GET, endpoints[1], body=generated_graph_xml(10, seed=3))
+
+    parallel_ingest.set_up_many_graphs(endpoints)
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith("Ingested 1 of 2 graphs in ")
+    assert lines[1] == "  FAILED  http://graphs.example/missing.xml at download: Problem downloading graph data."
+    assert lines[2].startswith("  ok      http://graphs.example/one.xml (dag_10_3, ")
+    assert graph_ids == ["dag_10_3"]
+
+
+def test_get_graph_endpoints(tmp_path, monkeypatch):
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("# Graphs to load\nhttp://a/1.xml\n\n  http://a/2.xml  # the big one\n")
+    monkeypatch.setattr(config, 'graph_data_manifest', str(manifest))
+    monkeypatch.setattr(config, 'graph_data_endpoints', ["http://a/3.xml", "http://a/1.xml"])
+
+    assert parallel_ingest.get_graph_endpoints() == ["http://a/1.xml", "http://a/2.xml", "http://a/3.xml"]
+
+
+def test_get_graph_endpoints_none_configured(monkeypatch):
+    monkeypatch.setattr(config, 'graph_data_manifest', "")
+    monkeypatch.setattr(config, 'graph_data_endpoints', [])
+    assert parallel_ingest.get_graph_endpoints() == []
+
+
+def test_store_graph_delta_update(mock_database, monkeypatch):
+    graph_data = ("g0", "Name", [("a", "A name")], [])
+    assert parallel_ingest.store_graph(graph_data) == (False, "Graph ID already exists.")
+    monkeypatch.setattr(config, 'delta_ingest', True)
+    monkeypatch.setattr(downloader, 'update_graph_data', lambda graph_data: 3)
+    assert parallel_ingest.store_graph(graph_data) == (True, 3)
@@ -0,0 +1,82 @@
+from concurrent.futures.process import BrokenProcessPool
+import os
+
+import pytest
+
+from sample_data import generated_graph
+from src.query_service import parallel_search, query_planner
+
+
+@pytest.fixture
+def process_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(parallel_search.tempfile, "tempdir", str(tmp_path))
+    yield tmp_path
+    parallel_search.shutdown_process_pool()
+
+
+def test_shard_keys_keeps_pairs_together():
+    keys = [("b", "c", "paths"), ("a", "c", "paths"), ("b", "c", "cheapest"), ("a", "d", "cheapest"),
+            (None, None, "cycles")]
+
+    shards = parallel_search.shard_keys(keys, 3)
+
+    assert len(shards) == 3
+    assert sorted((key for shard in shards for key in shard), key=str) == sorted(keys, key=str)
+    shard_of = {key: number for number, shard in enumerate(shards) for key in shard}
+    assert shard_of[("b", "c", "paths")] == shard_of[("b", "c", "cheapest")]
+    assert parallel_search.shard_keys(keys[:1], 8) == [keys[:1]]
+
+
+def test_iter_batch_matches_one_process(process_pool):
+    graph = generated_graph(40, seed=5)
+    names = list(graph.names)
+    keys = [(names[i], names[-1 - i], query_type) for i in range(12) for query_type in ("paths", "cheapest")]
+    keys.append((None, None, "cycles"))
+    limits = {keys[0]: 2}
+
+    results = list(parallel_search.iter_batch("dag", 1, graph, keys, limits, processes=2))
+
+    assert results == list(query_planner.iter_batch(graph, keys, limits))
+    assert [path.name for path in process_pool.rglob("*.graph")] == ["dag.1.graph"]
+
+
+def test_iter_batch_answers_here_if_snapshot_cant_be_written(process_pool, monkeypatch):
+    graph = generated_graph(10, seed=1)
+    keys = [(graph.names[0], name, "paths") for name in graph.names]
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(parallel_search, "shared_snapshot_path", fail)
+    monkeypatch.setattr(parallel_search, "get_process_pool", fail)
+
+    results = list(parallel_search.iter_batch("dag", 1, graph, keys, processes=2))
+    assert results == list(query_planner.iter_batch(graph, keys))
+
+
+def test_iter_batch_replaces_a_broken_pool(process_pool):
+    graph = generated_graph(20, seed=2)
+    names = list(graph.names)
+    keys = [(names[i], names[-1 - i], "paths") for i in range(8)]
+    broken = parallel_search.get_process_pool(2)
+    with pytest.raises(BrokenProcessPool):
+        broken.submit(os._exit, 1).result()
+
+    # Answered here this time, then by a new pool
+    assert list(parallel_search.iter_batch("dag", 1, graph, keys, processes=2)) == \
+        list(query_planner.iter_batch(graph, keys))
+    assert parallel_search.get_process_pool(2) is not broken
+    assert list(parallel_search.iter_batch("dag", 1, graph, keys, processes=2)) == \
+        list(query_planner.iter_batch(graph, keys))
+
+
+def test_shutdown_tolerates_missing_snapshots(process_pool):
+    graph = generated_graph(10, seed=1)
+    path = parallel_search.shared_snapshot_path("dag", 1, graph)
+    os.remove(path)
+    path = parallel_search.shared_snapshot_path("dag", 2, graph)  # Replaces version 1's, which is already gone
+    os.remove(path)
+
+    parallel_search.shutdown_process_pool()
+    parallel_search.shutdown_process_pool()
+    assert list(process_pool.rglob("*.graph")) == []
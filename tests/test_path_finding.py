@@ -0,0 +1,186 @@
+import random
+
+import pytest
+
+from sample_data import graph_samples
+from src.query_service.graph_cache import CSRGraph
+from src.query_service.path_finding import (
+    find_all_paths, find_all_paths_from, find_cheapest_path, find_cheapest_paths_from, is_reachable,
+    nodes_reaching, reachable_targets)
+
+
+def test_find_all_paths(g13):
+    # Same answer as the README's SELECT * FROM find_all_paths('a', 'c', 'g13');
+    paths = find_all_paths(g13, "a", "c")
+    assert sorted(paths) == sorted([
+        (["a", "d", "c"], 2.5),
+        (["a", "d", "e", "c"], 2.5),
+        (["a", "b", "c"], 2.0),
+    ])
+
+
+def test_find_all_paths_through_cycles(g13):
+    paths = find_all_paths(g13, "b", "a")
+    assert sorted(paths) == [(["b", "c", "a"], 2.25)]
+
+
+def test_find_all_paths_no_path():
+    graph = CSRGraph.from_edges(*graph_samples["g10"])
+    assert find_all_paths(graph, "c", "a") == []
+
+
+def test_find_all_paths_same_start_and_end(g13):
+    assert find_all_paths(g13, "a", "a") == [(["a"], 0.0)]
+
+
+def test_find_all_paths_unknown_node(g13):
+    assert find_all_paths(g13, "a", "z") == []
+    assert find_all_paths(g13, "z", "a") == []
+
+
+def test_find_cheapest_path(g13):
+    assert find_cheapest_path(g13, "a", "c") == [(["a", "b", "c"], 2.0)]
+    assert find_cheapest_path(g13, "a", "e") == [(["a", "d", "e"], 2.0)]
+
+
+def test_find_cheapest_path_prefers_cheap_detour():
+    graph = CSRGraph.from_edges(*graph_samples["g10"])
+    assert find_cheapest_path(graph, "a", "c") == [(["a", "c"], 15.0)]
+    graph = CSRGraph.from_edges(["a", "b", "c"], [("a", "c", 5.0), ("a", "b", 1.0), ("b", "c", 1.0)])
+    assert find_cheapest_path(graph, "a", "c") == [(["a", "b", "c"], 2.0)]
+
+
+def test_find_cheapest_path_matches_enumeration(g13):
+    for start in "abcde":
+        for end in "abcde":
+            all_paths = find_all_paths(g13, start, end)
+            cheapest = find_cheapest_path(g13, start, end)
+            if not all_paths:
+                assert cheapest == []
+            else:
+                assert cheapest[0][1] == min(cost for _, cost in all_paths)
+                assert cheapest[0] in all_paths
+
+
+def test_find_cheapest_path_no_path():
+    graph = CSRGraph.from_edges(*graph_samples["g10"])
+    assert find_cheapest_path(graph, "c", "a") == []
+    assert find_cheapest_path(graph, "a", "z") == []
+
+
+def test_find_cheapest_path_same_start_and_end(g13):
+    assert find_cheapest_path(g13, "a", "a") == [(["a"], 0.0)]
+
+
+def chain_and_fan(length):
+    """A chain of `length` nodes from "s", and a separate "end" node with one edge into it from "lonely"."""
+    names = ["s"] + [f"n{i}" for i in range(length)] + ["lonely", "end"]
+    edges = [(names[i], names[i + 1], 1.0) for i in range(length)] + [("lonely", "end", 1.0)]
+    return CSRGraph.from_edges(names, edges)
+
+
+def test_reverse_adjacency(g13):
+    a, b, c, d, e = (g13.node_id(name) for name in "abcde")
+    assert sorted(g13.predecessors(c)) == sorted([(b, 1.0), (d, 1.0), (e, 0.5)])
+    assert list(g13.predecessors(b)) == [(a, 1.0), (b, 0.25)]
+    assert list(g13.predecessors(a)) == [(c, 1.25)]
+
+
+def test_is_reachable(g13):
+    graph = CSRGraph.from_edges(*graph_samples["g10"])
+    a, b, c = (graph.node_id(name) for name in "abc")
+    assert is_reachable(graph, a, c)
+    assert not is_reachable(graph, c, a)
+    assert is_reachable(graph, c, c)
+    assert is_reachable(g13, g13.node_id("e"), g13.node_id("b"))
+
+
+def test_unreachable_end_short_circuits(monkeypatch):
+    graph = chain_and_fan(1000)
+    expanded = []
+    neighbours = graph.neighbours
+    monkeypatch.setattr(graph, "neighbours", lambda node: expanded.append(node) or neighbours(node))
+
+    assert find_all_paths(graph, "s", "end") == []
+    assert find_cheapest_path(graph, "s", "end") == []
+    assert find_cheapest_paths_from(graph, "s", ["end"]) == {"end": []}
+    # The backwards search from "end" runs out after one step, so the chain is never walked
+    assert len(expanded) < 10
+
+
+def test_find_cheapest_path_bidirectional_matches_dijkstra():
+    rng = random.Random(7)
+    names = [f"n{i}" for i in range(40)]
+    edges = [(rng.choice(names), rng.choice(names), rng.choice([0.0, 0.5, 1.0, rng.random() * 3]))
+             for _ in range(120)]
+    graph = CSRGraph.from_edges(names, edges)
+    for start in names[:10]:
+        expected = find_cheapest_paths_from(graph, start, names)
+        for end in names:
+            cheapest = find_cheapest_path(graph, start, end)
+            assert [cost for _, cost in cheapest] == pytest.approx([cost for _, cost in expected[end]])
+            if cheapest:
+                assert (cheapest[0][0][0], cheapest[0][0][-1]) == (start, end)
+
+
+def dead_end_tree(depth):
+    """"s" has an edge to "end", and another into a binary tree `depth` levels deep which never leads back."""
+    names = ["s", "end", "t"]
+    edges = [("s", "end", 1.0), ("s", "t", 1.0)]
+    level = ["t"]
+    for d in range(depth):
+        next_level = []
+        for parent in level:
+            for child in (f"{parent}0", f"{parent}1"):
+                names.append(child)
+                edges.append((parent, child, 1.0))
+                next_level.append(child)
+        level = next_level
+    return CSRGraph.from_edges(names, edges)
+
+
+def test_nodes_reaching():
+    graph = dead_end_tree(3)
+    can_reach = nodes_reaching(graph, [graph.node_id("end")])
+    assert [name for node, name in enumerate(graph.names) if can_reach[node]] == ["s", "end"]
+    can_reach = nodes_reaching(graph, [graph.node_id("end"), graph.node_id("t01")])
+    assert {name for node, name in enumerate(graph.names) if can_reach[node]} == {"s", "end", "t", "t0", "t01"}
+
+
+def test_dead_ends_are_not_expanded(monkeypatch):
+    graph = dead_end_tree(10)  # Over 2,000 nodes down the dead end
+    expanded = []
+    neighbours = graph.neighbours
+    monkeypatch.setattr(graph, "neighbours", lambda node: expanded.append(node) or neighbours(node))
+
+    assert find_all_paths(graph, "s", "end") == [(["s", "end"], 1.0)]
+    assert find_all_paths_from(graph, "s", ["end", "t1"]) == {"end": [(["s", "end"], 1.0)],
+                                                             "t1": [(["s", "t", "t1"], 2.0)]}
+    # Only the way to the ends, and the ends themselves (a path may go on through one to another)
+    assert set(expanded) <= {graph.node_id(name) for name in ("s", "t", "end", "t1")}
+
+
+def test_pruned_search_matches_unpruned(monkeypatch):
+    rng = random.Random(3)
+    names = [f"n{i}" for i in range(9)]
+    edges = [(rng.choice(names), rng.choice(names), 1.0) for _ in range(16)]
+    graph = CSRGraph.from_edges(names, edges)
+    pruned = {(start, end): find_all_paths(graph, start, end) for start in names for end in names}
+    monkeypatch.setattr("src.query_service.path_finding.nodes_reaching",
+                        lambda graph, target_ids: bytearray([1]) * len(graph))
+    for (start, end), paths in pruned.items():
+        assert sorted(paths) == sorted(find_all_paths(graph, start, end))
+
+
+def test_reachable_targets_searches_once(monkeypatch):
+    names = [f"n{i}" for i in range(500)]
+    graph = CSRGraph.from_edges(names + ["lonely"], [(names[i], names[i + 1], 1.0) for i in range(499)])
+    expanded = []
+    neighbours = graph.neighbours
+    monkeypatch.setattr(graph, "neighbours", lambda node: expanded.append(node) or neighbours(node))
+
+    ends = names[::5] + ["lonely", "missing"]
+    targets = reachable_targets(graph, 0, ends)
+    assert list(targets.values()) == names[5::5]
+    # One search forwards along the chain, rather than one per end
+    assert len(expanded) <= len(names)
@@ -0,0 +1,86 @@
+import threading
+from unittest import mock
+
+import psycopg2
+import pytest
+
+import src.db_connection.postgres as postgres
+
+
+class FakePool:
+    maxconn = 3
+
+    def __init__(self, conns):
+        self.conns = list(conns)
+        self.returned = []
+
+    def getconn(self):
+        return self.conns.pop(0)
+
+    def putconn(self, conn, close=False):
+        self.returned.append((conn, close))
+
+
+@pytest.fixture
+def fake_pool(monkeypatch):
+    def make(*conns):
+        connection_pool = FakePool(conns)
+        monkeypatch.setattr(postgres, "get_connection_pool", lambda: connection_pool)
+        return connection_pool
+    return make
+
+
+def healthy_conn():
+    return mock.MagicMock(closed=0)
+
+
+def test_pooled_connection_borrows_and_returns(fake_pool):
+    conn = healthy_conn()
+    connection_pool = fake_pool(conn)
+
+    with postgres.pooled_connection() as borrowed:
+        assert borrowed is conn
+
+    conn.__exit__.assert_called_once_with(None, None, None)
+    assert connection_pool.returned == [(conn, False)]
+
+
+def test_pooled_connection_replaces_unhealthy_connection(fake_pool):
+    stale = mock.MagicMock(closed=0)
+    stale.cursor.return_value.__enter__.return_value.execute.side_effect = psycopg2.OperationalError
+    dropped = mock.MagicMock(closed=2)
+    good = healthy_conn()
+    connection_pool = fake_pool(stale, dropped, good)
+
+    with postgres.pooled_connection():
+        pass
+
+    assert connection_pool.returned == [(stale, True), (dropped, True), (good, False)]
+
+
+def test_pooled_connection_returns_connection_on_error(fake_pool):
+    conn = healthy_conn()
+    connection_pool = fake_pool(conn)
+
+    with pytest.raises(ValueError):
+        with postgres.pooled_connection():
+            raise ValueError
+
+    assert connection_pool.returned == [(conn, False)]
+
+
+def test_blocking_connection_pool_waits_for_free_connection(monkeypatch):
+    monkeypatch.setattr(psycopg2, "connect", lambda *args, **kwargs: mock.MagicMock(closed=0))
+    connection_pool = postgres.BlockingConnectionPool(0, 1)
+    first = connection_pool.getconn()
+    got_second = threading.Event()
+
+    def borrow():
+        connection_pool.getconn()
+        got_second.set()
+
+    thread = threading.Thread(target=borrow, daemon=True)
+    thread.start()
+    assert not got_second.wait(0.1)
+    connection_pool.putconn(first)
+    assert got_second.wait(1)
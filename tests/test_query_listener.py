@@ -1,10 +1,14 @@
 import io
 import json
+from unittest import mock
 
+import psycopg2
 import pytest
 
+import config
 import src.query_service.query_listener as queries
-from sample_data import json_samples
+from sample_data import graph_samples, json_samples
+from src.query_service.graph_cache import CSRGraph
 
 
 def test_get_graph_id(monkeypatch):
@@ -331,7 +335,7 @@ def test_receive_and_send_query_valid(monkeypatch, capsys):
     monkeypatch.setattr("sys.stdin.read", lambda: query_str)
 
     mock_results = {("a", "b", "paths"): [[["a", "b"], 1.0]]}
-    monkeypatch.setattr(queries, "process_queries", lambda q: mock_results)
+    monkeypatch.setattr(queries, "process_queries", lambda q, conn=None: mock_results)
 
     # Run the function
     queries.receive_and_send_query()
@@ -352,7 +356,9 @@ def test_receive_and_send_query_invalid_format(monkeypatch, capsys):
     captured = capsys.readouterr()
     expected_error = "Invalid format. Please try again. Valid format looks like: " \
                      '{"queries": [{"paths": {"start": "node id","end": "node id"}}, ' \
-                     '{"cheapest": {"start": "node id", "end": "node id"}}]}'
+                     '{"cheapest": {"start": "node id", "end": "node id"}}, {"cycles": {}}]}. ' \
+                     'Optionally, a paths query can have a "limit" (the most paths to return), and the document a ' \
+                     '"format" ("json" or "ndjson") and a "graph_id".'
     assert expected_error == captured.out.strip()
 
 
@@ -365,5 +371,340 @@ def test_receive_and_send_query_invalid_json(monkeypatch, capsys):
     captured = capsys.readouterr()
     expected_error = "Invalid format. Please try again. Valid format looks like: " \
                      '{"queries": [{"paths": {"start": "node id","end": "node id"}}, ' \
-                     '{"cheapest": {"start": "node id", "end": "node id"}}]}'
+                     '{"cheapest": {"start": "node id", "end": "node id"}}, {"cycles": {}}]}. ' \
+                     'Optionally, a paths query can have a "limit" (the most paths to return), and the document a ' \
+                     '"format" ("json" or "ndjson") and a "graph_id".'
     assert expected_error == captured.out.strip()
+
+
+@pytest.fixture
+def mock_db_cursor(monkeypatch):
+    cursor = mock.MagicMock()
+    conn = mock.MagicMock()
+    conn.__enter__.return_value.cursor.return_value.__enter__.return_value = cursor
+    monkeypatch.setattr(queries, "pooled_connection", lambda: conn)
+    monkeypatch.setattr(queries, "get_graph_id", lambda: "g13")
+    monkeypatch.setattr(config, "result_cache", "off")
+    return cursor
+
+
+def test_process_queries_memory_engine(mock_db_cursor, monkeypatch):
+    graph = CSRGraph.from_edges(*graph_samples["g13"])
+    monkeypatch.setattr(config, "query_engine", "memory")
+    monkeypatch.setattr(queries.graph_cache, "get", lambda cur, graph_id: graph)
+
+    results = queries.process_queries({"queries": [
+        {"paths": {"start": "a", "end": "c"}},
+        {"cheapest": {"start": "a", "end": "c"}},
+    ]})
+
+    assert list(results) == [("a", "c", "paths"), ("a", "c", "cheapest")]
+    assert sorted(results[("a", "c", "paths")]) == sorted([
+        (["a", "d", "c"], 2.5), (["a", "d", "e", "c"], 2.5), (["a", "b", "c"], 2.0)])
+    mock_db_cursor.execute.assert_not_called()
+
+
+def test_process_queries_process_pool(mock_db_cursor, monkeypatch):
+    graph = CSRGraph.from_edges(*graph_samples["g13"])
+    monkeypatch.setattr(config, "query_engine", "memory")
+    monkeypatch.setattr(config, "query_processes", 2)
+    monkeypatch.setattr(queries.graph_cache, "get", lambda cur, graph_id: graph)
+    monkeypatch.setattr(queries.graph_cache, "version", lambda graph_id, graph=None: 3)
+    calls = []
+
+    def fake_iter_batch(graph_id, version, graph, keys, limits):
+        calls.append((graph_id, version, keys))
+        return queries.query_planner.iter_batch(graph, keys, limits)
+
+    monkeypatch.setattr(queries.parallel_search, "iter_batch", fake_iter_batch)
+
+    results = queries.process_queries({"queries": [{"cheapest": {"start": "a", "end": "c"}}]})
+
+    assert results == {("a", "c", "cheapest"): [(["a", "b", "c"], 2.0)]}
+    assert calls == [("g13", 3, [("a", "c", "cheapest")])]
+
+
+def test_process_queries_cheapest_skips_enumeration(mock_db_cursor, monkeypatch):
+    graph = CSRGraph.from_edges(*graph_samples["g13"])
+    monkeypatch.setattr(config, "query_engine", "memory")
+    monkeypatch.setattr(queries.graph_cache, "get", lambda cur, graph_id: graph)
+    monkeypatch.setattr(queries.query_planner.path_finding, "find_all_paths_from", mock.Mock(side_effect=AssertionError))
+
+    results = queries.process_queries({"queries": [{"cheapest": {"start": "a", "end": "c"}}]})
+
+    assert results == {("a", "c", "cheapest"): [(["a", "b", "c"], 2.0)]}
+
+
+def test_process_queries_database_engine(mock_db_cursor, monkeypatch):
+    monkeypatch.setattr(config, "query_engine", "database")
+    mock_db_cursor.fetchall.return_value = [(["a", "b"], 1.0)]
+
+    results = queries.process_queries({"queries": [{"paths": {"start": "a", "end": "b"}}]})
+
+    assert results == {("a", "b", "paths"): [(["a", "b"], 1.0)]}
+    mock_db_cursor.execute.assert_called_once_with(
+        "SELECT * FROM find_all_paths(%s, %s, %s);", ("a", "b", "g13"))
+
+
+def test_process_queries_database_engine_cheapest(mock_db_cursor, monkeypatch):
+    monkeypatch.setattr(config, "query_engine", "database")
+    mock_db_cursor.fetchall.return_value = [(["a", "b"], 1.0)]
+
+    results = queries.process_queries({"queries": [{"cheapest": {"start": "a", "end": "b"}}]})
+
+    assert results == {("a", "b", "cheapest"): [(["a", "b"], 1.0)]}
+    mock_db_cursor.execute.assert_called_once_with(
+        "SELECT * FROM find_cheapest_path(%s, %s, %s);", ("a", "b", "g13"))
+
+
+def test_answer_query_valid(monkeypatch):
+    conn = object()
+    seen = []
+    mock_results = {("a", "b", "cheapest"): [[["a", "b"], 1.0]]}
+    monkeypatch.setattr(queries, "process_queries", lambda q, c=None: seen.append(c) or mock_results)
+
+    result = queries.answer_query('{"queries": [{"cheapest": {"start": "a", "end": "b"}}]}', conn)
+
+    assert json.loads(result) == {"answers": [{"cheapest": {"from": "a", "to": "b", "paths": ["a", "b"]}}]}
+    assert seen == [conn]
+
+
+def test_answer_query_database_error(monkeypatch):
+    monkeypatch.setattr(queries, "process_queries", lambda q, c=None: None)
+    result = queries.answer_query('{"queries": [{"cheapest": {"start": "a", "end": "b"}}]}')
+    assert result == "Problem querying the database."
+
+
+def test_get_query_type_and_nodes_cycles():
+    assert queries.get_query_type_and_nodes({"cycles": {}}) == ("cycles", None, None)
+
+
+def test_verify_correct_query_format_valid_cycles():
+    query = {"queries": [{"cycles": {}}, {"paths": {"start": "a", "end": "b"}}]}
+    assert queries.verify_correct_query_format(query) is True
+
+
+def test_verify_correct_query_format_invalid_cycles():
+    assert queries.verify_correct_query_format({"queries": [{"cycles": []}]}) is False
+    assert queries.verify_correct_query_format(
+        {"queries": [{"cycles": {}, "paths": {"start": "a", "end": "b"}}]}) is False
+
+
+def test_process_queries_cycles_memory_engine(mock_db_cursor, monkeypatch):
+    graph = CSRGraph.from_edges(*graph_samples["g13"])
+    monkeypatch.setattr(config, "query_engine", "memory")
+    monkeypatch.setattr(queries.graph_cache, "get", lambda cur, graph_id: graph)
+
+    results = queries.process_queries({"queries": [{"cycles": {}}]})
+
+    assert sorted(results[(None, None, "cycles")]) == [["a", "b", "c"], ["a", "d", "c"], ["a", "d", "e", "c"], ["b"]]
+
+
+def test_process_queries_cycles_database_engine(mock_db_cursor, monkeypatch):
+    monkeypatch.setattr(config, "query_engine", "database")
+    mock_db_cursor.fetchall.return_value = [(["b"],)]
+
+    results = queries.process_queries({"queries": [{"cycles": {}}]})
+
+    assert results == {(None, None, "cycles"): [["b"]]}
+    mock_db_cursor.execute.assert_called_once_with(
+        "SELECT cycle_path FROM find_elementary_cycles(%s);", ("g13",))
+
+
+def test_format_results_to_json_cycles():
+    result_json = queries.format_results_to_json(queries.tidy_up_results({(None, None, "cycles"): [["b"]]}))
+    assert json.loads(result_json) == {"answers": [{"cycles": {"cycles": [["b"]]}}]}
+
+
+def test_verify_correct_query_format_response_format():
+    assert queries.verify_correct_query_format({"queries": [], "format": "ndjson"}) is True
+    assert queries.verify_correct_query_format({"queries": [], "format": "json"}) is True
+    assert queries.verify_correct_query_format({"queries": [], "format": "xml"}) is False
+
+
+def ndjson_lines(query_str):
+    return "".join(queries.iter_response(query_str)).splitlines()
+
+
+def test_iter_response_ndjson(mock_db_cursor, monkeypatch):
+    graph = CSRGraph.from_edges(*graph_samples["g13"])
+    monkeypatch.setattr(config, "query_engine", "memory")
+    monkeypatch.setattr(queries.graph_cache, "get", lambda cur, graph_id: graph)
+
+    response = queries.iter_response(json.dumps({"format": "ndjson", "queries": [
+        {"cheapest": {"start": "a", "end": "c"}},
+        {"paths": {"start": "b", "end": "a"}},
+        {"cheapest": {"start": "a", "end": "c"}},
+    ]}))
+
+    assert json.loads(next(response)) == {"cheapest": {"from": "a", "to": "c", "paths": ["a", "b", "c"]}}
+    assert next(response) == "\n"
+    assert "".join(response) == '{"paths": {"from": "b", "to": "a", "paths": [["b", "c", "a"]]}}\n'
+
+
+def test_iter_response_ndjson_by_default(monkeypatch):
+    monkeypatch.setattr(config, "response_format", "ndjson")
+    monkeypatch.setattr(queries, "iter_query_results",
+                        lambda q, conn=None, lazy=False: iter([(("a", "b", "cheapest"), [(["a", "b"], 1.0)])]))
+
+    lines = ndjson_lines('{"queries": [{"cheapest": {"start": "a", "end": "b"}}]}')
+
+    assert lines == ['{"cheapest": {"from": "a", "to": "b", "paths": ["a", "b"]}}']
+
+
+def test_iter_response_ndjson_database_error(monkeypatch, capsys):
+    def failing_results(q, conn=None, lazy=False):
+        yield ("a", "b", "cheapest"), [(["a", "b"], 1.0)]
+        yield ("a", "c", "paths"), failing_paths()
+
+    def failing_paths():
+        yield ["a", "c"], 1.0
+        raise psycopg2.OperationalError("connection lost")
+    monkeypatch.setattr(queries, "iter_query_results", failing_results)
+    monkeypatch.setattr(queries, "ANSWER_CHUNK_PATHS", 1)
+
+    lines = ndjson_lines('{"format": "ndjson", "queries": [{"cheapest": {"start": "a", "end": "b"}}]}')
+
+    assert lines == [
+        '{"cheapest": {"from": "a", "to": "b", "paths": ["a", "b"]}}',
+        '{"paths": {"from": "a", "to": "c", "paths": [["a", "c"]',
+        '{"error": "Problem querying the database."}',
+    ]
+    assert "connection lost" in capsys.readouterr().err
+
+
+def test_iter_answer_chunks_matches_json_dumps(monkeypatch):
+    monkeypatch.setattr(queries, "ANSWER_CHUNK_PATHS", 2)
+    paths = [["a", "b"], ["a", "c", "b"], ["a", "d", "b"]]
+    for count in range(len(paths) + 1):
+        chunks = list(queries.iter_answer_chunks(("paths", "a", "b", iter(paths[:count]))))
+        assert "".join(chunks) == json.dumps(queries.format_answer(("paths", "a", "b", paths[:count])))
+
+
+def test_verify_correct_query_format_limit():
+    def query(limit):
+        return {"queries": [{"paths": {"start": "a", "end": "b", "limit": limit}}]}
+    assert queries.verify_correct_query_format(query(0)) is True
+    assert queries.verify_correct_query_format(query(5)) is True
+    assert queries.verify_correct_query_format(query(-1)) is False
+    assert queries.verify_correct_query_format(query("5")) is False
+    assert queries.verify_correct_query_format(query(True)) is False
+
+
+def test_process_queries_limit_memory_engine(mock_db_cursor, monkeypatch):
+    graph = CSRGraph.from_edges(*graph_samples["g13"])
+    monkeypatch.setattr(config, "query_engine", "memory")
+    monkeypatch.setattr(queries.graph_cache, "get", lambda cur, graph_id: graph)
+
+    results = queries.process_queries({"queries": [
+        {"paths": {"start": "a", "end": "c", "limit": 2}},
+        {"cheapest": {"start": "a", "end": "c"}},
+    ]})
+
+    assert results[("a", "c", "paths")] == queries.query_planner.path_finding.find_all_paths(graph, "a", "c")[:2]
+    assert results[("a", "c", "cheapest")] == [(["a", "b", "c"], 2.0)]
+
+
+def test_process_queries_limit_database_engine(mock_db_cursor, monkeypatch):
+    monkeypatch.setattr(config, "query_engine", "database")
+    mock_db_cursor.fetchall.return_value = [(["a", "b"], 1.0)]
+
+    queries.process_queries({"queries": [{"paths": {"start": "a", "end": "b", "limit": 1}}]})
+
+    mock_db_cursor.execute.assert_called_once_with(
+        "SELECT * FROM find_all_paths(%s, %s, %s) LIMIT %s;", ("a", "b", "g13", 1))
+
+
+def test_lazy_database_paths_use_server_side_cursor(mock_db_cursor, monkeypatch):
+    monkeypatch.setattr(config, "query_engine", "database")
+    monkeypatch.setattr(config, "query_fetch_size", 100)
+    named_cursor = mock.MagicMock()
+    named_cursor.__enter__.return_value.__iter__.return_value = iter([(["a", "b"], 1.0), (["a", "c", "b"], 2.0)])
+    mock_db_cursor.connection.cursor.return_value = named_cursor
+
+    results = queries.iter_query_results({"queries": [{"paths": {"start": "a", "end": "b", "limit": 10}}]}, lazy=True)
+    key, paths = next(results)
+
+    assert key == ("a", "b", "paths")
+    assert list(paths) == [(["a", "b"], 1.0), (["a", "c", "b"], 2.0)]
+    assert mock_db_cursor.connection.cursor.call_args.kwargs["name"].startswith("paths_")
+    assert named_cursor.__enter__.return_value.itersize == 100
+    named_cursor.__enter__.return_value.execute.assert_called_once_with(
+        "SELECT * FROM find_all_paths(%s, %s, %s) LIMIT %s;", ("a", "b", "g13", 10))
+    mock_db_cursor.fetchall.assert_not_called()
+
+
+def test_process_queries_uses_result_cache(mock_db_cursor, monkeypatch):
+    graph = CSRGraph.from_edges(*graph_samples["g13"])
+    monkeypatch.setattr(config, "query_engine", "memory")
+    monkeypatch.setattr(config, "result_cache", "memory")
+    monkeypatch.setattr(queries.graph_cache, "get", lambda cur, graph_id: graph)
+    monkeypatch.setattr(queries.graph_cache, "version", lambda graph_id, graph=None: 7)
+    cache = queries.result_cache.ResultCache(1024 * 1024)
+    monkeypatch.setattr(queries, "memory_result_cache", cache)
+    batch = {"queries": [{"paths": {"start": "a", "end": "c"}}, {"cheapest": {"start": "a", "end": "c"}}]}
+
+    first = queries.process_queries(batch)
+    monkeypatch.setattr(queries.query_planner, "iter_batch", mock.Mock(side_effect=AssertionError))
+    second = queries.process_queries(batch)
+
+    assert first == second
+    assert len(cache) == 2
+    monkeypatch.setattr(queries.graph_cache, "version", lambda graph_id, graph=None: 8)
+    with pytest.raises(AssertionError):
+        queries.process_queries(batch)
+
+
+def test_lazy_results_are_cached_once_read(mock_db_cursor, monkeypatch):
+    graph = CSRGraph.from_edges(*graph_samples["g13"])
+    monkeypatch.setattr(config, "query_engine", "memory")
+    monkeypatch.setattr(config, "result_cache", "memory")
+    monkeypatch.setattr(queries.graph_cache, "get", lambda cur, graph_id: graph)
+    monkeypatch.setattr(queries.graph_cache, "version", lambda graph_id, graph=None: 7)
+    cache = queries.result_cache.ResultCache(1024 * 1024)
+    monkeypatch.setattr(queries, "memory_result_cache", cache)
+
+    query_str = '{"format": "ndjson", "queries": [{"paths": {"start": "a", "end": "c", "limit": 2}}]}'
+
+    lines = ndjson_lines(query_str)
+
+    expected = queries.query_planner.path_finding.find_all_paths(graph, "a", "c")[:2]
+    assert cache.get(None, "g13", 7, ("a", "c", "paths", 2)) == expected
+    assert ndjson_lines(query_str) == lines
+
+
+def test_get_graph_id_from_config(monkeypatch):
+    monkeypatch.setattr(config, "default_graph_id", "g7")
+    monkeypatch.setattr("builtins.open", mock.Mock(side_effect=AssertionError))
+    assert queries.get_graph_id() == "g7"
+
+
+def test_get_graph_id_prefers_config_to_last_ingested(monkeypatch):
+    monkeypatch.setattr(config, "default_graph_id", "g7")
+    monkeypatch.setattr(config, "last_ingested_graph_id", "g13")
+    monkeypatch.setattr("builtins.open", mock.Mock(side_effect=AssertionError))
+    assert queries.get_graph_id() == "g7"
+    monkeypatch.setattr(config, "default_graph_id", "")
+    assert queries.get_graph_id() == "g13"
+
+
+def test_resolve_graph_id(monkeypatch):
+    monkeypatch.setattr(queries, "get_graph_id", lambda: "g13")
+    assert queries.resolve_graph_id({"queries": []}) == "g13"
+    assert queries.resolve_graph_id({"queries": [], "graph_id": "g10"}) == "g10"
+
+
+def test_verify_correct_query_format_graph_id():
+    assert queries.verify_correct_query_format({"queries": [], "graph_id": "g10"}) is True
+    assert queries.verify_correct_query_format({"queries": [], "graph_id": 10}) is False
+
+
+def test_process_queries_named_graphs(mock_db_cursor, monkeypatch):
+    graphs = {"g13": CSRGraph.from_edges(*graph_samples["g13"]), "g10": CSRGraph.from_edges(*graph_samples["g10"])}
+    monkeypatch.setattr(config, "query_engine", "memory")
+    monkeypatch.setattr(queries.graph_cache, "get", lambda cur, graph_id: graphs[graph_id])
+    batch = [{"cheapest": {"start": "a", "end": "c"}}]
+
+    assert queries.process_queries({"queries": batch}) == {("a", "c", "cheapest"): [(["a", "b", "c"], 2.0)]}
+    assert queries.process_queries({"graph_id": "g10", "queries": batch}) == {
+        ("a", "c", "cheapest"): [(["a", "c"], 15.0)]}
@@ -0,0 +1,84 @@
+from unittest import mock
+
+import pytest
+
+from src.query_service import query_planner
+from src.query_service.path_finding import (
+    find_all_paths, find_all_paths_from, find_cheapest_path, find_cheapest_paths_from)
+
+
+def test_find_all_paths_from_matches_single_searches(g13):
+    for start in "abcdez":
+        results = find_all_paths_from(g13, start, "abcdez")
+        assert results == {end: find_all_paths(g13, start, end) for end in "abcdez"}
+
+
+def test_find_cheapest_paths_from_matches_single_searches(g13):
+    for start in "abcdez":
+        results = find_cheapest_paths_from(g13, start, "abcdez")
+        assert results == {end: find_cheapest_path(g13, start, end) for end in "abcdez"}
+
+
+def test_plan_searches():
+    keys = [("a", "c", "paths"), ("a", "e", "cheapest"), ("a", "c", "cheapest"),
+            ("b", "c", "paths"), ("a", "d", "paths"), (None, None, "cycles")]
+    assert query_planner.plan_searches(keys) == {
+        ("paths", "a"): ["c", "d"],
+        ("cheapest", "a"): ["e"],
+        ("paths", "b"): ["c"],
+        ("cycles", None): [None],
+    }
+
+
+def test_answer_batch_one_search_per_start(g13, monkeypatch):
+    find_all = mock.Mock(wraps=find_all_paths_from)
+    find_cheapest = mock.Mock(wraps=find_cheapest_paths_from)
+    find_one_cheapest = mock.Mock(wraps=find_cheapest_path)
+    monkeypatch.setattr(query_planner.path_finding, "find_all_paths_from", find_all)
+    monkeypatch.setattr(query_planner.path_finding, "find_cheapest_paths_from", find_cheapest)
+    monkeypatch.setattr(query_planner.path_finding, "find_cheapest_path", find_one_cheapest)
+    keys = [("a", "c", "paths"), ("a", "e", "cheapest"), ("a", "c", "cheapest"),
+            ("a", "e", "paths"), ("b", "a", "cheapest"), ("a", "b", "cheapest")]
+
+    results = query_planner.answer_batch(g13, keys)
+
+    assert find_all.call_count == 1
+    # The cheapest queries from "a" to "c" and "e" come from the paths search, leaving
+    # one end each from "a" and "b", which get a bidirectional search of their own
+    assert find_cheapest.call_count == 0
+    assert find_one_cheapest.call_args_list == [mock.call(g13, "b", "a"), mock.call(g13, "a", "b")]
+    assert list(results) == keys
+    assert results[("a", "c", "paths")] == find_all_paths(g13, "a", "c")
+    assert results[("a", "e", "paths")] == find_all_paths(g13, "a", "e")
+    assert results[("a", "c", "cheapest")] == results[("a", "c", "paths")]
+    assert results[("a", "b", "cheapest")] == [(["a", "b"], 1.0)]
+    assert results[("b", "a", "cheapest")] == find_cheapest_path(g13, "b", "a")
+
+
+def test_iter_batch_runs_searches_when_first_needed(g13, monkeypatch):
+    find_cheapest = mock.Mock(wraps=find_cheapest_paths_from)
+    find_one_cheapest = mock.Mock(wraps=find_cheapest_path)
+    monkeypatch.setattr(query_planner.path_finding, "find_cheapest_paths_from", find_cheapest)
+    monkeypatch.setattr(query_planner.path_finding, "find_cheapest_path", find_one_cheapest)
+    keys = [("a", "b", "cheapest"), ("b", "c", "cheapest"), ("a", "c", "cheapest")]
+
+    batch = query_planner.iter_batch(g13, keys)
+    assert next(batch) == (("a", "b", "cheapest"), [(["a", "b"], 1.0)])
+    assert (find_cheapest.call_count, find_one_cheapest.call_count) == (1, 0)
+    assert next(batch) == (("b", "c", "cheapest"), [(["b", "c"], 1.0)])
+    assert next(batch) == (("a", "c", "cheapest"), [(["a", "b", "c"], 2.0)])
+    assert (find_cheapest.call_count, find_one_cheapest.call_count) == (1, 1)
+
+
+def test_iter_batch_lazy_and_limited_paths(g13):
+    keys = [("a", "c", "paths"), ("a", "e", "paths"), ("a", "c", "cheapest")]
+
+    batch = query_planner.iter_batch(g13, keys, {("a", "e", "paths"): 1}, lazy=True)
+
+    key, paths = next(batch)
+    assert key == ("a", "c", "paths")
+    assert not isinstance(paths, list)
+    assert list(paths) == find_all_paths(g13, "a", "c")
+    key, paths = next(batch)
+    assert list(paths) == find_all_paths(g13, "a", "e")[:1]
+    assert next(batch) == (("a", "c", "cheapest"), [(["a", "b", "c"], 2.0)])
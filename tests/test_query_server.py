@@ -0,0 +1,127 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+import src.query_service.query_server as query_server
+
+
+def read_request(payload: bytes, max_bytes=None) -> str:
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(payload)
+        reader.feed_eof()
+        return await query_server.read_request(reader, max_bytes)
+    return asyncio.run(read())
+
+
+def test_read_request_until_nul():
+    assert read_request(b'{"queries": []}\0ignored') == '{"queries": []}'
+
+
+def test_read_request_until_eof():
+    assert read_request(b'{"queries": []}') == '{"queries": []}'
+
+
+def test_read_request_max_bytes():
+    assert read_request(b'{"queries": []}\0' + bytes(100), max_bytes=15) == '{"queries": []}'
+    with pytest.raises(query_server.RequestTooLarge):
+        read_request(b'{"queries": [1]}\0', max_bytes=15)
+
+
+@pytest.fixture
+def running_server(monkeypatch):
+    monkeypatch.setattr(query_server, "close_connection_pool", lambda: None)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    server = query_server.QueryServer("127.0.0.1", 0, workers=2)
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+    yield server
+    asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def send(address, payload):
+    with socket.create_connection(address) as sock:
+        sock.sendall(payload)
+        response = b""
+        while chunk := sock.recv(4096):
+            response += chunk
+    return response.decode()
+
+
+def test_query_server_answers_each_request(running_server, monkeypatch):
+    calls = []
+    monkeypatch.setattr(query_server, "iter_response", lambda query_str: calls.append(query_str) or ["answer\n"])
+
+    assert send(running_server.address, b'{"queries": []}\0') == "answer\n"
+    assert send(running_server.address, b'{"queries": [1]}\0') == "answer\n"
+    assert calls == ['{"queries": []}', '{"queries": [1]}']
+
+
+def test_query_server_streams_lines(running_server, monkeypatch):
+    monkeypatch.setattr(query_server, "iter_response", lambda query_str: iter(['{"a": ', '1}\n', '{"b": 2}\n']))
+
+    assert send(running_server.address, b'{"queries": [], "format": "ndjson"}\0') == '{"a": 1}\n{"b": 2}\n'
+
+
+def test_query_server_slow_query_doesnt_block_others(running_server, monkeypatch):
+    release = threading.Event()
+
+    def fake_iter_response(query_str):
+        if query_str == "slow":
+            release.wait(5)
+        yield query_str + "\n"
+
+    monkeypatch.setattr(query_server, "iter_response", fake_iter_response)
+    with socket.create_connection(running_server.address) as slow_client:
+        slow_client.sendall(b"slow\0")
+        assert send(running_server.address, b"quick\0") == "quick\n"
+        release.set()
+        assert slow_client.recv(100) == b"slow\n"
+
+
+def test_query_server_backpressure(running_server, monkeypatch):
+    produced = []
+    closed = threading.Event()
+    chunk = "x" * (1024 * 1024)
+
+    def endless_response(query_str):
+        try:
+            while True:
+                produced.append(1)
+                yield chunk
+        finally:
+            closed.set()
+
+    monkeypatch.setattr(query_server, "iter_response", endless_response)
+    with socket.create_connection(running_server.address) as client:
+        client.sendall(b"big\0")
+        time.sleep(0.5)
+        # A client that isn't reading stops us producing more, once the socket buffers are full
+        first_count = len(produced)
+        time.sleep(0.5)
+        assert len(produced) == first_count < 64
+    # Hanging up closes the response, so the query can give back its connection
+    assert closed.wait(5)
+
+
+def test_query_server_rejects_undecodable_request(running_server, monkeypatch):
+    monkeypatch.setattr(query_server, "iter_response", lambda query_str: ["answer\n"])
+
+    assert send(running_server.address, b'{"queries": "\xff"}\0') == query_server.INVALID_FORMAT_MESSAGE + "\n"
+
+
+def test_query_server_rejects_huge_request(running_server, monkeypatch):
+    monkeypatch.setattr(query_server, "iter_response", lambda query_str: ["answer\n"])
+    running_server.max_request_bytes = 1000
+
+    with socket.create_connection(running_server.address) as sock:
+        sock.sendall(b" " * 2000)  # And no end of request, it would wait forever
+        response = sock.recv(4096).decode()
+    assert response.startswith("Request is too large.")
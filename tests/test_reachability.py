@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+import config
+from sample_data import graph_samples
+from src.query_service import path_finding
+from src.query_service.graph_cache import CSRGraph
+from src.query_service.graph_snapshot import snapshot_path, write_snapshot
+from src.query_service.reachability import (
+    ReachabilityIndex, index_path, load_index, load_indexed_snapshot, write_index)
+
+
+def random_graph(seed, node_count=30, edge_count=45):
+    rng = random.Random(seed)
+    names = [f"n{i}" for i in range(node_count)]
+    edges = [(rng.choice(names), rng.choice(names), 1.0) for _ in range(edge_count)]
+    return CSRGraph.from_edges(names, edges)
+
+
+def reachable_from(graph, start):
+    seen = {start}
+    stack = [start]
+    while stack:
+        for next_node, _ in graph.neighbours(stack.pop()):
+            if next_node not in seen:
+                seen.add(next_node)
+                stack.append(next_node)
+    return seen
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_index_matches_search(seed):
+    graph = random_graph(seed)
+    index = ReachabilityIndex.build(graph)
+    for source in range(len(graph)):
+        reachable = reachable_from(graph, source)
+        assert [index.reaches(source, target) for target in range(len(graph))] == [
+            target in reachable for target in range(len(graph))]
+
+
+def test_index_round_trip(tmp_path):
+    graph = random_graph(1)
+    index = ReachabilityIndex.build(graph, version=4)
+    path = str(tmp_path / "g.reach")
+
+    size = write_index(path, index)
+    loaded = load_index(path)
+
+    assert size == (tmp_path / "g.reach").stat().st_size
+    assert loaded.version == 4
+    assert list(loaded.components) == list(index.components)
+    assert bytes(loaded.labels) == bytes(index.labels)
+
+
+def test_index_too_big():
+    assert ReachabilityIndex.build(random_graph(2, node_count=200, edge_count=10), max_bytes=100) is None
+
+
+def test_load_indexed_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "graph_snapshot_dir", str(tmp_path))
+    monkeypatch.setattr(config, "reachability_index", True)
+    graph = CSRGraph.from_edges(*graph_samples["g10"])
+    path = snapshot_path(str(tmp_path), "g10")
+    write_snapshot(path, "g10", 2, graph)
+
+    assert load_indexed_snapshot("g10", 2).reachability is None
+    write_index(index_path(path), ReachabilityIndex.build(graph, version=1))
+    assert load_indexed_snapshot("g10", 2).reachability is None  # Stale
+    write_index(index_path(path), ReachabilityIndex.build(graph, version=2))
+    indexed = load_indexed_snapshot("g10", 2)
+    a, c = indexed.node_id("a"), indexed.node_id("c")
+    assert indexed.reachability.reaches(a, c) and not indexed.reachability.reaches(c, a)
+
+
+def test_index_prunes_dead_ends(monkeypatch):
+    # "s" leads to "end", and also into a big tangle of nodes which can't reach it
+    names = ["s", "end"] + [f"t{i}" for i in range(8)]
+    edges = [("s", "end", 1.0)] + [("s", "t0", 1.0)] + [
+        (f"t{i}", f"t{j}", 1.0) for i in range(8) for j in range(8) if i != j]
+    graph = CSRGraph.from_edges(names, edges)
+    expected = [(["s", "end"], 1.0)]
+    graph.reachability = ReachabilityIndex.build(graph)
+    expanded = []
+    neighbours = graph.neighbours
+    monkeypatch.setattr(graph, "neighbours", lambda node: expanded.append(node) or neighbours(node))
+
+    assert path_finding.find_all_paths(graph, "s", "end") == expected
+    assert path_finding.find_all_paths_from(graph, "s", ["end", "s"])["end"] == expected
+    assert set(expanded) == {graph.node_id("s")}
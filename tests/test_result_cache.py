@@ -0,0 +1,78 @@
+import json
+from unittest import mock
+
+from src.query_service.result_cache import (
+    DatabaseResultCache, ResultCache, cache_results, estimate_size)
+
+
+def test_get_and_put():
+    cache = ResultCache(10000)
+    assert cache.get(None, "g1", 1, ("a", "b", "paths", None)) is None
+    cache.put(None, "g1", 1, ("a", "b", "paths", None), [(["a", "b"], 1.0)])
+    assert cache.get(None, "g1", 1, ("a", "b", "paths", None)) == [(["a", "b"], 1.0)]
+    assert cache.get(None, "g2", 1, ("a", "b", "paths", None)) is None
+    assert cache.get(None, "g1", 1, ("a", "b", "paths", 5)) is None
+
+
+def test_stale_version_is_dropped():
+    cache = ResultCache(10000)
+    cache.put(None, "g1", 1, ("a", "b", "cheapest", None), [])
+    assert cache.get(None, "g1", 2, ("a", "b", "cheapest", None)) is None
+    assert len(cache) == 0
+    assert cache.size == 0
+
+
+def test_least_recently_used_are_evicted():
+    result = [(["a", "b"], 1.0)]
+    cache = ResultCache(3 * estimate_size(result))
+    for end in "bcd":
+        cache.put(None, "g1", 1, ("a", end, "paths", None), result)
+    cache.get(None, "g1", 1, ("a", "b", "paths", None))
+    cache.put(None, "g1", 1, ("a", "e", "paths", None), result)
+
+    assert cache.get(None, "g1", 1, ("a", "c", "paths", None)) is None
+    assert [end for end in "bde" if cache.get(None, "g1", 1, ("a", end, "paths", None))] == ["b", "d", "e"]
+    assert cache.size <= cache.max_bytes
+
+
+def test_results_bigger_than_the_budget_are_not_kept():
+    cache = ResultCache(100)
+    cache.put(None, "g1", 1, ("a", "b", "paths", None), [(["a"] * 100, 1.0)])
+    assert len(cache) == 0
+
+
+def test_lazy_results_are_stored_once_read():
+    cache = ResultCache(10000)
+    rows = [(["a", "b"], 1.0), (["a", "c", "b"], 2.0)]
+    wrapped = cache_results(cache, None, "g1", 1, ("a", "b", "paths", None), iter(rows))
+
+    assert len(cache) == 0
+    assert list(wrapped) == rows
+    assert cache.get(None, "g1", 1, ("a", "b", "paths", None)) == rows
+
+
+def test_lazy_results_over_budget_are_not_stored():
+    cache = ResultCache(300)
+    rows = [(["a", "b" * 50], 1.0)] * 10
+    assert list(cache_results(cache, None, "g1", 1, ("a", "b", "paths", None), iter(rows))) == rows
+    assert len(cache) == 0
+
+
+def test_database_result_cache():
+    cur = mock.MagicMock()
+    cache = DatabaseResultCache(10000)
+
+    cur.fetchone.return_value = None
+    assert cache.get(cur, "g1", 3, ("a", "b", "paths", None)) is None
+    assert cur.execute.call_args.args[1] == ("g1", '["a", "b", "paths", null]', 3)
+
+    cur.fetchone.return_value = ('[[["a", "b"], 1.0]]',)
+    assert cache.get(cur, "g1", 3, ("a", "b", "paths", None)) == [[["a", "b"], 1.0]]
+
+    cur.reset_mock()
+    cache.put(cur, "g1", 3, ("a", "b", "paths", None), [(["a", "b"], 1.0)])
+    statements = [call.args[0] for call in cur.execute.call_args_list]
+    assert statements[0].startswith("DELETE FROM public.query_results WHERE graph_id = %s AND version <> %s")
+    assert statements[1].startswith("INSERT INTO public.query_results")
+    assert "sum(size) OVER (ORDER BY last_used DESC)" in statements[2]
+    assert json.loads(cur.execute.call_args_list[1].args[1][3]) == [[["a", "b"], 1.0]]
@@ -1,6 +1,10 @@
+import gzip
+import io
+import json
 import xml.etree.ElementTree as ET
 from unittest import mock
 
+import psycopg2
 import pytest
 import responses
 
@@ -8,16 +12,20 @@ import config
 import src.downloader.setup as downloader
 from sample_data import xml_samples
 from src.downloader.setup import extract_graph_data
+from src.downloader.streaming import ChunkReader, decompress_chunks
+from src.query_service.graph_cache import CSRGraph
+from src.query_service.graph_snapshot import load_snapshot, write_snapshot
+from src.query_service.reachability import load_index
 
 
 @pytest.fixture
 def download_graph_ok(monkeypatch):
-    monkeypatch.setattr(downloader, 'download_graph', lambda: xml_samples['valid'])
+    monkeypatch.setattr(downloader, 'fetch_graph', lambda: (xml_samples['valid'], len(xml_samples['valid'])))
 
 
 @pytest.fixture
 def download_graph_fail(monkeypatch):
-    monkeypatch.setattr(downloader, 'download_graph', lambda: None)
+    monkeypatch.setattr(downloader, 'fetch_graph', lambda: (None, 0))
 
 
 @pytest.fixture
@@ -99,6 +107,34 @@ def test_set_up_graph_data_success(
     assert captured.out.strip() == "Graph data successfully inserted."
 
 
+def test_set_up_graph_data_delta_update(
+        download_graph_ok, verify_graph_data_ok, extract_graph_data_ok, monkeypatch, capsys):
+    # With delta ingest, a graph that's already there gets updated instead
+    monkeypatch.setattr(config, 'delta_ingest', True)
+    monkeypatch.setattr(downloader, 'set_graph_id', lambda _: None)
+    monkeypatch.setattr(downloader, 'graph_id_exists', lambda _: True)
+    monkeypatch.setattr(downloader, 'insert_graph_data', mock.MagicMock())
+    monkeypatch.setattr(downloader, 'update_graph_data', lambda _: 0)
+    downloader.set_up_graph_data()
+    assert capsys.readouterr().out.strip() == "Graph data successfully updated."
+    downloader.insert_graph_data.assert_not_called()
+
+
+def test_set_up_graph_data_logs_phases(
+        download_graph_ok, verify_graph_data_ok, extract_graph_data_ok, monkeypatch, capsys):
+    monkeypatch.setattr(config, 'ingest_metrics', True)
+    monkeypatch.setattr(downloader, 'set_graph_id', lambda _: None)
+    monkeypatch.setattr(downloader, 'graph_id_exists', lambda _: False)
+    monkeypatch.setattr(downloader, 'insert_graph_data', lambda _: 2)
+    downloader.set_up_graph_data()
+    lines = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    assert [line.get("phase") for line in lines] == [
+        "download", "verify", "extract", "unique_ids", "graph_id_check", "insert", None]
+    assert lines[0]["bytes"] == len(xml_samples['valid'].encode())
+    assert lines[5]["rows"] == 2
+    assert lines[-1] == {**lines[-1], "event": "ingest", "graph_id": "g0", "ok": True}
+
+
 @responses.activate
 def test_download_graph_ok():
     responses.add(
@@ -110,6 +146,14 @@ def test_download_graph_ok():
     assert result == xml_samples["valid"]
 
 
+@responses.activate
+def test_fetch_graph_counts_body_bytes():
+    body = xml_samples["valid"].replace("<name>", "<name>Gráf ")
+    responses.add(responses.GET, config.graph_data_endpoint, body=body.encode(),
+                  content_type="application/xml; charset=utf-8")
+    assert downloader.fetch_graph() == (body, len(body.encode()))
+
+
 @responses.activate
 def test_download_graph_not_found():
     responses.add(
@@ -178,6 +222,260 @@ def test_verify_unique_node_ids():
 def test_set_graph_id(monkeypatch):
     mock_file = mock.mock_open()
     monkeypatch.setattr("builtins.open", mock_file)
+    monkeypatch.setattr(config, "default_graph_id", "configured")
+    monkeypatch.setattr(config, "last_ingested_graph_id", "")
 
     downloader.set_graph_id("graph_123")
     mock_file().write.assert_called_once_with("graph_123")
+    assert config.last_ingested_graph_id == "graph_123"
+    # GRAPH_ID is left alone
+    assert config.default_graph_id == "configured"
+
+
+@pytest.fixture
+def mock_db_cursor(monkeypatch):
+    cursor = mock.MagicMock()
+    copied = {}
+
+    def copy_expert(sql, stream):
+        copied[sql] = stream.read()
+
+    cursor.copy_expert.side_effect = copy_expert
+    cursor.copied = copied
+    conn = mock.MagicMock()
+    conn.__enter__.return_value.cursor.return_value.__enter__.return_value = cursor
+    monkeypatch.setattr(downloader, 'pooled_connection', lambda: conn)
+    return cursor
+
+
+def test_insert_graph_data_copy(mock_db_cursor, monkeypatch, capsys):
+    monkeypatch.setattr(config, 'insert_method', 'copy')
+    graph_data = ("g0", "Name", [("a", "A name"), ("b", None)], [("e1", "a", "b", 42.0)])
+
+    row_count = downloader.insert_graph_data(graph_data, batch_size=1)
+
+    assert row_count == 3
+    mock_db_cursor.execute.assert_called_once_with(
+        "INSERT INTO public.graphs (graph_id, name) VALUES (%s, %s)", ("g0", "Name"))
+    assert mock_db_cursor.copied == {
+        "COPY public.nodes (node_id, name, graph_id) FROM STDIN": "a\tA name\tg0\nb\t\\N\tg0\n",
+        "COPY public.edges (edge_id, from_node, to_node, cost, graph_id) FROM STDIN": "e1\ta\tb\t42.0\tg0\n",
+    }
+    assert "Inserted 3 rows" in capsys.readouterr().out
+
+
+def test_insert_graph_data_values(mock_db_cursor, monkeypatch):
+    monkeypatch.setattr(config, 'insert_method', 'values')
+    batches = []
+    monkeypatch.setattr(downloader, 'execute_values',
+                        lambda cur, sql, rows, page_size: batches.append((sql, rows)))
+    nodes = [("a", "A"), ("b", "B"), ("c", "C")]
+    graph_data = ("g0", "Name", nodes, [("e1", "a", "b", 1.0)])
+
+    row_count = downloader.insert_graph_data(graph_data, batch_size=2)
+
+    assert row_count == 4
+    assert [len(rows) for _, rows in batches] == [2, 1, 1]
+    assert batches[0][0] == "INSERT INTO public.nodes (node_id, name, graph_id) VALUES %s"
+    assert batches[2][1] == [("e1", "a", "b", 1.0, "g0")]
+
+
+def test_update_graph_data(mock_db_cursor, capsys):
+    # Each upsert returns (inserted, updated), then rowcount is read after each delete
+    mock_db_cursor.fetchone.side_effect = [(1, 2), (3, 0)]
+    type(mock_db_cursor).rowcount = mock.PropertyMock(side_effect=[4, 5])
+    graph_data = ("g0", "Name", [("a", "A name"), ("b", None)], [("e1", "a", "b", 42.0)])
+
+    change_count = downloader.update_graph_data(graph_data, batch_size=1)
+
+    assert change_count == 1 + 2 + 5 + 3 + 4
+    assert mock_db_cursor.copied == {
+        "COPY staged_nodes (node_id, name) FROM STDIN": "a\tA name\nb\t\\N\n",
+        "COPY staged_edges (edge_id, from_node, to_node, cost) FROM STDIN": "e1\ta\tb\t42.0\n",
+    }
+    statements = [" ".join(call.args[0].split()) for call in mock_db_cursor.execute.call_args_list]
+    assert statements[0].startswith("CREATE TEMPORARY TABLE staged_nodes")
+    assert "ON CONFLICT (node_id, graph_id) DO UPDATE" in statements[3]
+    assert statements[4].startswith("DELETE FROM public.edges")
+    assert "ON CONFLICT (edge_id, graph_id) DO UPDATE" in statements[5]
+    assert statements[6].startswith("DELETE FROM public.nodes")
+    assert "nextval('public.graph_version_seq')" in statements[7]
+    assert mock_db_cursor.execute.call_args_list[7].args[1] == ("Name", "g0", True, "Name")
+    out = capsys.readouterr().out
+    assert "nodes 1 inserted, 2 updated, 5 deleted; edges 3 inserted, 0 updated, 4 deleted" in out
+
+
+def test_update_graph_data_unchanged_keeps_version(mock_db_cursor):
+    mock_db_cursor.fetchone.side_effect = [(0, 0), (0, 0)]
+    type(mock_db_cursor).rowcount = mock.PropertyMock(return_value=0)
+
+    assert downloader.update_graph_data(("g0", "Name", [("a", "A")], [])) == 0
+    # The version is only bumped if something changed (or the name did)
+    assert mock_db_cursor.execute.call_args_list[-1].args[1] == ("Name", "g0", False, "Name")
+
+
+def test_save_graph_snapshot(mock_db_cursor, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(config, 'graph_snapshot_dir', str(tmp_path / "snapshots"))
+    monkeypatch.setattr(downloader, 'get_graph_version', lambda cur, graph_id: 5)
+    monkeypatch.setattr(downloader, 'load_graph',
+                        lambda cur, graph_id: CSRGraph.from_edges(["a", "b"], [("a", "b", 1.0)]))
+
+    size = downloader.save_graph_snapshot("g0")
+
+    snapshot = load_snapshot(str(tmp_path / "snapshots" / "g0.graph"))
+    assert size > 0
+    assert (snapshot.graph_id, snapshot.version, list(snapshot.names)) == ("g0", 5, ["a", "b"])
+    assert f"Wrote {size} byte snapshot of graph g0" in capsys.readouterr().out
+
+
+def test_save_graph_snapshot_database_error(mock_db_cursor, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(config, 'graph_snapshot_dir', str(tmp_path))
+
+    def fail(cur, graph_id):
+        raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+    monkeypatch.setattr(downloader, 'get_graph_version', fail)
+
+    assert downloader.save_graph_snapshot("g0") is None
+    assert "Problem writing graph snapshot: server closed the connection" in capsys.readouterr().out
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_save_reachability_index(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(config, 'graph_snapshot_dir', str(tmp_path))
+    graph = CSRGraph.from_edges(["a", "b"], [("a", "b", 1.0)])
+    write_snapshot(str(tmp_path / "g0.graph"), "g0", 5, graph)
+
+    size = downloader.save_reachability_index("g0")
+
+    index = load_index(str(tmp_path / "g0.reach"))
+    assert size == (tmp_path / "g0.reach").stat().st_size
+    assert index.version == 5 and index.reaches(0, 1) and not index.reaches(1, 0)
+    assert f"Wrote {size} byte reachability index of graph g0" in capsys.readouterr().out
+
+    monkeypatch.setattr(config, 'reachability_index_max_bytes', 1)
+    assert downloader.save_reachability_index("g0") is None
+    assert "too many strongly connected components" in capsys.readouterr().out
+
+
+def test_set_up_graph_data_writes_snapshot(
+        download_graph_ok, verify_graph_data_ok, extract_graph_data_ok, monkeypatch, capsys):
+    monkeypatch.setattr(config, 'ingest_metrics', True)
+    monkeypatch.setattr(config, 'graph_snapshot_dir', "snapshots")
+    monkeypatch.setattr(downloader, 'set_graph_id', lambda _: None)
+    monkeypatch.setattr(downloader, 'graph_id_exists', lambda _: False)
+    monkeypatch.setattr(downloader, 'insert_graph_data', lambda _: 2)
+    monkeypatch.setattr(downloader, 'save_graph_snapshot', lambda graph_id: 128)
+    downloader.set_up_graph_data()
+    lines = [json.loads(line) for line in capsys.readouterr().err.splitlines()]
+    assert lines[-2] == {**lines[-2], "phase": "snapshot", "bytes": 128}
+    assert lines[-1]["phases"][-1] == "snapshot"
+
+
+def test_copy_stream_reads_in_chunks():
+    stream = downloader.CopyStream(((str(i),) for i in range(5)), batch_size=2)
+    chunks = []
+    while chunk := stream.read(3):
+        chunks.append(chunk)
+    assert "".join(chunks) == "0\n1\n2\n3\n4\n"
+    assert stream.row_count == 5
+
+
+def test_escape_copy_value():
+    assert downloader.escape_copy_value(None) == "\\N"
+    assert downloader.escape_copy_value("a\tb\nc\\d\re") == "a\\tb\\nc\\\\d\\re"
+    assert downloader.escape_copy_value(1.5) == "1.5"
+
+
+def test_ingest_graph_stream_success(monkeypatch, capsys):
+    inserted = []
+    monkeypatch.setattr(downloader, 'set_graph_id', lambda _: None)
+    monkeypatch.setattr(downloader, 'graph_id_exists', lambda _: False)
+    monkeypatch.setattr(downloader, 'insert_graph_data',
+                        lambda data: inserted.append((data[0], data[1], list(data[2]), list(data[3]))))
+
+    assert downloader.ingest_graph_stream(io.BytesIO(xml_samples["valid"].encode())) is True
+    assert inserted == [("g0", "Name", [("a", "A name")], [("e1", "a", "a", 42.0)])]
+    assert capsys.readouterr().out.strip() == "Graph data successfully inserted."
+
+
+def test_ingest_graph_stream_invalid(monkeypatch, capsys):
+    monkeypatch.setattr(downloader, 'set_graph_id', lambda _: None)
+    monkeypatch.setattr(downloader, 'graph_id_exists', lambda _: False)
+    monkeypatch.setattr(downloader, 'insert_graph_data',
+                        lambda data: (list(data[2]), list(data[3])))
+
+    assert downloader.ingest_graph_stream(io.BytesIO(xml_samples["invalid multi to"].encode())) is False
+    assert capsys.readouterr().out.strip().endswith("Problem validating graph data.")
+
+
+def test_ingest_graph_stream_corrupt_gzip(monkeypatch, capsys):
+    monkeypatch.setattr(downloader, 'set_graph_id', lambda _: None)
+    monkeypatch.setattr(downloader, 'graph_id_exists', lambda _: False)
+    monkeypatch.setattr(downloader, 'insert_graph_data',
+                        lambda data: (list(data[2]), list(data[3])))
+    compressed = gzip.compress(xml_samples["valid"].encode())
+
+    corrupt = compressed[:10] + b"garbage" + compressed[17:]
+
+    assert downloader.ingest_graph_stream(ChunkReader(decompress_chunks([corrupt]))) is False
+    assert capsys.readouterr().out.strip().endswith("Problem validating graph data.")
+
+
+def test_ingest_graph_stream_graph_id_exists(monkeypatch, capsys):
+    monkeypatch.setattr(downloader, 'set_graph_id', lambda _: None)
+    monkeypatch.setattr(downloader, 'graph_id_exists', lambda _: True)
+
+    assert downloader.ingest_graph_stream(io.BytesIO(xml_samples["valid"].encode())) is False
+    assert capsys.readouterr().out.strip() == "Graph ID already exists."
+
+
+def test_ingest_graph_stream_delta_update(monkeypatch, capsys):
+    updated = []
+    monkeypatch.setattr(config, 'delta_ingest', True)
+    monkeypatch.setattr(downloader, 'set_graph_id', lambda _: None)
+    monkeypatch.setattr(downloader, 'graph_id_exists', lambda _: True)
+    monkeypatch.setattr(downloader, 'update_graph_data',
+                        lambda data: updated.append((data[0], list(data[2]), list(data[3]))))
+
+    assert downloader.ingest_graph_stream(io.BytesIO(xml_samples["valid"].encode())) is True
+    assert updated == [("g0", [("a", "A name")], [("e1", "a", "a", 42.0)])]
+    assert capsys.readouterr().out.strip() == "Graph data successfully updated."
+
+
+@responses.activate
+def test_open_graph_stream_ok():
+    responses.add(
+        responses.GET,
+        config.graph_data_endpoint,
+        body=gzip.compress(xml_samples["valid"].encode()),
+    )
+    with downloader.open_graph_stream(chunk_size=16) as stream:
+        assert stream.read() == xml_samples["valid"].encode()
+
+
+@responses.activate
+def test_open_graph_stream_not_found():
+    responses.add(
+        responses.GET,
+        config.graph_data_endpoint,
+        status=404,
+    )
+    assert downloader.open_graph_stream() is None
+
+
+def test_set_up_graph_data_streaming(monkeypatch, capsys):
+    monkeypatch.setattr(config, 'stream_ingest', True)
+    monkeypatch.setattr(downloader, 'open_graph_stream',
+                        lambda: ChunkReader([xml_samples["valid"].encode()]))
+    ingested = []
+    monkeypatch.setattr(downloader, 'ingest_graph_stream', lambda stream, metrics=None: ingested.append(stream.read()))
+    downloader.set_up_graph_data()
+    assert ingested == [xml_samples["valid"].encode()]
+
+
+def test_set_up_graph_data_streaming_problem_downloading(monkeypatch, capsys):
+    monkeypatch.setattr(config, 'stream_ingest', True)
+    monkeypatch.setattr(downloader, 'open_graph_stream', lambda: None)
+    downloader.set_up_graph_data()
+    assert capsys.readouterr().out.strip() == "Problem downloading graph data."
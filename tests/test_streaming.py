@@ -0,0 +1,157 @@
+import gzip
+import io
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from sample_data import xml_samples
+from src.downloader.setup import extract_graph_data
+from src.downloader.streaming import ChunkReader, GraphDataError, GraphStream, decompress_chunks, parse_edge_cost
+
+
+def stream_all(xml_string):
+    graph = GraphStream(io.BytesIO(xml_string.encode()))
+    nodes = list(graph.nodes())
+    edges = list(graph.edges())
+    return graph.graph_id, graph.graph_name, nodes, edges
+
+
+@pytest.mark.parametrize("name", xml_samples.keys())
+def test_graph_stream_matches_verify_and_extract(name):
+    if "invalid" in name:
+        with pytest.raises(GraphDataError):
+            stream_all(xml_samples[name])
+    else:
+        expected = extract_graph_data(ET.fromstring(xml_samples[name]))
+        assert stream_all(xml_samples[name]) == expected
+
+
+def test_graph_stream_multiple_nodes_and_edges():
+    xml_string = """
+        <graph><id>g1</id><name>Two</name>
+        <nodes>
+            <node><id>a</id><name>A</name></node>
+            <node><id>b</id><name>B</name></node>
+        </nodes>
+        <edges>
+            <node><id>e1</id><from>a</from><to>b</to><cost>1.5</cost></node>
+            <node><id>e2</id><from>b</from><to>a</to></node>
+        </edges>
+        </graph>"""
+    assert stream_all(xml_string) == (
+        "g1", "Two", [("a", "A"), ("b", "B")], [("e1", "a", "b", 1.5), ("e2", "b", "a", 0.0)])
+
+
+def test_graph_stream_duplicate_edge_id():
+    xml_string = """
+        <graph><id>g1</id><name>Dup</name>
+        <nodes><node><id>a</id><name>A</name></node></nodes>
+        <edges>
+            <node><id>e1</id><from>a</from><to>a</to></node>
+            <node><id>e1</id><from>a</from><to>a</to></node>
+        </edges>
+        </graph>"""
+    with pytest.raises(GraphDataError, match="Edge ID is not unique"):
+        stream_all(xml_string)
+
+
+def test_graph_stream_header_must_precede_nodes():
+    xml_string = """
+        <graph><name>Late</name>
+        <nodes><node><id>a</id><name>A</name></node></nodes>
+        <id>g1</id>
+        <edges></edges>
+        </graph>"""
+    with pytest.raises(GraphDataError, match="Expected one 'id' element"):
+        stream_all(xml_string)
+
+
+def test_graph_stream_is_lazy():
+    xml_string = """
+        <graph><id>g1</id><name>Lazy</name>
+        <nodes><node><id>a</id><name>A</name></node></nodes>
+        <edges><node><id>e1</id><from>a</from><to>nowhere</to></node></edges>
+        </graph>"""
+    graph = GraphStream(io.BytesIO(xml_string.encode()))
+    assert list(graph.nodes()) == [("a", "A")]
+    with pytest.raises(GraphDataError, match="'to' node ID not found"):
+        list(graph.edges())
+
+
+@pytest.mark.parametrize("cost_str, expected", [("42", 42.0), ("", 0.0), (None, 0.0), ("-1", 0.0), ("x", 0.0)])
+def test_parse_edge_cost(cost_str, expected):
+    assert parse_edge_cost(cost_str) == expected
+
+
+def test_chunk_reader_reads_across_chunks():
+    reader = ChunkReader([b"ab", b"", b"cde", b"f"])
+    assert reader.read(3) == b"abc"
+    assert reader.read(-1) == b"def"
+    assert reader.read(3) == b""
+    assert reader.bytes_read == 6
+
+
+def test_chunk_reader_close_calls_back_once():
+    closed = []
+    with ChunkReader([], on_close=lambda: closed.append(True)) as reader:
+        reader.close()
+    assert closed == [True]
+
+
+def split_into_chunks(data, size=7):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_decompress_chunks_plain_passthrough():
+    data = xml_samples["valid"].encode()
+    assert b"".join(decompress_chunks(split_into_chunks(data))) == data
+
+
+def test_decompress_chunks_gzip():
+    data = xml_samples["valid"].encode()
+    assert b"".join(decompress_chunks(split_into_chunks(gzip.compress(data), size=1))) == data
+
+
+def test_decompress_chunks_zstd():
+    zstandard = pytest.importorskip("zstandard")
+    data = xml_samples["valid"].encode()
+    compressed = zstandard.ZstdCompressor().compress(data)
+    assert b"".join(decompress_chunks(split_into_chunks(compressed))) == data
+
+
+def test_decompress_chunks_concatenated_members():
+    data = xml_samples["valid"].encode()
+    compressed = gzip.compress(data[:40]) + gzip.compress(data[40:])
+    assert b"".join(decompress_chunks(split_into_chunks(compressed, size=5))) == data
+    assert b"".join(decompress_chunks([compressed])) == data
+
+
+def test_decompress_chunks_concatenated_zstd_frames():
+    zstandard = pytest.importorskip("zstandard")
+    data = xml_samples["valid"].encode()
+    compressor = zstandard.ZstdCompressor()
+    compressed = compressor.compress(data[:40]) + compressor.compress(data[40:])
+    assert b"".join(decompress_chunks(split_into_chunks(compressed))) == data
+
+
+@pytest.mark.parametrize("damage", [lambda data: data[:-12], lambda data: data[:10] + b"garbage" + data[17:]])
+def test_decompress_chunks_bad_gzip(damage):
+    compressed = damage(gzip.compress(xml_samples["valid"].encode()))
+    with pytest.raises(GraphDataError):
+        b"".join(decompress_chunks(split_into_chunks(compressed)))
+
+
+def test_decompress_chunks_bad_zstd():
+    zstandard = pytest.importorskip("zstandard")
+    compressed = zstandard.ZstdCompressor().compress(xml_samples["valid"].encode())
+    with pytest.raises(GraphDataError):
+        b"".join(decompress_chunks(split_into_chunks(compressed[:-6])))
+    with pytest.raises(GraphDataError):
+        b"".join(decompress_chunks([compressed[:8] + b"garbage" + compressed[15:]]))
+
+
+def test_graph_stream_from_gzip_chunks():
+    compressed = gzip.compress(xml_samples["valid"].encode())
+    graph = GraphStream(ChunkReader(decompress_chunks(split_into_chunks(compressed))))
+    assert (graph.graph_id, list(graph.nodes()), list(graph.edges())) == (
+        "g0", [("a", "A name")], [("e1", "a", "a", 42.0)])